@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Reports which patches in PATCHES.json apply to an llvm-project checkout,
+and which of them conflict with each other."""
+
+import argparse
+import logging
+from pathlib import Path
+import sys
+
+import context
+from llvm_android import android_version, patch_analysis, paths
+
+
+def parse_args():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--source-dir', type=Path, default=paths.TOOLCHAIN_LLVM_PATH,
+                        help='llvm-project git checkout (default: %(default)s)')
+    parser.add_argument('--patch-json', type=Path,
+                        default=paths.SCRIPTS_DIR / 'patches' / 'PATCHES.json',
+                        help='PATCHES.json (default: %(default)s)')
+    parser.add_argument('--svn-version', type=int,
+                        help='Only check patches for this svn revision (default: the current one)')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of concurrent checks')
+    return parser.parse_args()
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    svn_version = args.svn_version or int(android_version.get_svn_revision_number())
+    analysis = patch_analysis.analyze(args.source_dir, args.patch_json, svn_version, args.jobs)
+    print(analysis.report())
+    failed = any(r.status == patch_analysis.Status.FAILS for r in analysis.results)
+    return 1 if failed or analysis.conflicts else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Shows build step times across builds and flags regressions."""
+
+import argparse
+from datetime import timedelta
+import json
+from pathlib import Path
+import sys
+
+import context
+from llvm_android import build_history, paths
+
+
+def parse_args():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--db', type=Path, default=paths.BUILD_HISTORY_DB,
+        help='Build history database (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add = subparsers.add_parser('add', help='Add the build_info.json of a build')
+    add.add_argument('build_info', type=Path, nargs='+')
+
+    trend = subparsers.add_parser('trend', help='Show the times of a step across builds')
+    trend.add_argument('step')
+    trend.add_argument('--limit', type=int, default=20)
+
+    regressions = subparsers.add_parser(
+        'regressions', help='Show steps that regressed against the rolling median')
+    regressions.add_argument('--build', type=int, help='Build id (default: the last build)')
+    regressions.add_argument('--threshold', type=float, default=10,
+                             help='Regression threshold in percent (default: %(default)s)')
+    regressions.add_argument('--window', type=int, default=10,
+                             help='Number of earlier builds in the median (default: %(default)s)')
+    regressions.add_argument('--min-seconds', type=float, default=60,
+                             help='Ignore steps shorter than this (default: %(default)s)')
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    pretty_print = lambda t: str(timedelta(seconds=int(t)))
+    history = build_history.BuildHistory(args.db)
+
+    if args.command == 'add':
+        for build_info in args.build_info:
+            build_id = history.add_build(json.loads(build_info.read_text()))
+            print(f'Added {build_info} as build {build_id}')
+        return 0
+
+    if args.command == 'trend':
+        for timestamp, build_name, svn_revision, cores, options, seconds in \
+                history.trend(args.step, args.limit):
+            print(f'{timestamp} {pretty_print(seconds)} {build_name} {svn_revision} '
+                  f'cores={cores} {options}')
+        return 0
+
+    build_id = args.build or history.last_build()
+    if build_id is None:
+        print('No builds recorded')
+        return 0
+    regressions = history.regressions(build_id, args.threshold, args.window, args.min_seconds)
+    for regression in regressions:
+        print(f'{regression.step}: {pretty_print(regression.seconds)} vs median '
+              f'{pretty_print(regression.median)} (+{regression.percent:.0f}%)')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
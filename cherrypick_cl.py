@@ -18,6 +18,7 @@
 from __future__ import annotations
 import argparse
 import collections
+import concurrent.futures
 import copy
 import dataclasses
 from dataclasses import dataclass
@@ -27,14 +28,17 @@ import math
 import os
 from pathlib import Path
 import re
+import subprocess
 import sys
 from typing import Any, Dict, List, Optional, Tuple
 import urllib.request
 
 import context
 from llvm_android.android_version import get_svn_revision_number
-from merge_from_upstream import fetch_upstream, sha_to_revision
+from merge_from_upstream import (revision_index, sha_to_revision, shas_to_revisions,
+                                 update_revision_index)
 from llvm_android import paths, source_manager
+from llvm_android.patch_index import PatchIndex
 from llvm_android.utils import check_call, check_output
 
 
@@ -175,45 +179,61 @@ class PatchList(list):
         return True
 
 
-def create_patches_for_sha_list(sha_list: List[str], start_version: int, patch_list: PatchList
+def create_patches_for_sha_list(sha_list: List[str], start_version: int, patch_index: PatchIndex
                                 ) -> PatchList:
     """ generate upstream cherry-pick patch files """
     upstream_dir = paths.TOOLCHAIN_LLVM_PATH
-    fetch_upstream()
+    # Commits that are in the local repo and known to the revision index were
+    # fetched before.  Only fetch if some SHA is not.
+    full_shas = [local_full_sha(upstream_dir, sha) for sha in sha_list]
+    if any(sha is None or revision_index().revision(sha) is None for sha in full_shas):
+        update_revision_index()
+        full_shas = [get_full_sha(upstream_dir, sha) for sha in sha_list]
+    sha_list = full_shas
+    end_versions = shas_to_revisions(sha_list)
+
+    # Versions depend on earlier picks of the same SHA, so assign them in order.
     result = PatchList()
+    picks: List[Tuple[str, PatchItem]] = []
     for sha in sha_list:
-        if len(sha) < 40:
-            sha = get_full_sha(upstream_dir, sha)
-        version = find_version(sha, patch_list, start_version)
+        version = find_version(sha, patch_index, start_version)
         version_name = '' if version == 1 else f'-v{version}'
         rel_patch_path = f'cherry/{sha}' + version_name + '.patch'
-        file_path = paths.SCRIPTS_DIR / 'patches' / rel_patch_path
-        with open(file_path, 'w') as fh:
-            check_call(f'git format-patch -1 {sha} --stdout',
-                       stdout=fh, shell=True, cwd=upstream_dir)
-
-        commit_subject = check_output(
-            f'git log -n1 --format=%s {sha}', shell=True, cwd=upstream_dir)
         info: Optional[List[str]] = []
-        title = '[UPSTREAM] ' + commit_subject.strip()
-        end_version = sha_to_revision(sha)
-        metadata = {'info': info, 'title': title}
+        metadata = {'info': info, 'title': ''}
         platforms = ['android']
         version_range: Dict[str, Optional[int]] = {
             'from': start_version,
-            'until': end_version,
+            'until': end_versions[sha],
         }
-        result.append(PatchItem(metadata, platforms, rel_patch_path, version_range))
+        patch = PatchItem(metadata, platforms, rel_patch_path, version_range)
+        # A SHA may be picked again later in the same batch.
+        patch_index.add(patch)
+        picks.append((sha, patch))
+        result.append(patch)
+
+    def write_patch(pick: Tuple[str, PatchItem]) -> None:
+        sha, patch = pick
+        file_path = paths.SCRIPTS_DIR / 'patches' / patch.rel_patch_path
+        with open(file_path, 'w') as fh:
+            check_call(['git', 'format-patch', '-1', sha, '--stdout'],
+                       stdout=fh, cwd=upstream_dir)
+        commit_subject = check_output(
+            ['git', 'log', '-n1', '--format=%s', sha], cwd=upstream_dir)
+        patch.metadata['title'] = '[UPSTREAM] ' + commit_subject.strip()
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        list(executor.map(write_patch, picks))
     return result
 
 
 def create_patch_for_sha_with_patch_file(patch_file: Path, sha: str, start_version: int,
-                                         patch_list: PatchList) -> PatchList:
+                                         patch_index: PatchIndex) -> PatchList:
     """ add patch files for sha"""
     upstream_dir = paths.TOOLCHAIN_LLVM_PATH
     result = []
     assert len(sha) >= 40, f'the length of {sha} is {len(sha)} and it is shorter than 40'
-    version = find_version(sha, patch_list, start_version)
+    version = find_version(sha, patch_index, start_version)
     version_name = '' if version == 1 else f'-v{version}'
     rel_patch_path = f'cherry/{sha}' + version_name + '.patch'
     file_path = paths.SCRIPTS_DIR / 'patches' / rel_patch_path
@@ -240,6 +260,13 @@ def get_full_sha(upstream_dir: Path, short_sha: str) -> str:
     return check_output(['git', 'rev-parse', short_sha], cwd=upstream_dir).strip()
 
 
+def local_full_sha(upstream_dir: Path, sha: str) -> Optional[str]:
+    """Expands sha to a full commit SHA, None if the local repo doesn't have it."""
+    result = subprocess.run(['git', 'rev-parse', '--verify', '--quiet', f'{sha}^{{commit}}'],
+                            cwd=upstream_dir, stdout=subprocess.PIPE, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
 def create_cl(new_patches: PatchList, reason: str, bug: Optional[str], cherry: bool):
     file_list = [
         str(paths.SCRIPTS_DIR / 'patches' / p.rel_patch_path) for p in new_patches
@@ -325,28 +352,14 @@ def create_patch_for_pr(pr: str, start_version: int) -> PatchList:
     return result
 
 
-def find_version(sha, patch_list, start_version) -> int:
+def find_version(sha, patch_index: PatchIndex, start_version) -> int:
     """ Return the next version for the given SHA and update end_revision if needed"""
-    target = f'cherry/{sha}'
-    last_idx = -1
-    version = 1
-    name = ''
-
-    # Find the latest version
-    for i, item in enumerate(patch_list):
-        if item.rel_patch_path.startswith(target):
-            last_idx = i
-            name = item.rel_patch_path.removesuffix('.patch')
+    latest = patch_index.latest(sha)
 
     # If this patch is not new, update the end_revision for Vn
-    if last_idx != -1:
-        patch_list[last_idx].version_range['until'] = start_version
-        if name == target:
-            return 2
-        prefix = target + f'-v'
-        version = int(name.removeprefix(prefix)) + 1
-
-    return version
+    if latest:
+        patch_index.set_end_version(latest, start_version)
+    return patch_index.next_version(sha)
 
 
 def main() -> bool:
@@ -354,6 +367,7 @@ def main() -> bool:
     level = logging.DEBUG if args.verbose else logging.INFO
     logging.basicConfig(level=level)
     patch_list = PatchList.load_from_file()
+    patch_index = PatchIndex(patch_list)
 
     assert not (bool(args.sha) and bool(args.pr)), (
         'Only one of cherry-pick or patch supported.'
@@ -368,9 +382,9 @@ def main() -> bool:
             assert len(
                 args.sha) == 1,  f'error: --patch-file only requires 1 sha, but the size of sha list is {len(args.sha)}'
             new_patches = create_patch_for_sha_with_patch_file(
-                args.patch_file, args.sha[0], start_version, patch_list)
+                args.patch_file, args.sha[0], start_version, patch_index)
         else:
-            new_patches = create_patches_for_sha_list(args.sha, start_version, patch_list)
+            new_patches = create_patches_for_sha_list(args.sha, start_version, patch_index)
         patch_list.extend(new_patches)
 
     patch_list.sort()
@@ -387,11 +401,8 @@ def main() -> bool:
         return True
 
     if not args.no_verify_merge:
-        print('Verifying merge...')
-        print('Verifying merge with git am ...')
-        source_manager.setup_sources(git_am=True)
-        print('Verifying merge with patch ...')
-        source_manager.setup_sources()
+        print('Verifying merge with git am and with patch ...')
+        source_manager.verify_patches()
     if not args.no_create_cl:
         cherry = True if args.sha else False
         create_cl(new_patches, args.reason, args.bug, cherry)
@@ -17,6 +17,8 @@
 # pylint: disable=not-callable, line-too-long, no-else-return
 
 import argparse
+import concurrent.futures
+import contextvars
 import glob
 import logging
 from pathlib import Path
@@ -24,14 +26,14 @@ import os
 import shutil
 import sys
 import textwrap
-from typing import List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
 import re
 
 import context
 
 from llvm_android.base_builders import Builder, LLVMBuilder
 from llvm_android.builder_registry import BuilderRegistry
-from llvm_android import (android_version, builders, build_info, configs, hosts, paths, source_manager, toolchain_errors, timer, toolchains, utils, win_sdk)
+from llvm_android import (android_version, bolt, builders, build_cache, build_history, build_info, configs, fingerprint, hosts, jobserver, journal, ninja_log, package_manifest, paths, profile_cache, source_manager, toolchain_errors, timer, toolchains, utils, win_sdk)
 
 def logger():
     """Returns the module level logger."""
@@ -57,7 +59,7 @@ def extract_pgo_profile(args: argparse.Namespace) -> Path:
             return pgo_profdata_path
 
         else:
-            utils.extract_tarball(paths.OUT_DIR, pgo_profdata_path)
+            profile_cache.extract_profile(pgo_profdata_path, paths.OUT_DIR)
             profdata_file = paths.OUT_DIR / paths.pgo_profdata_filename()
             if not profdata_file.exists():
                 raise RuntimeError(f'{profdata_file} does not exist')
@@ -67,19 +69,24 @@ def extract_pgo_profile(args: argparse.Namespace) -> Path:
         return None
 
 
-def extract_bolt_profile(args: argparse.Namespace) -> Path:
+def extract_bolt_profile(args: argparse.Namespace) -> Dict[str, Path]:
+    """Returns the BOLT profile of each binary in the profile tarball, by name."""
     if args.bolt:
         bolt_fdata_tar = paths.bolt_fdata_tar()
         if not bolt_fdata_tar:
             raise RuntimeError(f'{bolt_fdata_tar} does not exist')
-        utils.extract_tarball(paths.OUT_DIR, bolt_fdata_tar)
-        clang_bolt_fdata_file = paths.OUT_DIR / 'clang.fdata'
-        if not clang_bolt_fdata_file.exists():
-            raise RuntimeError(f'{clang_bolt_fdata_file} does not exist')
-        return clang_bolt_fdata_file
+        # A directory of its own, so that profiles of an earlier tarball don't linger.
+        bolt_fdata_dir = paths.OUT_DIR / 'bolt-fdata'
+        shutil.rmtree(bolt_fdata_dir, ignore_errors=True)
+        bolt_fdata_dir.mkdir(parents=True)
+        profile_cache.extract_profile(bolt_fdata_tar, bolt_fdata_dir)
+        bolt_fdata = {f.stem: f for f in sorted(bolt_fdata_dir.glob('*.fdata'))}
+        if 'clang' not in bolt_fdata:
+            raise RuntimeError(f'{bolt_fdata_dir / "clang.fdata"} does not exist')
+        return bolt_fdata
 
     else:
-        return None
+        return {}
 
 
 def build_llvm_for_windows(enable_assertions: bool,
@@ -116,14 +123,10 @@ def build_llvm_for_windows(enable_assertions: bool,
 
     if full_build:
         libzstd_builder = builders.ZstdBuilder(config_list)
-        libzstd_builder.build()
         win_builder.libzstd = libzstd_builder
 
         libxml2_builder = builders.LibXml2Builder(config_list)
-        libxml2_builder.build()
         win_builder.libxml2 = libxml2_builder
-        for lib in libxml2_builder.install_libraries:
-            lldb_bins.add(lib.name)
 
         win_builder.build_lldb = build_lldb
         if build_lldb:
@@ -132,7 +135,6 @@ def build_llvm_for_windows(enable_assertions: bool,
             win_builder.swig_executable = swig_builder.install_dir / 'bin' / 'swig'
 
             xz_builder = builders.XzBuilder(config_list)
-            xz_builder.build()
             win_builder.liblzma = xz_builder
 
             lldb_bins.add('liblldb.dll')
@@ -141,7 +143,10 @@ def build_llvm_for_windows(enable_assertions: bool,
         win_builder.svn_revision = android_version.get_svn_revision()
         win_builder.enable_assertions = enable_assertions
         win_builder.lto = enable_lto
-        win_builder.build()
+        # The libraries are independent of each other, build them concurrently.
+        BuilderRegistry.build_graph(win_builder.dependencies + [win_builder])
+        for lib in libxml2_builder.install_libraries:
+            lldb_bins.add(lib.name)
 
     if build_simpleperf_readelf:
         libsimpleperf_readelf_builder = builders.LibSimpleperfReadElfBuilder(config_list)
@@ -315,56 +320,42 @@ def install_winpthreads(bin_dir: Path, lib_dir: Path) -> None:
     shutil.copy2(lib_path, bin_dir / lib_name)
 
 
-def remove_static_libraries(static_lib_dir, necessary_libs=None):
-    if not necessary_libs:
-        necessary_libs = {}
-    if os.path.isdir(static_lib_dir):
-        lib_files = os.listdir(static_lib_dir)
-        for lib_file in lib_files:
-            if lib_file.endswith('.a') and lib_file not in necessary_libs:
-                static_library = os.path.join(static_lib_dir, lib_file)
-                os.remove(static_library)
-
-
-def bolt_optimize(toolchain_builder: LLVMBuilder, clang_fdata: Path):
-    """ Optimize using llvm-bolt. """
+def bolt_optimize(toolchain_builder: LLVMBuilder, bolt_fdata: Dict[str, Path]):
+    """ Optimize the binaries that have a profile in bolt_fdata using llvm-bolt. """
     major_version = toolchain_builder.installed_toolchain.version.major_version()
     bin_dir = toolchain_builder.install_dir / 'bin'
-    llvm_bolt_bin = bin_dir / 'llvm-bolt'
-
-    clang_bin = bin_dir / ('clang-' + major_version)
-    clang_bin_orig = bin_dir / ('clang-' + major_version + '.orig')
-    shutil.move(clang_bin, clang_bin_orig)
-    args = [
-        llvm_bolt_bin, '-data=' + str(clang_fdata), '-o', clang_bin,
-        '-reorder-blocks=ext-tsp', '-reorder-functions=cdsort',
-        '-split-functions', '-split-all-cold', '-dyno-stats',
-        '-icf=1', '--use-gnu-stack', clang_bin_orig
-    ]
-    utils.check_call(args)
-    os.remove(clang_bin_orig)
+    jobs = []
+    for name, binary in bolt.binaries(bin_dir, major_version).items():
+        if name not in bolt_fdata:
+            continue
+        args = [
+            '-data=' + str(bolt_fdata[name]),
+            '-reorder-blocks=ext-tsp', '-reorder-functions=cdsort',
+            '-split-functions', '-split-all-cold', '-dyno-stats',
+            '-icf=1', '--use-gnu-stack',
+        ]
+        jobs.append(bolt.BoltJob(name, binary, args))
+    bolt.run(bin_dir / 'llvm-bolt', jobs, 'bolt_optimize')
 
 
 def bolt_instrument(toolchain_builder: LLVMBuilder):
-    """ Instrument binary using llvm-bolt """
+    """ Instrument binaries using llvm-bolt """
     major_version = toolchain_builder.installed_toolchain.version.major_version()
     bin_dir = toolchain_builder.install_dir / 'bin'
-    llvm_bolt_bin = bin_dir / 'llvm-bolt'
-
-    clang_bin = bin_dir / ('clang-' + major_version)
-    clang_bin_orig = bin_dir / ('clang-' + major_version + '.orig')
-    clang_afdo_path = paths.OUT_DIR / 'bolt_collection' / 'clang' / 'clang'
-    shutil.move(clang_bin, clang_bin_orig)
-    args = [
-        llvm_bolt_bin, '-instrument', '--instrumentation-file=' + str(clang_afdo_path),
-        '--instrumentation-file-append-pid', '-o', clang_bin,
-        clang_bin_orig
-    ]
-    utils.check_call(args)
-
-    # Need to create the profile output directory for BOLT.
-    # TODO: Let BOLT instrumented library to create it on itself.
-    os.makedirs(clang_afdo_path, exist_ok=True)
+    jobs = []
+    for name, binary in bolt.binaries(bin_dir, major_version).items():
+        if not binary.exists():
+            continue
+        afdo_path = paths.OUT_DIR / 'bolt_collection' / name / name
+        args = [
+            '-instrument', '--instrumentation-file=' + str(afdo_path),
+            '--instrumentation-file-append-pid',
+        ]
+        jobs.append(bolt.BoltJob(name, binary, args, keep_original=True))
+        # Need to create the profile output directory for BOLT.
+        # TODO: Let BOLT instrumented library to create it on itself.
+        os.makedirs(afdo_path, exist_ok=True)
+    bolt.run(bin_dir / 'llvm-bolt', jobs, 'bolt_instrument')
 
 
 def verify_symlink_exists(link_path: Path, target: Path):
@@ -381,9 +372,39 @@ def verify_file_exists(lib_dir: Path, name: str):
         raise RuntimeError(f'Did not find {name} in {lib_dir}')
 
 
+def strip_binaries(binaries: List[Tuple[Path, List[str]]], package_name: str) -> None:
+    """Strips (binary, extra strip flags) pairs concurrently.
+
+    Each strip takes a jobserver slot and is timed in build_times.txt.
+    """
+    if not binaries:
+        return
+    strip_cmd = Builder.toolchain.strip
+
+    def strip_binary(binary: Path, flags: List[str]) -> None:
+        with jobserver.job_slot('strip'), timer.Timer(f'strip {package_name}/{binary.name}'):
+            utils.check_call([strip_cmd, *flags, binary])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(binaries), os.cpu_count()),
+                                               thread_name_prefix='strip') as executor:
+        futures = [executor.submit(contextvars.copy_context().run, strip_binary, binary, flags)
+                   for binary, flags in binaries]
+    for future in futures:
+        future.result()
+
+
+def package_toolchain_step(toolchain_builder: LLVMBuilder, **kwargs):
+    """Runs package_toolchain as a journaled build step."""
+    variant = 'builders' if kwargs.get('builders_package') else 'release'
+    journal.run_step(f'package_{toolchain_builder.name}_{variant}',
+                     lambda: [toolchain_builder.build_fingerprint, kwargs],
+                     package_toolchain, toolchain_builder, **kwargs)
+
+
 def package_toolchain(toolchain_builder: LLVMBuilder,
                       necessary_bin_files: Optional[Set[str]]=None,
-                      strip=True, with_runtimes=True, create_tar=True, llvm_next=False, builders_package=False):
+                      strip=True, with_runtimes=True, create_tar=True, llvm_next=False, builders_package=False,
+                      zstd=False):
     build_dir = toolchain_builder.install_dir
     host_config = toolchain_builder.config_list[0]
     host = host_config.target_os
@@ -400,113 +421,29 @@ def package_toolchain(toolchain_builder: LLVMBuilder,
     if install_host_dir.exists():
         shutil.rmtree(install_host_dir)
 
-    # First copy over the entire set of output objects.
-    shutil.copytree(build_dir, install_dir, symlinks=True)
-
-    ext = '.exe' if host.is_windows else ''
-    script_ext = '.cmd' if host.is_windows else '.sh'
-    shlib_ext = '.dll' if host.is_windows else '.so' if host.is_linux else '.dylib'
-
-    if not necessary_bin_files:
-        necessary_bin_files = set()
-
-    # Next, we remove unnecessary binaries.
-    necessary_bin_files |= {
-        'clang' + ext,
-        'clang++' + ext,
-        'clang-' + version.major_version() + ext,
-        'clang-check' + ext,
-        'clang-cl' + ext,
-        'clang-format' + ext,
-        'clang-scan-deps' + ext,
-        'clang-tidy' + ext,
-        'clangd' + ext,
-        'dsymutil' + ext,
-        'git-clang-format',  # No extension here
-        'ld.lld' + ext,
-        'ld64.lld' + ext,
-        'lld' + ext,
-        'lld-link' + ext,
-        'llvm-addr2line' + ext,
-        'llvm-ar' + ext,
-        'llvm-as' + ext,
-        'llvm-bolt' + ext,
-        'llvm-cfi-verify' + ext,
-        'llvm-config' + ext,
-        'llvm-cov' + ext,
-        'llvm-cxxfilt' + ext,
-        'llvm-dis' + ext,
-        'llvm-dlltool' + ext,
-        'llvm-dwarfdump' + ext,
-        'llvm-dwp' + ext,
-        'llvm-ifs' + ext,
-        'llvm-lib' + ext,
-        'llvm-link' + ext,
-        'llvm-lipo' + ext,
-        'llvm-modextract' + ext,
-        'llvm-ml' + ext,
-        'llvm-nm' + ext,
-        'llvm-objcopy' + ext,
-        'llvm-objdump' + ext,
-        'llvm-profdata' + ext,
-        'llvm-ranlib' + ext,
-        'llvm-rc' + ext,
-        'llvm-readelf' + ext,
-        'llvm-readobj' + ext,
-        'llvm-size' + ext,
-        'llvm-strings' + ext,
-        'llvm-strip' + ext,
-        'llvm-symbolizer' + ext,
-        'llvm-windres' + ext,
-        'merge-fdata' + ext,
-        'perf2bolt' + ext,
-        'sancov' + ext,
-        'sanstats' + ext,
-        'scan-build' + ext,
-        'scan-view' + ext,
-        'wasm-ld' + ext,
-    }
+    ext = package_manifest.executable_ext(host)
+    necessary_bin_files = package_manifest.bin_files(
+        host, version.major_version(), toolchain_builder.build_lldb, necessary_bin_files)
+    script_bins = package_manifest.script_bins(host)
+    necessary_lib_files = package_manifest.lib_files(host, with_runtimes, win_sdk.is_enabled())
 
-    if toolchain_builder.build_lldb:
-        necessary_bin_files.update({
-            'lldb-argdumper' + ext,
-            'lldb' + ext,
-            'lldb' + script_ext,
-        })
-
-    if host.is_windows:
-        windows_exclude_bin_files = {
-            'clang-' + version.major_version() + ext,
-            'clangd' + ext,
-            'llvm-bolt' + ext,
-            'merge-fdata' + ext,
-            'perf2bolt' + ext,
-            'scan-build' + ext,
-            'scan-view' + ext,
-        }
-        necessary_bin_files -= windows_exclude_bin_files
-        necessary_bin_files.add('libclang.dll')
-
-    # scripts that should not be stripped
-    script_bins = {
-        'git-clang-format',
-        'lldb' + script_ext,
-        # merge-fdata is built with relocation, strip -S would fail. Treat it as
-        # a script and do not strip as a workaround.
-        'merge-fdata' + ext,
-        'scan-build',
-        'scan-view',
-    }
+    # Materialize only the files that go into the package.  The builders
+    # package keeps everything.
+    if builders_package:
+        manifest = package_manifest.PackageManifest(bin_files=None, static_libs=None)
+    else:
+        manifest = package_manifest.PackageManifest(bin_files=necessary_bin_files,
+                                                    static_libs=necessary_lib_files)
+    manifest.materialize(build_dir, install_dir)
 
     bin_dir = install_dir / 'bin'
     lib_dir = install_dir / 'lib'
-    strip_cmd = Builder.toolchain.strip
 
+    to_strip: List[Tuple[Path, List[str]]] = []
     for binary in bin_dir.iterdir():
         if binary.is_file():
             if binary.name not in necessary_bin_files:
-                if not builders_package:
-                    binary.unlink()
+                continue
             elif binary.is_symlink():
                 continue
             elif strip and binary.name not in script_bins:
@@ -515,60 +452,37 @@ def package_toolchain(toolchain_builder: LLVMBuilder,
                     # These specific flags prevent Darwin executables from being
                     # stripped of additional global symbols that might be used
                     # by plugins.
-                    utils.check_call([strip_cmd, '-S', '-x', binary])
+                    to_strip.append((binary, ['-S', '-x']))
                 else:
-                    utils.check_call([strip_cmd, binary])
+                    to_strip.append((binary, []))
 
     # FIXME: check that all libs under lib/clang/<version>/ are created.
+    # Check before stripping, so that a missing binary fails the build early.
     for necessary_bin_file in necessary_bin_files:
         if not (bin_dir / necessary_bin_file).is_file():
             raise RuntimeError(f'Did not find {necessary_bin_file} in {bin_dir}')
 
+    strip_binaries(to_strip, package_name)
+
     if builders_package:
         # Copy FileCheck into the install directory.  This is needed to build the
         # Rust toolchain.
         shutil.copy2(toolchain_builder.output_dir / 'bin' / ('FileCheck' + ext), bin_dir)
 
-    necessary_lib_files = set()
     if with_runtimes:
-        if not (host.is_windows and win_sdk.is_enabled()):
-            necessary_lib_files |= {
-                'libc++.a',
-                'libc++abi.a',
-            }
-        if host.is_linux:
-            necessary_lib_files |= {
-                'libbolt_rt_instr.a',
-                'libc++.so',
-                'libc++.so.1',
-                'libc++abi.so',
-                'libc++abi.so.1',
-                'libsimpleperf_readelf.a',
-            }
-        if host.is_darwin:
-            necessary_lib_files |= {
-                'libc++.dylib',
-                'libc++abi.dylib',
-                'libsimpleperf_readelf.a',
-            }
-
         if host.is_windows and not win_sdk.is_enabled():
-            necessary_lib_files.add('libwinpthread-1' + shlib_ext)
             # For Windows, add other relevant libraries.
             install_winpthreads(bin_dir, lib_dir)
 
         # Archive libsimpleperf_readelf.a for linux and darwin hosts from stage2 build.
+        # The LLVM static libraries aren't in the package, use the install's.
         if host.is_linux:
-            builders.LibSimpleperfReadElfBuilder().build_readelf_lib(lib_dir,
+            builders.LibSimpleperfReadElfBuilder().build_readelf_lib(build_dir / 'lib',
                                                                      lib_dir / host_config.llvm_triple)
         elif host.is_darwin:
-            builders.LibSimpleperfReadElfBuilder().build_readelf_lib(lib_dir, lib_dir,
+            builders.LibSimpleperfReadElfBuilder().build_readelf_lib(build_dir / 'lib', lib_dir,
                                                                      is_darwin_lib=True)
 
-    # Remove unnecessary static libraries.
-    if not builders_package:
-        remove_static_libraries(lib_dir, necessary_lib_files)
-
     if host.is_linux:
         install_wrappers(install_dir, llvm_next)
 
@@ -614,11 +528,14 @@ def package_toolchain(toolchain_builder: LLVMBuilder,
     libc_include_path = paths.ANDROID_DIR / 'bionic' / 'libc' / 'include'
     header_path = lib_dir / 'clang' / version.major_version() / 'include'
 
+    # Replace rather than overwrite, the header may be linked to the install.
+    (header_path / 'stdatomic.h').unlink(missing_ok=True)
     shutil.copy2(libc_include_path / 'stdatomic.h', header_path)
 
     bits_install_path = header_path / 'bits'
     bits_install_path.mkdir(parents=True, exist_ok=True)
     bits_stdatomic_path = libc_include_path / 'bits' / 'stdatomic.h'
+    (bits_install_path / 'stdatomic.h').unlink(missing_ok=True)
     shutil.copy2(bits_stdatomic_path, bits_install_path)
 
     # Install license files as NOTICE in the toolchain install dir.
@@ -733,8 +650,9 @@ def package_toolchain(toolchain_builder: LLVMBuilder,
             tag += "-builders"
         tarball_name = package_name + '-' + tag + '.tar.xz'
         package_path = paths.DIST_DIR / tarball_name
+        extra_outputs = [package_path.with_suffix('.zst')] if zstd else []
         logger().info(f'Packaging {package_path}')
-        utils.create_tarball(install_host_dir, [package_name], package_path)
+        utils.create_tarball(install_host_dir, [package_name], package_path, extra_outputs)
 
 
 def parse_args():
@@ -857,12 +775,57 @@ def parse_args():
         default=False,
         help='Continue build on error. This allows catching all errors at once.')
 
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of job slots shared by all concurrently running make/ninja builds. \
+        0 disables the shared jobserver.')
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        default=False,
+        help='Skip build steps that completed in an earlier build of this OUT_DIR with \
+        unchanged inputs, as recorded in its build journal.  Implies --incremental and \
+        --journal, and builds one builder at a time.')
+
+    parser.add_argument(
+        '--journal',
+        action='store_true',
+        default=False,
+        help='Record completed build steps in OUT_DIR/build_journal.json, so that a \
+        failed build can be continued with --resume.')
+
+    parser.add_argument(
+        '--build-history',
+        nargs='?',
+        type=Path,
+        const=paths.BUILD_HISTORY_DB,
+        help='Add the step times of a successful build to a build history database and warn \
+        about steps that regressed (see build_times.py).  Defaults to ' + str(paths.BUILD_HISTORY_DB))
+
+    parser.add_argument(
+        '--build-cache',
+        nargs='?',
+        type=Path,
+        const=paths.BUILD_CACHE_DIR,
+        help='Restore outputs of unchanged small libraries and sysroots from a local build \
+        cache, and store newly built ones.  Defaults to ' + str(paths.BUILD_CACHE_DIR))
+
     parser.add_argument(
         '--create-tar',
         action='store_true',
         default=False,
         help='Create a tar archive of the toolchains')
 
+    parser.add_argument(
+        '--zstd',
+        action='store_true',
+        default=False,
+        help='With --create-tar, also create .tar.zst archives of the toolchains')
+
     parser.add_argument(
         '--no-strip',
         action='store_true',
@@ -991,7 +954,7 @@ def main():
     args = parse_args()
 
     if paths.OUT_DIR.exists():
-        if not args.incremental:
+        if not args.incremental and not args.resume:
             logger().info(f'Removing {paths.OUT_DIR}')
             utils.clean_out_dir()
         else:
@@ -999,8 +962,17 @@ def main():
             logger().info(f'Keeping older build in {paths.OUT_DIR}: {out_dir_items}')
 
     timer.Timer.register_atexit(paths.DIST_DIR / 'build_times.txt')
+    timer.Timer.register_trace_atexit(paths.DIST_DIR / 'build_trace.json')
+    ninja_log.NinjaLogs.register_atexit(paths.DIST_DIR / 'ninja_times.txt')
     build_info.ToolchainBuild.register_atexit(paths.DIST_DIR / 'build_info.json')
 
+    if args.jobs:
+        jobserver.start(args.jobs)
+    if args.build_cache:
+        build_cache.enable(args.build_cache)
+    if args.journal or args.resume:
+        journal.open_journal(paths.OUT_DIR / 'build_journal.json', args.resume)
+
     if args.skip_build:
         # Skips all builds
         BuilderRegistry.add_filter(lambda name: False)
@@ -1036,6 +1008,11 @@ def main():
     logger().info('do_build=%r do_stage1=%r do_stage2=%r do_runtimes=%r do_package=%r need_windows=%r lto=%r bolt=%r musl=%r' %
                   (not args.skip_build, BuilderRegistry.should_build('stage1'), BuilderRegistry.should_build('stage2'),
                   do_runtimes, do_package, need_windows, args.lto, args.bolt, args.musl))
+    build_info.ToolchainBuild.Properties = {
+        'build_name': args.build_name,
+        'svn_revision': android_version.get_svn_revision(),
+        'options': {'pgo': bool(args.pgo), 'lto': args.lto, 'bolt': do_bolt, 'mlgo': mlgo},
+    }
 
     if paths.get_tensorflow_path() is None:
         if mlgo:
@@ -1048,7 +1025,15 @@ def main():
     build_errors : List[toolchain_errors.ToolchainError] = []
     # Clone sources to be built and apply patches.
     if not args.skip_source_setup:
-        setup_source_result = source_manager.setup_sources(git_am=args.git_am,
+        setup_source_inputs = lambda: [
+            args.llvm_rev or fingerprint.tree_digest(paths.TOOLCHAIN_LLVM_PATH),
+            fingerprint.dir_digest(paths.SCRIPTS_DIR / 'patches'),
+            args.git_am, args.skip_apply_patches, args.continue_on_errors,
+            paths.LLVM_PATH.exists()]
+        setup_source_result = journal.run_step('setup_sources', setup_source_inputs,
+                                         source_manager.setup_sources,
+                                         result_codec=toolchain_errors.ERROR_CODEC,
+                                         git_am=args.git_am,
                                          llvm_rev=args.llvm_rev,
                                          skip_apply_patches=args.skip_apply_patches,
                                          continue_on_patch_errors=args.continue_on_errors)
@@ -1098,18 +1083,21 @@ def main():
         set_default_toolchain(toolchains.Toolchain(paths.OUT_DIR / 'stage1-install', paths.OUT_DIR / 'stage1'))
     if args.bootstrap_build_only:
         with timer.Timer(f'package_bootstrap'):
-            utils.create_tarball(paths.OUT_DIR, ['stage1', 'stage1-install'], paths.DIST_DIR / 'stage1-install.tar.xz')
+            # Keep mtimes, so that builds on top of the stage1 build directory stay incremental.
+            utils.create_tarball(paths.OUT_DIR, ['stage1', 'stage1-install'], paths.DIST_DIR / 'stage1-install.tar.xz',
+                                 deterministic=False)
         return
 
     if build_lldb:
         # Swig is needed for both host and windows lldb.
         swig_builder = builders.SwigBuilder(host_configs)
-        swig_builder.build()
+        build_graph = [swig_builder]
     else:
         swig_builder = None
+        build_graph = []
 
     profdata = extract_pgo_profile(args)
-    clang_bolt_fdata = extract_bolt_profile(args)
+    bolt_fdata = extract_bolt_profile(args)
 
     if need_host:
         stage2 = builders.Stage2Builder(host_configs)
@@ -1127,41 +1115,50 @@ def main():
         stage2.libzstd = libzstd_builder
 
         libxml2_builder = builders.LibXml2Builder(host_configs)
-        libxml2_builder.build()
         stage2.libxml2 = libxml2_builder
+        build_graph.append(libxml2_builder)
 
         stage2.build_lldb = build_lldb
         if build_lldb:
+            stage2.swig_builder = swig_builder
             stage2.swig_executable = swig_builder.install_dir / 'bin' / 'swig'
 
             xz_builder = builders.XzBuilder(host_configs)
-            xz_builder.build()
             stage2.liblzma = xz_builder
 
             libncurses = builders.LibNcursesBuilder(host_configs)
-            libncurses.build()
             stage2.libncurses = libncurses
 
             libedit_builder = builders.LibEditBuilder(host_configs)
             libedit_builder.libncurses = libncurses
-            libedit_builder.build()
             stage2.libedit = libedit_builder
+            build_graph.extend([xz_builder, libncurses, libedit_builder])
 
         stage2_tags = []
         # Annotate the version string with build options.
         to_tag = lambda c, tag : ('+' if c else '-') + tag
         stage2_tags.append(to_tag(profdata, 'pgo'))
-        stage2_tags.append(to_tag(clang_bolt_fdata, 'bolt'))
+        stage2_tags.append(to_tag(bolt_fdata, 'bolt'))
         stage2_tags.append(to_tag(stage2.lto, 'lto'))
         stage2_tags.append(to_tag(stage2.enable_mlgo, 'mlgo'))
         if args.build_llvm_next:
             stage2_tags.append('ANDROID_LLVM_NEXT')
         stage2.build_tags = stage2_tags
+        build_graph.append(stage2)
 
-        stage2.build()
+    # The host libraries mostly don't depend on each other.  Build them
+    # concurrently and start stage2 as soon as all of its inputs are ready.
+    # When resuming, build in a fixed order, so that the same steps are skipped
+    # every time.
+    BuilderRegistry.build_graph(build_graph, max_workers=1 if args.resume else None)
 
+    if need_host:
         if do_bolt:
-            bolt_optimize(stage2, clang_bolt_fdata)
+            journal.run_step('bolt_optimize',
+                             lambda: [stage2.build_fingerprint,
+                                      {name: fingerprint.file_digest(fdata)
+                                       for name, fdata in bolt_fdata.items()}],
+                             bolt_optimize, stage2, bolt_fdata)
 
         if not (stage2.build_instrumented or stage2.debug_build):
             set_default_toolchain(stage2.installed_toolchain)
@@ -1194,54 +1191,62 @@ def main():
             BuilderRegistry.should_build('stage2') and \
             (not args.build_instrumented)
     if need_tests:
-       stage2.test()
+       journal.run_step('stage2_test', lambda: stage2.build_fingerprint, stage2.test)
 
     # Instrument with llvm-bolt. Must be the last build step to prevent other
     # build steps generating BOLT profiles.
     if need_host:
         if do_bolt_instrument:
-            bolt_instrument(stage2)
+            journal.run_step('bolt_instrument', lambda: stage2.build_fingerprint,
+                             bolt_instrument, stage2)
 
     if args.package_stage2_install:
         utils.create_tarball(paths.OUT_DIR, ['stage2-install'],
-                             paths.DIST_DIR / 'stage2-install.tar.xz')
+                             paths.DIST_DIR / 'stage2-install.tar.xz', deterministic=False)
 
     if do_package and need_host:
-        package_toolchain(
+        package_toolchain_step(
             stage2,
             strip=do_strip_host_package,
             with_runtimes=do_runtimes,
             create_tar=args.create_tar,
+            zstd=args.zstd,
             llvm_next=args.build_llvm_next,
             builders_package=False)
 
         if args.builders_package:
-            package_toolchain(
+            package_toolchain_step(
                 stage2,
                 strip=do_strip_host_package,
                 with_runtimes=do_runtimes,
                 create_tar=args.create_tar,
+                zstd=args.zstd,
                 llvm_next=args.build_llvm_next,
                 builders_package=True)
 
     if do_package and need_windows:
-        package_toolchain(
+        package_toolchain_step(
             win_builder,
             necessary_bin_files=win_lldb_bins,
             strip=do_strip,
             with_runtimes=do_runtimes,
             create_tar=args.create_tar,
+            zstd=args.zstd,
             builders_package=False)
 
         if args.builders_package:
-            package_toolchain(
+            package_toolchain_step(
                 win_builder,
                 necessary_bin_files=win_lldb_bins,
                 strip=do_strip,
                 with_runtimes=do_runtimes,
                 create_tar=args.create_tar,
+                zstd=args.zstd,
                 builders_package=True)
 
+    if args.build_history and not build_errors:
+        build_history.record(args.build_history, build_info.ToolchainBuild.report())
+
     if build_errors:
         logger().info(toolchain_errors.combine_toolchain_errors(build_errors))
         return len(build_errors)
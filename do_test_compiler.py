@@ -27,7 +27,7 @@ import subprocess
 from typing import Dict, List, Optional, Set
 
 import context
-from llvm_android import hosts, paths, utils, version
+from llvm_android import host_memory, hosts, paths, profile_merge, utils, version
 
 STDERR_REDIRECT_KEY = 'ANDROID_LLVM_STDERR_REDIRECT'
 PREBUILT_COMPILER_PATH_KEY = 'ANDROID_LLVM_PREBUILT_COMPILER_PATH'
@@ -44,6 +44,10 @@ class ProfileHandler(object):
     def getProfileFileEnvVars(self):
         return []
 
+    def startCollecting(self):
+        """Called right before the build that writes profiles starts."""
+        return
+
     def mergeProfiles(self):
         return
 
@@ -52,22 +56,38 @@ class PgoProfileHandler(ProfileHandler):
 
     def __init__(self):
         self.profiles_dir = paths.OUT_DIR / 'clang-profiles'
-        self.profiles_format = os.path.join(self.profiles_dir, '%4m.profraw')
+        # One file per pid and binary, which is merged and deleted soon after
+        # the process exits.  %m turns on the runtime's merge mode: a process
+        # that reuses a pid merges its counters into the existing file under a
+        # file lock.  Without it, the runtime truncates the file at startup.
+        self.profiles_format = os.path.join(self.profiles_dir, '%p-%m.profraw')
+        self.merger = profile_merge.IncrementalMerger(
+            self.profiles_dir, '.profraw', self._merge, paths.OUT_DIR / 'clang-profiles-merge')
 
     def getProfileFileEnvVars(self):
         return [('LLVM_PROFILE_FILE', self.profiles_format)]
 
-    def mergeProfiles(self):
-        stage1_install = paths.OUT_DIR / 'stage1-install'
-        profdata_tool = stage1_install / 'bin' / 'llvm-profdata'
+    @staticmethod
+    def _merge(inputs: List[Path], output: Path) -> None:
+        profdata_tool = paths.OUT_DIR / 'stage1-install' / 'bin' / 'llvm-profdata'
+        # Pass the inputs in a response file, there can be thousands.
+        input_files = output.parent / (output.name + '.inputs')
+        input_files.write_text('\n'.join(str(path) for path in inputs) + '\n')
+        # The output may be a hardlink into the profile cache, replace it.
+        output.unlink(missing_ok=True)
+        try:
+            utils.check_call([str(profdata_tool), 'merge', '-o', str(output),
+                              '-f', str(input_files)])
+        finally:
+            input_files.unlink()
+
+    def startCollecting(self):
+        self.merger.start()
 
+    def mergeProfiles(self):
         profdata_dir = paths.OUT_DIR
         profdata_filename = paths.pgo_profdata_filename()
-        utils.check_call([
-            str(profdata_tool), 'merge', '-o',
-            str(profdata_dir / profdata_filename),
-            str(self.profiles_dir)
-        ])
+        self.merger.finish(profdata_dir / profdata_filename)
 
         dist_dir = Path(os.environ.get('DIST_DIR', paths.OUT_DIR))
         utils.create_tarball(profdata_dir, [profdata_filename],
@@ -84,14 +104,37 @@ class BoltProfileHandler(ProfileHandler):
         merge_fdata_tool = stage2_install / 'bin' / 'merge-fdata'
 
         bolt_collection_path = paths.OUT_DIR / 'bolt_collection'
-        clang_fdata_filename = 'clang.fdata'
-        clang_fdata_path = bolt_collection_path / clang_fdata_filename
-        utils.check_call([
-            merge_fdata_tool, '-o', str(clang_fdata_path), str(bolt_collection_path / 'clang')
-        ])
+
+        def merge(inputs: List[Path], output: Path) -> None:
+            utils.check_call([merge_fdata_tool, '-o', str(output), *map(str, inputs)])
+
+        # One profile per instrumented binary, from bolt_collection/<binary>/.
+        fdata_filenames = []
+        for binary_dir in sorted(p for p in bolt_collection_path.iterdir() if p.is_dir()):
+            # merge-fdata over a directory takes the .fdata files under it.
+            fdata_files = sorted(binary_dir.rglob('*.fdata'))
+            if not fdata_files:
+                continue
+            fdata_filename = binary_dir.name + '.fdata'
+            fdata_path = bolt_collection_path / fdata_filename
+
+            # A merge holds its inputs' entries in memory, so size the pool by the
+            # largest batch.
+            batch_size = 64
+            largest_batch = sum(sorted((f.stat().st_size for f in fdata_files),
+                                       reverse=True)[:batch_size])
+            jobs = host_memory.parallel_jobs(max(2 * largest_batch, host_memory.GiB),
+                                             multiprocessing.cpu_count())
+            merge_dir = bolt_collection_path / f'merge-{binary_dir.name}'
+            profile_merge.tree_reduce(fdata_files, fdata_path, merge, merge_dir,
+                                      fan_in=batch_size, jobs=jobs)
+            shutil.rmtree(merge_dir)
+            # merge-fdata's entry order depends on how the inputs were grouped.
+            profile_merge.sort_fdata(fdata_path)
+            fdata_filenames.append(fdata_filename)
 
         dist_dir = Path(os.environ.get('DIST_DIR', paths.OUT_DIR))
-        utils.create_tarball(bolt_collection_path, [clang_fdata_filename],
+        utils.create_tarball(bolt_collection_path, fdata_filenames,
                              dist_dir / paths.bolt_fdata_tarname())
 
 
@@ -314,6 +357,8 @@ def build_target(android_base: Path, clang_version: version.Version,
 
     modulesList = ' '.join(modules)
     print('Start building target %s and modules %s.' % (target, modulesList))
+    if profiler is not None:
+        profiler.startCollecting()
     try:
         subprocess.check_call(
             ['/bin/bash', '-c', 'build/soong/soong_ui.bash --make-mode ' + jobs + \
@@ -21,9 +21,11 @@ import argparse
 from functools import lru_cache
 import subprocess
 import sys
+from typing import Dict, Iterable
 
 import context
 from llvm_android import paths, utils
+from llvm_android.upstream_revisions import RevisionIndex
 
 sys.path.append(str(paths.TOOLCHAIN_UTILS_DIR / 'llvm_tools'))
 #pylint: disable=wrong-import-position,wrong-import-order
@@ -78,22 +80,50 @@ def fetch_upstream():
                           cwd=paths.TOOLCHAIN_LLVM_PATH)
 
 
-def sha_to_revision(sha: str) -> int:
+@lru_cache
+def revision_index() -> RevisionIndex:
+    return RevisionIndex(paths.UPSTREAM_REVISIONS, paths.TOOLCHAIN_LLVM_PATH,
+                         git_llvm_rev.base_llvm_sha, git_llvm_rev.base_llvm_revision)
+
+
+@lru_cache
+def update_revision_index() -> RevisionIndex:
+    """Fetches upstream and indexes the new upstream-main commits."""
     fetch_upstream()
+    index = revision_index()
+    index.update('aosp/upstream-main')
+    return index
+
+
+def _llvm_config():
     git_llvm_rev.MAIN_BRANCH = 'upstream-main'
-    llvm_config = git_llvm_rev.LLVMConfig(remote='aosp',
-                                          dir=str(paths.TOOLCHAIN_LLVM_PATH))
-    rev = git_llvm_rev.translate_sha_to_rev(llvm_config, sha)
-    return rev.number
+    return git_llvm_rev.LLVMConfig(remote='aosp', dir=str(paths.TOOLCHAIN_LLVM_PATH))
+
+
+def sha_to_revision(sha: str) -> int:
+    # Upstream is only fetched if the index doesn't know sha yet.
+    rev = revision_index().revision(sha)
+    if rev is None:
+        rev = update_revision_index().revision(sha)
+    if rev is None:
+        # Not on the first-parent history of upstream-main after the git
+        # migration, e.g. an abbreviated SHA.
+        rev = git_llvm_rev.translate_sha_to_rev(_llvm_config(), sha).number
+    return rev
+
+
+def shas_to_revisions(shas: Iterable[str]) -> Dict[str, int]:
+    return {sha: sha_to_revision(sha) for sha in shas}
 
 
 def revision_to_sha(rev: int) -> str:
-    fetch_upstream()
-    git_llvm_rev.MAIN_BRANCH = 'upstream-main'
-    llvm_config = git_llvm_rev.LLVMConfig(remote='aosp',
-                                          dir=str(paths.TOOLCHAIN_LLVM_PATH))
-    return git_llvm_rev.translate_rev_to_sha(
-        llvm_config, git_llvm_rev.Rev.parse(f'r{rev}'))
+    sha = revision_index().sha(rev)
+    if sha is None:
+        sha = update_revision_index().sha(rev)
+    if sha is None:
+        sha = git_llvm_rev.translate_rev_to_sha(_llvm_config(),
+                                                git_llvm_rev.Rev.parse(f'r{rev}'))
+    return sha
 
 
 def merge_projects(sha, revision, bug_id, create_new_branch, dry_run):
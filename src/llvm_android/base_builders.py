@@ -15,6 +15,9 @@
 #
 """Builders for various build tools and build systems."""
 
+import concurrent.futures
+import contextvars
+import copy
 import functools
 from pathlib import Path
 import logging
@@ -23,9 +26,10 @@ import os
 import re
 import shutil
 import subprocess
-from typing import cast, Dict, List, Optional, Set, Sequence
+from typing import cast, Dict, List, Optional, Set, Sequence, Tuple
 
-from llvm_android import android_version, configs, constants, hosts, paths, timer, toolchains, utils, win_sdk
+from llvm_android import (android_version, build_cache, configs, constants, fingerprint, host_memory, hosts, jobserver,
+                          journal, ninja_log, objfile, paths, timer, toolchains, utils, win_sdk)
 from llvm_android.builder_registry import BuilderRegistry
 
 def logger():
@@ -54,19 +58,17 @@ class LibInfo:
         if not lib.exists():
             raise RuntimeError('Lookup of version before library is built')
 
-        objdump_output = utils.check_output([toolchains.get_prebuilt_toolchain().objdump,
-                                             '-p', lib])
-
+        # Memoized by the library's mtime, so reading this repeatedly is cheap.
+        soname = objfile.read(lib).soname or ''
         if target_os.is_linux:
-            regex = fr'SONAME\s*{self.name}\.so\.([0-9.]+)$'
+            regex = fr'{re.escape(self.name)}\.so\.([0-9.]+)'
         else:
-            regex = fr'name .*/{self.name}\.([0-9.]+)\.dylib \(offset.*'
-        version = re.findall(regex, objdump_output, re.MULTILINE)
+            regex = fr'(?:.*/)?{re.escape(self.name)}\.([0-9.]+)\.dylib'
+        version = re.fullmatch(regex, soname)
         if not version:
-            print('objdump output is')
-            print(objdump_output)
-            raise RuntimeError(f'Cannot find regex pattern {regex}')
-        return version[0]
+            raise RuntimeError(f'Cannot find regex pattern {regex} in the SONAME of {lib}: '
+                               f'{soname!r}')
+        return version.group(1)
 
     @property
     def install_dir(self) -> Path:
@@ -164,6 +166,22 @@ class Builder:  # pylint: disable=too-few-public-methods
     """The toolchain to install artifacts from this LLVMRuntimeBuilder."""
     output_toolchain: Optional[toolchains.Toolchain] = None
 
+    """Names of attributes holding builders whose outputs this builder uses."""
+    input_attrs: Tuple[str, ...] = ()
+
+    """Whether configs are independent and can be built concurrently.
+
+    Only takes effect when the jobserver is running, so that the concurrent
+    builds share one job budget.  Configs may install into shared
+    directories, so install_config() still runs for one config at a time."""
+    parallel_configs: bool = False
+
+    # Set on the workers of _build_configs_concurrently, which install later.
+    _defer_install: bool = False
+
+    """Whether outputs can be restored from the build cache instead of building."""
+    cacheable: bool = False
+
     def __init__(self,
                  config_list: Optional[Sequence[configs.Config]] = None,
                  toolchain: Optional[toolchains.Toolchain] = None) -> None:
@@ -175,18 +193,134 @@ class Builder:  # pylint: disable=too-few-public-methods
 
     @BuilderRegistry.register_and_build
     def build(self) -> None:
-        """Builds all configs."""
-        for config in self.config_list:
-            self._config = config
-
-            logger().info('Building %s for %s', self.name, self._config)
-            with timer.Timer(f'{self.name}_{self._config}'):
-                self._build_config()
+        """Builds all configs, unless a resumed build journal says they are built."""
+        with timer.trace(self.name, 'builder'):
+            journal.run_step(f'build_{self.name}', lambda: self.build_fingerprint,
+                             self._build_all)
+
+    def _build_all(self) -> None:
+        config_list = self.config_list
+        # The build cache stores installed outputs, so cacheable builders
+        # build and install one config at a time.
+        if (self.parallel_configs and not self.cacheable and jobserver.get() and
+                len(config_list) > 1):
+            self._build_configs_concurrently(config_list)
+        else:
+            for config in config_list:
+                self._config = config
+                self._build_timed_config()
         self.install()
 
+    def _build_timed_config(self) -> None:
+        logger().info('Building %s for %s', self.name, self._config)
+        with timer.Timer(f'{self.name}_{self._config}'):
+            self._build_cached_config()
+
+    def _build_cached_config(self) -> None:
+        """Runs _build_config, or restores its outputs from the build cache."""
+        cache = build_cache.get()
+        if not self.cacheable or not cache:
+            self._build_config()
+            return
+        key = self.input_fingerprint
+        if cache.restore(key, self.cache_outputs):
+            logger().info('Restored %s for %s from build cache', self.name, self._config)
+            return
+        self._build_config()
+        cache.store(key, self.cache_outputs)
+
+    @property
+    def cache_outputs(self) -> List[Path]:
+        """Paths written by _build_config for the current config."""
+        return [self.install_dir]
+
+    @property
+    def cache_sources(self) -> List[Path]:
+        """Source trees used by _build_config."""
+        return []
+
+    @property
+    def fingerprint_inputs(self) -> Dict[str, object]:
+        """Everything that affects the outputs of _build_config for the current config."""
+        env = self.env
+        return {
+            'builder': type(self).__name__,
+            'config': f'{self._config}{self._config.output_suffix}',
+            'extra_config': self._config.extra_config,
+            # Same as utils.create_script, only record what the build changes.
+            'env': {k: v for k, v in env.items() if v != utils.ORIG_ENV.get(k)},
+            'toolchain': fingerprint.toolchain_digest(self.toolchain),
+            'sources': [fingerprint.tree_digest(src) for src in self.cache_sources],
+            'dependencies': [dep.input_fingerprint for dep in self.dependencies],
+        }
+
+    @property
+    def input_fingerprint(self) -> str:
+        """A digest of fingerprint_inputs."""
+        return fingerprint.digest(self.fingerprint_inputs)
+
+    @property
+    def build_fingerprint(self) -> str:
+        """A digest of fingerprint_inputs for all configs."""
+        current_config = self._config
+        inputs = []
+        try:
+            for config in self.config_list:
+                self._config = config
+                inputs.append(self.fingerprint_inputs)
+        finally:
+            self._config = current_config
+        return fingerprint.digest(inputs)
+
+    def _build_configs_concurrently(self, config_list: List[configs.Config]) -> None:
+        """Builds each config in a worker that is a copy of this builder.
+
+        Workers have their own _config, so properties derived from it don't
+        interfere.  State set on a worker is not propagated back.  Once all
+        workers are done, the configs are installed in order, one at a time.
+        """
+        def build_worker(config: configs.Config) -> None:
+            worker = copy.copy(self)
+            worker._config = config
+            worker._defer_install = True
+            logger().info('Building %s for %s', worker.name, config)
+            with timer.Timer(f'{worker.name}_{config}'):
+                worker._build_config()
+
+        max_workers = min(len(config_list), os.cpu_count())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                   thread_name_prefix=self.name) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, build_worker, config)
+                       for config in config_list]
+        for future in futures:
+            future.result()
+        for config in config_list:
+            self._config = config
+            with timer.Timer(f'install_{self.name}_{config}'):
+                self.install_config()
+        # _config is left as a serial build would, install() may depend on it.
+
     def _build_config(self) -> None:
         raise NotImplementedError()
 
+    @property
+    def dependencies(self) -> List['Builder']:
+        """Builders that must be built before this one."""
+        inputs = (getattr(self, attr, None) for attr in self.input_attrs)
+        return [builder for builder in inputs if isinstance(builder, Builder)]
+
+    def _run_build_tool(self, cmd, measure_memory: bool = False, **kwargs) -> Optional[int]:
+        """Runs make/ninja/cmake as a jobserver client, holding one job slot for it.
+
+        If measure_memory is set, returns the peak memory of the run in bytes.
+        """
+        kwargs['env'] = jobserver.client_env(kwargs.get('env') or self.env)
+        with jobserver.job_slot(self.name):
+            if measure_memory:
+                return utils.check_call_peak_rss(cmd, **kwargs)
+            utils.check_call(cmd, **kwargs)
+            return None
+
     def _is_64bit(self) -> bool:
         return self._config.target_arch in (hosts.Arch.AARCH64, hosts.Arch.X86_64)
 
@@ -291,6 +425,20 @@ class AutoconfBuilder(Builder):
         """Parameters to configure."""
         return []
 
+    @property
+    def cache_sources(self) -> List[Path]:
+        return [self.src_dir]
+
+    @property
+    def fingerprint_inputs(self) -> Dict[str, object]:
+        inputs = super().fingerprint_inputs
+        inputs['cflags'] = self._config.cflags + self.cflags
+        inputs['cxxflags'] = self._config.cxxflags + self.cxxflags
+        inputs['ldflags'] = self._config.ldflags + self.ldflags
+        inputs['config_flags'] = self.config_flags
+        inputs['install_dir'] = self.install_dir
+        return inputs
+
     def _touch_src_dir(self, files) -> None:
         for file in files:
             file_path = self.src_dir / file
@@ -339,21 +487,29 @@ class AutoconfBuilder(Builder):
         config_cmd = [str(self.src_dir / 'configure'), f'--prefix={self.install_dir}']
         config_cmd.extend(self.config_flags)
         utils.create_script(self.output_dir / 'config_invocation.sh', config_cmd, env)
-        utils.check_call(config_cmd, cwd=self.output_dir, env=env)
+        self._run_build_tool(config_cmd, cwd=self.output_dir, env=env)
 
-        make_cmd = [str(paths.MAKE_BIN_PATH), f'-j{multiprocessing.cpu_count()}']
-        utils.check_call(make_cmd, cwd=self.output_dir, env=self.env)
+        make_cmd = [str(paths.MAKE_BIN_PATH)]
+        if not jobserver.get():
+            # Otherwise make takes its parallelism from the jobserver in MAKEFLAGS.
+            make_cmd.append(f'-j{multiprocessing.cpu_count()}')
+        self._run_build_tool(make_cmd, cwd=self.output_dir, env=self.env)
 
-        self.install_config()
+        if not self._defer_install:
+            self.install_config()
 
     def install_config(self) -> None:
         """Installs built artifacts for current config."""
         install_cmd = [str(paths.MAKE_BIN_PATH), 'install']
-        utils.check_call(install_cmd, cwd=self.output_dir, env=self.env)
+        self._run_build_tool(install_cmd, cwd=self.output_dir, env=self.env)
         if isinstance(self, LibInfo):
             cast(LibInfo, self).update_lib_id()
 
 
+# CMake defines that only affect how many jobs ninja runs in parallel.
+SCHEDULING_DEFINES = ('LLVM_PARALLEL_COMPILE_JOBS', 'LLVM_PARALLEL_LINK_JOBS')
+
+
 class CMakeBuilder(Builder):
     """Builder for cmake targets."""
     config: configs.Config
@@ -447,6 +603,23 @@ class CMakeBuilder(Builder):
         defines.update(self._config.cmake_defines)
         return defines
 
+    @property
+    def cache_sources(self) -> List[Path]:
+        return [self.src_dir]
+
+    @property
+    def fingerprint_inputs(self) -> Dict[str, object]:
+        inputs = super().fingerprint_inputs
+        inputs['cmake_defines'] = {key: value for key, value in self.cmake_defines.items()
+                                   if key not in SCHEDULING_DEFINES}
+        inputs['ninja_targets'] = self.ninja_targets
+        return inputs
+
+    @property
+    def memory_profile(self) -> Optional[str]:
+        """Key to record the peak memory of ninja runs under, if any (see host_memory)."""
+        return None
+
     def _get_cmake_system_name(self) -> str:
         return self._config.target_os.value.capitalize()
 
@@ -461,11 +634,20 @@ class CMakeBuilder(Builder):
             if 'CMakeFiles' in dirs:
                 shutil.rmtree(os.path.join(dirpath, 'CMakeFiles'))
 
-    def _ninja(self, args: list[str], add_env: Optional[Dict[str, str]] = None) -> None:
+    def _is_configured(self, fingerprint_file: Path, input_fingerprint: str) -> bool:
+        """Tests whether output_dir is intact and was configured with input_fingerprint."""
+        return ((self.output_dir / 'CMakeCache.txt').is_file() and
+                (self.output_dir / 'build.ninja').is_file() and
+                fingerprint_file.is_file() and
+                fingerprint_file.read_text() == input_fingerprint)
+
+    def _ninja(self, args: list[str], add_env: Optional[Dict[str, str]] = None,
+               measure_memory: bool = False) -> Optional[int]:
         """ Build ninja targets.
             Args:
                 args: ninja targets to build
                 add_env: additional environment variables
+                measure_memory: return the peak memory of the run
         """
         ninja_cmd = [str(paths.NINJA_BIN_PATH)] + args
         if add_env:
@@ -473,7 +655,8 @@ class CMakeBuilder(Builder):
             ninja_env.update(add_env)
         else:
             ninja_env = self.env
-        utils.check_call(ninja_cmd, cwd=self.output_dir, env=ninja_env)
+        return self._run_build_tool(ninja_cmd, measure_memory=measure_memory,
+                                    cwd=self.output_dir, env=ninja_env)
 
     def _build_config(self) -> None:
         if self.remove_cmake_cache:
@@ -492,16 +675,41 @@ class CMakeBuilder(Builder):
         env = self.env
         utils.create_script(self.output_dir / 'cmake_invocation.sh', cmake_cmd, env)
 
-        with timer.Timer(f'cmake_{self.name}_{self._config}'):
-          utils.check_call(cmake_cmd, cwd=self.output_dir, env=env)
-
-        self._ninja(self.ninja_targets)
-        self.install_config()
+        # Skip configuring if the build dir was configured with the same inputs.
+        # ninja still re-runs cmake by itself if a CMakeLists.txt changed.
+        fingerprint_file = self.output_dir / 'cmake_fingerprint'
+        # Job pools don't affect the outputs, but they do need a reconfigure.
+        input_fingerprint = fingerprint.digest([self.input_fingerprint, self.cmake_defines])
+        if self._is_configured(fingerprint_file, input_fingerprint):
+            logger().info('Skipping cmake for %s for %s, inputs are unchanged',
+                          self.name, self._config)
+        else:
+            fingerprint_file.unlink(missing_ok=True)
+            with timer.Timer(f'cmake_{self.name}_{self._config}'):
+              self._run_build_tool(cmake_cmd, cwd=self.output_dir, env=env)
+            fingerprint_file.write_text(input_fingerprint)
+
+        log_offset = ninja_log.NinjaLogs.log_offset(self.output_dir)
+        peak_rss = self._ninja(self.ninja_targets, measure_memory=bool(self.memory_profile))
+        ninja_log.NinjaLogs.add_run(f'{self.name}_{self._config}', self.output_dir, log_offset)
+        # The peak of a run is sized by its biggest link.  Runs that didn't link
+        # anything (e.g. nothing to rebuild) say nothing about link memory.
+        if peak_rss and self._ran_link(log_offset):
+            host_memory.PROFILES.record(self.memory_profile, peak_rss)
+        if not self._defer_install:
+            self.install_config()
+
+    def _ran_link(self, log_offset: int) -> bool:
+        """Tests whether the ninja run that logged from log_offset linked anything."""
+        log_file = self.output_dir / '.ninja_log'
+        if not log_file.exists():
+            return False
+        return any(edge.kind == 'link' for edge in ninja_log.read_edges(log_file, log_offset))
 
     def install_config(self) -> None:
         """Installs built artifacts for current config."""
-        utils.check_call([paths.NINJA_BIN_PATH, 'install'],
-                         cwd=self.output_dir, env=self.env)
+        self._run_build_tool([paths.NINJA_BIN_PATH, 'install'],
+                             cwd=self.output_dir, env=self.env)
 
 
 class LLVMBaseBuilder(CMakeBuilder):  # pylint: disable=abstract-method
@@ -607,19 +815,47 @@ class LLVMBuilder(LLVMBaseBuilder):
     libzstd: Optional[LibInfo] = None
     runtimes_triples: List[str] = list()
     build_cross_runtimes: bool = False
+    input_attrs: Tuple[str, ...] = ('libzstd', 'swig_builder', 'libxml2', 'liblzma', 'libedit',
+                                    'libncurses')
 
     # lldb options.
     build_lldb: bool = True
+    swig_builder: Optional[Builder] = None
     swig_executable: Optional[Path] = None
     libxml2: Optional[LibInfo] = None
     liblzma: Optional[LibInfo] = None
     libedit: Optional[LibInfo] = None
     libncurses: Optional[LibInfo] = None
 
+    lto: bool = False
+
     @property
     def install_dir(self) -> Path:
         return paths.OUT_DIR / f'{self.name}-install'
 
+    @property
+    def memory_profile(self) -> Optional[str]:
+        return f'{self.name}_{self._config}'
+
+    def _set_parallel_jobs(self, defines: Dict[str, str]) -> None:
+        """Limits parallel compile and link jobs to what fits in memory.
+
+        Link jobs are sized by the peak memory recorded for an earlier build of
+        this builder, which is dominated by the biggest link.
+        """
+        num_cpus = multiprocessing.cpu_count()
+        default_link_memory = (host_memory.DEFAULT_LTO_LINK_JOB_MEMORY if self.lto
+                               else host_memory.DEFAULT_LINK_JOB_MEMORY)
+        link_memory = host_memory.PROFILES.get(self.memory_profile) or default_link_memory
+        # ThinLTO links are multithreaded themselves.
+        max_link_jobs = max(1, num_cpus // 2) if self.lto else num_cpus
+        link_jobs = host_memory.parallel_jobs(link_memory, max_link_jobs)
+        defines['LLVM_PARALLEL_LINK_JOBS'] = str(link_jobs)
+
+        compile_jobs = host_memory.parallel_jobs(host_memory.DEFAULT_COMPILE_JOB_MEMORY, num_cpus)
+        if compile_jobs < num_cpus:
+            defines['LLVM_PARALLEL_COMPILE_JOBS'] = str(compile_jobs)
+
     @property
     def output_dir(self) -> Path:
         return paths.OUT_DIR / self.name
@@ -784,6 +1020,8 @@ class LLVMBuilder(LLVMBaseBuilder):
         defines['CLANG_DEFAULT_LINKER'] = 'lld'
         defines['CLANG_DEFAULT_OBJCOPY'] = 'llvm-objcopy'
 
+        self._set_parallel_jobs(defines)
+
         # Omit versions on LLVM's Linux and Darwin shared libraries. The versions for the runtimes
         # (e.g. libc++) are also omitted, using OS-specific versions of the same CMake flag.
         defines['CMAKE_PLATFORM_NO_VERSIONED_SONAME'] = 'ON'
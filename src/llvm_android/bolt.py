@@ -0,0 +1,166 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Runs llvm-bolt on several binaries of a toolchain concurrently.
+
+An llvm-bolt run holds its input binary and profile in memory, and much of it
+is single-threaded, so binaries are rewritten side by side for as long as
+their estimated peak memory fits the host.  Runs start biggest first.  The
+peak memory of each run is recorded in host_memory.PROFILES, so later builds
+schedule with measured numbers instead of estimates.
+"""
+
+import concurrent.futures
+import contextvars
+import dataclasses
+from datetime import timedelta
+import logging
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+from llvm_android import host_memory, jobserver, timer, utils
+
+# Without a recorded profile, an llvm-bolt run is assumed to peak at this
+# multiple of its input's size.
+_DEFAULT_MEMORY_PER_INPUT_BYTE = 8
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+def binaries(bin_dir: Path, major_version: str) -> Dict[str, Path]:
+    """Returns the binaries of an install that BOLT profiles exist for, by profile name.
+
+    clang and ld.lld are links to these.
+    """
+    return {
+        'clang': bin_dir / ('clang-' + major_version),
+        'lld': bin_dir / 'lld',
+    }
+
+
+@dataclasses.dataclass
+class BoltJob:
+    """An llvm-bolt run that replaces binary with its rewritten version."""
+    name: str
+    binary: Path
+    # llvm-bolt options, besides the input and output.
+    args: List[str]
+    # Leave the input binary next to the output, as <binary>.orig.
+    keep_original: bool = False
+
+    @property
+    def original(self) -> Path:
+        return self.binary.parent / (self.binary.name + '.orig')
+
+    @property
+    def memory_profile(self) -> str:
+        return f'llvm-bolt_{self.name}'
+
+    def estimated_memory(self) -> int:
+        recorded = host_memory.PROFILES.get(self.memory_profile)
+        if recorded:
+            return recorded
+        return max(host_memory.GiB, _DEFAULT_MEMORY_PER_INPUT_BYTE * self.binary.stat().st_size)
+
+
+@dataclasses.dataclass
+class BoltResult:
+    name: str
+    seconds: float
+    peak_rss: int
+
+
+class _MemoryBudget:
+    """Memory reserved by running jobs, bounded by what the host can spare."""
+
+    def __init__(self, capacity: Optional[int]) -> None:
+        self.capacity = capacity
+        self.reserved = 0
+        self.cond = threading.Condition()
+
+    def clamp(self, amount: int) -> int:
+        # A job bigger than the budget runs alone.
+        return min(amount, self.capacity) if self.capacity else 0
+
+    def acquire(self, amount: int) -> None:
+        with self.cond:
+            self.cond.wait_for(lambda: self.reserved + amount <= (self.capacity or 0))
+            self.reserved += amount
+
+    def release(self, amount: int) -> None:
+        with self.cond:
+            self.reserved -= amount
+            self.cond.notify_all()
+
+
+def _run_job(llvm_bolt: Path, job: BoltJob, step: str) -> BoltResult:
+    with jobserver.job_slot('llvm-bolt'), timer.Timer(f'{step} {job.name}'):
+        start = time.time()
+        shutil.move(job.binary, job.original)
+        cmd = [llvm_bolt, *job.args, '-o', job.binary, job.original]
+        peak_rss = utils.check_call_peak_rss(cmd)
+        if not job.keep_original:
+            os.remove(job.original)
+        seconds = time.time() - start
+    host_memory.PROFILES.record(job.memory_profile, peak_rss)
+    return BoltResult(job.name, seconds, peak_rss)
+
+
+def report(step: str, results: List[BoltResult]) -> str:
+    """Returns one '<duration> <name> (<peak memory>)' line per job, slowest first."""
+    lines = [f'{step}:']
+    for result in sorted(results, key=lambda r: r.seconds, reverse=True):
+        lines.append(f'  {timedelta(seconds=int(result.seconds))} {result.name} '
+                     f'(peak {result.peak_rss / host_memory.GiB:.1f} GiB)')
+    return '\n'.join(lines)
+
+
+def run(llvm_bolt: Path, jobs: List[BoltJob], step: str = 'bolt') -> List[BoltResult]:
+    """Runs jobs concurrently, as many at once as their memory allows.
+
+    Each job is timed as '<step> <name>' in build_times.txt.
+    """
+    if not jobs:
+        return []
+    memory = host_memory.total_memory()
+    budget = _MemoryBudget(int(memory * host_memory.USABLE_FRACTION) if memory else None)
+    estimates = {job.name: budget.clamp(job.estimated_memory()) for job in jobs}
+
+    def run_job(job: BoltJob) -> BoltResult:
+        try:
+            return _run_job(llvm_bolt, job, step)
+        finally:
+            budget.release(estimates[job.name])
+
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs),
+                                               thread_name_prefix='llvm-bolt') as executor:
+        for job in sorted(jobs, key=lambda job: estimates[job.name], reverse=True):
+            # Start jobs in order, so a big job isn't passed over by small ones.
+            budget.acquire(estimates[job.name])
+            if any(future.done() and future.exception() for future in futures):
+                budget.release(estimates[job.name])
+                break
+            futures.append(executor.submit(contextvars.copy_context().run, run_job, job))
+    results = [future.result() for future in futures]
+    logger().info(report(step, results))
+    return results
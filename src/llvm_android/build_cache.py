@@ -0,0 +1,171 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A local content-addressed store for builder outputs.
+
+An entry maps a builder's input fingerprint to a manifest of the files it
+produced.  File contents are stored once per sha256 under objects/, so
+entries that share files (e.g. headers) don't take extra space.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Dict, List, Optional
+
+from llvm_android import fingerprint
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+class BuildCache:
+    """Stores and restores the outputs of a build step, keyed by its fingerprint."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.objects_dir = root / 'objects'
+        self.entries_dir = root / 'entries'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.entries_dir.mkdir(parents=True, exist_ok=True)
+
+    def _object_path(self, sha: str) -> Path:
+        return self.objects_dir / sha[:2] / sha[2:]
+
+    def _entry_path(self, key: str) -> Path:
+        return self.entries_dir / f'{key}.json'
+
+    @staticmethod
+    def _write_atomic(path: Path, write) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as outfile:
+                write(outfile)
+            os.replace(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def _add_object(self, path: Path) -> str:
+        sha = fingerprint.file_digest(path)
+        obj = self._object_path(sha)
+        if not obj.exists():
+            with path.open('rb') as infile:
+                self._write_atomic(obj, lambda outfile: shutil.copyfileobj(infile, outfile))
+        return sha
+
+    def _scan(self, output: Path) -> List[Dict[str, object]]:
+        """Lists the entries of an output file or directory, storing file contents."""
+        if not output.exists() and not output.is_symlink():
+            return []
+        if not output.is_dir() or output.is_symlink():
+            paths = [output]
+        else:
+            paths = [output]
+            for dirpath, dirnames, filenames in os.walk(output):
+                dirnames.sort()
+                for name in sorted(dirnames + filenames):
+                    paths.append(Path(dirpath) / name)
+
+        entries = []
+        for path in paths:
+            entry: Dict[str, object] = {'path': os.fspath(path.relative_to(output))}
+            if path.is_symlink():
+                entry['symlink'] = os.readlink(path)
+            elif path.is_dir():
+                entry['dir'] = True
+            else:
+                entry['sha'] = self._add_object(path)
+                entry['mode'] = path.stat().st_mode & 0o7777
+            entries.append(entry)
+        return entries
+
+    def _metadata_path(self, key: str) -> Path:
+        return self.entries_dir / f'{key}.metadata.json'
+
+    def store(self, key: str, outputs: List[Path], metadata: Optional[Dict] = None) -> None:
+        """Stores the current contents of outputs as the entry for key.
+
+        metadata is stored with the entry, see load_metadata().
+        """
+        if metadata is not None:
+            meta = json.dumps(metadata).encode()
+            self._write_atomic(self._metadata_path(key), lambda outfile: outfile.write(meta))
+        manifest = {os.fspath(output): self._scan(output) for output in outputs}
+        data = json.dumps(manifest, indent=1).encode()
+        self._write_atomic(self._entry_path(key), lambda outfile: outfile.write(data))
+        logger().info('Stored %s in build cache', key)
+
+    def load_metadata(self, key: str) -> Optional[Dict]:
+        """Returns the metadata stored with the entry for key, if any."""
+        try:
+            return json.loads(self._metadata_path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def restore(self, key: str, outputs: List[Path]) -> bool:
+        """Replaces outputs with the entry for key.  Returns False on a cache miss."""
+        entry_path = self._entry_path(key)
+        if not entry_path.exists():
+            return False
+        manifest = json.loads(entry_path.read_text())
+        if sorted(manifest) != sorted(os.fspath(output) for output in outputs):
+            return False
+        for entries in manifest.values():
+            for entry in entries:
+                if 'sha' in entry and not self._object_path(entry['sha']).exists():
+                    logger().warning('Build cache entry %s is incomplete', key)
+                    return False
+
+        for output in outputs:
+            if output.is_symlink() or output.is_file():
+                output.unlink()
+            elif output.exists():
+                shutil.rmtree(output)
+            for entry in manifest[os.fspath(output)]:
+                path = output / entry['path']
+                if 'symlink' in entry:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    path.symlink_to(entry['symlink'])
+                elif 'dir' in entry:
+                    path.mkdir(parents=True, exist_ok=True)
+                else:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copyfile(self._object_path(entry['sha']), path)
+                    path.chmod(entry['mode'])
+        entry_path.touch()
+        return True
+
+
+_BUILD_CACHE: Optional[BuildCache] = None
+
+
+def enable(root: Path) -> BuildCache:
+    """Enables the build cache for this process."""
+    global _BUILD_CACHE  # pylint: disable=global-statement
+    _BUILD_CACHE = BuildCache(root)
+    logger().info('Using build cache at %s', root)
+    return _BUILD_CACHE
+
+
+def get() -> Optional[BuildCache]:
+    """Returns the build cache, or None if it isn't enabled."""
+    return _BUILD_CACHE
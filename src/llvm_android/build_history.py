@@ -0,0 +1,165 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A local SQLite database of step times across builds.
+
+Builds are only compared with earlier builds of the same kind: the same build
+name, core count and build options (pgo, lto, bolt, mlgo).
+"""
+
+import dataclasses
+import datetime
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import statistics
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    build_name TEXT NOT NULL,
+    svn_revision TEXT NOT NULL,
+    cores INTEGER NOT NULL,
+    options TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    build_id INTEGER NOT NULL REFERENCES builds(id),
+    step TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    parent TEXT
+);
+CREATE INDEX IF NOT EXISTS steps_by_step ON steps (step, build_id);
+"""
+
+
+def format_options(options: Dict[str, bool]) -> str:
+    """Formats build options like the stage2 version tags, e.g. '+lto-pgo'."""
+    return ''.join(('+' if enabled else '-') + name for name, enabled in sorted(options.items()))
+
+
+@dataclasses.dataclass
+class Regression:
+    """A step that took longer than its rolling median."""
+    step: str
+    seconds: float
+    median: float
+
+    @property
+    def percent(self) -> float:
+        return (self.seconds / self.median - 1) * 100
+
+
+class BuildHistory:
+    """Step times of past builds."""
+
+    def __init__(self, db_path: Path) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def add_build(self, report: Dict[str, Any], timestamp: Optional[str] = None) -> int:
+        """Adds a build from a ToolchainBuild.report() JSON object.  Returns its id."""
+        properties = report.get('Properties', {})
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO builds (timestamp, build_name, svn_revision, cores, options) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (timestamp or datetime.datetime.now().isoformat(timespec='seconds'),
+                 properties.get('build_name', 'unknown'),
+                 properties.get('svn_revision', 'unknown'),
+                 report['Cores'],
+                 format_options(properties.get('options', {}))))
+            build_id = cursor.lastrowid
+            self.conn.executemany(
+                'INSERT INTO steps (build_id, step, seconds, parent) VALUES (?, ?, ?, ?)',
+                [(build_id, entry['step'], entry['time'], entry.get('parent'))
+                 for entry in report['BuildTime']])
+        return build_id
+
+    def last_build(self) -> Optional[int]:
+        row = self.conn.execute('SELECT MAX(id) FROM builds').fetchone()
+        return row[0]
+
+    def _similar_builds(self, build_id: int, window: int) -> List[int]:
+        """Returns up to window earlier builds of the same kind as build_id, newest first."""
+        build_name, cores, options = self.conn.execute(
+            'SELECT build_name, cores, options FROM builds WHERE id = ?', (build_id,)).fetchone()
+        rows = self.conn.execute(
+            'SELECT id FROM builds WHERE build_name = ? AND cores = ? AND options = ? AND id < ? '
+            'ORDER BY id DESC LIMIT ?', (build_name, cores, options, build_id, window))
+        return [row[0] for row in rows]
+
+    def _step_times(self, build_ids: List[int]) -> Dict[str, List[float]]:
+        times: Dict[str, List[float]] = {}
+        if not build_ids:
+            return times
+        placeholders = ','.join('?' * len(build_ids))
+        for step, seconds in self.conn.execute(
+                f'SELECT step, seconds FROM steps WHERE build_id IN ({placeholders})', build_ids):
+            times.setdefault(step, []).append(seconds)
+        return times
+
+    def regressions(self, build_id: int, threshold: float, window: int,
+                    min_seconds: float = 60) -> List[Regression]:
+        """Returns steps of build_id that were more than threshold% slower than
+        the median of the last window builds of the same kind.
+
+        Steps shorter than min_seconds are ignored, they are too noisy.
+        """
+        current = self._step_times([build_id])
+        history = self._step_times(self._similar_builds(build_id, window))
+        result = []
+        for step, times in current.items():
+            seconds = max(times)
+            if step not in history or seconds < min_seconds:
+                continue
+            median = statistics.median(history[step])
+            if median > 0 and seconds > median * (1 + threshold / 100):
+                result.append(Regression(step, seconds, median))
+        return sorted(result, key=lambda r: r.seconds - r.median, reverse=True)
+
+    def trend(self, step: str, limit: int) -> List[Tuple[str, str, str, int, str, float]]:
+        """Returns (timestamp, build_name, svn_revision, cores, options, seconds) of
+        the last limit builds that ran step, oldest first."""
+        rows = self.conn.execute(
+            'SELECT b.timestamp, b.build_name, b.svn_revision, b.cores, b.options, MAX(s.seconds) '
+            'FROM steps s JOIN builds b ON b.id = s.build_id WHERE s.step = ? '
+            'GROUP BY b.id ORDER BY b.id DESC LIMIT ?', (step, limit)).fetchall()
+        return list(reversed(rows))
+
+
+def record(db_path: Path, report: str) -> None:
+    """Adds a ToolchainBuild.report() to the database at db_path and logs regressions."""
+    history = BuildHistory(db_path)
+    try:
+        build_id = history.add_build(json.loads(report))
+        for regression in history.regressions(build_id, threshold=10, window=10):
+            logger().warning('%s took %ds, %.0f%% more than the median of recent builds (%ds)',
+                             regression.step, regression.seconds, regression.percent,
+                             regression.median)
+    finally:
+        history.close()
@@ -4,12 +4,16 @@ import os
 
 class ToolchainBuild:
     BuildTime = []
+    # Build name, svn revision and options, to compare like builds over time.
+    Properties = {}
 
     @classmethod
     def report(cls):
         num_cores = os.cpu_count()
         # The build time is measured in seconds.
         result = {"Cores": num_cores, "BuildTime": cls.BuildTime}
+        if cls.Properties:
+            result["Properties"] = cls.Properties
         return json.dumps(result)
 
     @classmethod
@@ -15,8 +15,10 @@
 #
 """A class to manage existing builders, so that they are discoverable."""
 
+import concurrent.futures
+import contextvars
 import logging
-from typing import Callable, Dict, List, Iterable
+from typing import Callable, Dict, List, Iterable, Optional, Sequence, Set
 
 
 def logger():
@@ -68,3 +70,45 @@ class BuilderRegistry:
             else:
                 logger().info("Skipping %s.", name)
         return wrapper
+
+    @classmethod
+    def build_graph(cls, builders: Sequence[object], max_workers: Optional[int] = None) -> None:
+        """Builds builders concurrently, each as soon as its dependencies are built.
+
+        Dependencies come from each builder's `dependencies`. Dependencies not in
+        `builders` are assumed to be built already. should_build() filters still
+        apply; a skipped builder counts as done so that its dependents can run.
+        """
+        nodes = list(builders)
+        node_set = set(nodes)
+        remaining: Dict[object, Set[object]] = {
+            node: set(dep for dep in node.dependencies if dep in node_set) for node in nodes
+        }
+        done: Set[object] = set()
+        errors: List[BaseException] = []
+        running: Dict[concurrent.futures.Future, object] = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(nodes) or 1,
+                                                   thread_name_prefix='builder') as executor:
+            while remaining or running:
+                if not errors:
+                    ready = [node for node, deps in remaining.items() if deps <= done]
+                    for node in ready:
+                        del remaining[node]
+                        running[executor.submit(contextvars.copy_context().run, node.build)] = node
+                if not running:
+                    if errors:
+                        break
+                    names = ', '.join(node.name for node in remaining)
+                    raise RuntimeError(f'Dependency cycle among builders: {names}')
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    if future.exception():
+                        logger().error('%s failed: %s', node.name, future.exception())
+                        errors.append(future.exception())
+                    else:
+                        done.add(node)
+        if errors:
+            raise errors[0]
@@ -16,9 +16,8 @@
 """Builder instances for various targets."""
 
 from pathlib import Path
-from typing import cast, Dict, Iterator, List, Optional, Set
+from typing import cast, Dict, Iterator, List, Optional, Set, Tuple
 import contextlib
-import multiprocessing
 import os
 import re
 import shutil
@@ -222,9 +221,6 @@ class Stage2Builder(base_builders.LLVMBuilder):
                 not self.debug_build):
             defines['LLVM_ENABLE_LTO'] = 'Thin'
 
-            # Increase the ThinLTO link jobs limit to improve build speed.
-            defines['LLVM_PARALLEL_LINK_JOBS'] = min(int(multiprocessing.cpu_count() / 2), 16)
-
         # Build libFuzzer here to be exported for the host fuzzer builds. libFuzzer
         # is not currently supported on Darwin.
         if self._config.target_os.is_darwin:
@@ -306,6 +302,7 @@ class Stage2Builder(base_builders.LLVMBuilder):
 class BuiltinsBuilder(base_builders.LLVMRuntimeBuilder):
     name: str = 'builtins'
     src_dir: Path = paths.LLVM_PATH / 'compiler-rt' / 'lib' / 'builtins'
+    parallel_configs: bool = True
 
     # Only target the NDK, not the platform. The NDK copy is sufficient for the
     # platform builders, and both NDK+platform builders use the same toolchain,
@@ -420,6 +417,7 @@ class BuiltinsBuilder(base_builders.LLVMRuntimeBuilder):
 class CompilerRTBuilder(base_builders.LLVMRuntimeBuilder):
     name: str = 'compiler-rt'
     src_dir: Path = paths.LLVM_PATH / 'compiler-rt'
+    parallel_configs: bool = True
     config_list: List[configs.Config] = (
         configs.android_configs(platform=True) +
         configs.android_configs(platform=False)
@@ -583,6 +581,7 @@ class MuslHostRuntimeBuilder(base_builders.LLVMRuntimeBuilder):
 class LibUnwindBuilder(base_builders.LLVMRuntimeBuilder):
     name: str = 'libunwind'
     src_dir: Path = paths.LLVM_PATH / 'runtimes'
+    parallel_configs: bool = True
 
     # Build two copies of the builtins library:
     #  - A copy targeting the NDK with hidden symbols.
@@ -721,6 +720,7 @@ class LibOMPBuilder(base_builders.LLVMRuntimeBuilder):
 class LibNcursesBuilder(base_builders.AutoconfBuilder, base_builders.LibInfo):
     name: str = 'libncurses'
     src_dir: Path = paths.LIBNCURSES_SRC_DIR
+    cacheable: bool = True
 
     @property
     def config_flags(self) -> List[str]:
@@ -740,7 +740,9 @@ class LibNcursesBuilder(base_builders.AutoconfBuilder, base_builders.LibInfo):
 class LibEditBuilder(base_builders.AutoconfBuilder, base_builders.LibInfo):
     name: str = 'libedit'
     src_dir: Path = paths.LIBEDIT_SRC_DIR
+    cacheable: bool = True
     libncurses: base_builders.LibInfo
+    input_attrs: Tuple[str, ...] = ('libncurses',)
 
     @property
     def ldflags(self) -> List[str]:
@@ -764,6 +766,7 @@ class LibEditBuilder(base_builders.AutoconfBuilder, base_builders.LibInfo):
 class SwigBuilder(base_builders.AutoconfBuilder):
     name: str = 'swig'
     src_dir: Path = paths.SWIG_SRC_DIR
+    cacheable: bool = True
 
     @property
     def config_flags(self) -> List[str]:
@@ -792,6 +795,7 @@ class XzBuilder(base_builders.CMakeBuilder, base_builders.LibInfo):
     name: str = 'liblzma'
     src_dir: Path = paths.XZ_SRC_DIR
     static_lib: bool = True
+    cacheable: bool = True
 
     @property
     def cmake_defines(self) -> Dict[str, str]:
@@ -810,6 +814,7 @@ class ZstdBuilder(base_builders.CMakeBuilder, base_builders.LibInfo):
     name: str = 'libzstd'
     src_dir: Path = paths.ZSTD_SRC_DIR / 'build' / 'cmake'
     static_lib: bool = True
+    cacheable: bool = True
 
     @property
     def cmake_defines(self) -> Dict[str, str]:
@@ -825,6 +830,7 @@ class ZstdBuilder(base_builders.CMakeBuilder, base_builders.LibInfo):
 class LibXml2Builder(base_builders.CMakeBuilder, base_builders.LibInfo):
     name: str = 'libxml2'
     src_dir: Path = paths.LIBXML2_SRC_DIR
+    cacheable: bool = True
 
     @contextlib.contextmanager
     def _backup_file(self, file_to_backup: Path) -> Iterator[None]:
@@ -933,6 +939,22 @@ class LldbServerBuilder(base_builders.LLVMRuntimeBuilder):
 class HostSysrootsBuilder(base_builders.Builder):
     name: str = 'host-sysroots'
     config_list: List[configs.Config] = (configs.MinGWConfig(), configs.MinGWConfig(is_32_bit=True))
+    cacheable: bool = True
+
+    @property
+    def cache_outputs(self) -> List[Path]:
+        return [self._config.sysroot]
+
+    @property
+    def cache_sources(self) -> List[Path]:
+        return [self._config.gcc_root]
+
+    @property
+    def fingerprint_inputs(self) -> Dict[str, object]:
+        inputs = super().fingerprint_inputs
+        # Sysroots are copied from prebuilts, the toolchain isn't used.
+        del inputs['toolchain']
+        return inputs
 
     def _build_config(self) -> None:
         config = self._config
@@ -968,6 +990,23 @@ class DeviceSysrootsBuilder(base_builders.Builder):
         configs.android_configs(platform=True) +
         configs.android_configs(platform=False)
     )
+    cacheable: bool = True
+
+    @property
+    def cache_outputs(self) -> List[Path]:
+        return [self._config.sysroot]
+
+    @property
+    def cache_sources(self) -> List[Path]:
+        if self._config.target_arch == hosts.Arch.RISCV64:
+            return [paths.RISCV64_ANDROID_SYSROOT]
+        return [paths.NDK_BASE]
+
+    @property
+    def fingerprint_inputs(self) -> Dict[str, object]:
+        inputs = super().fingerprint_inputs
+        del inputs['toolchain']
+        return inputs
 
     def _build_config(self) -> None:
         config: configs.AndroidConfig = cast(configs.AndroidConfig, self._config)
@@ -1040,6 +1079,7 @@ class DeviceSysrootsBuilder(base_builders.Builder):
 class DeviceLibcxxBuilder(base_builders.LLVMRuntimeBuilder):
     name = 'device-libcxx'
     src_dir: Path = paths.LLVM_PATH / 'runtimes'
+    parallel_configs: bool = True
 
     config_list: List[configs.Config] = (
         configs.android_configs(platform=True, extra_config={'hwasan': False, 'noexcept': False}) +
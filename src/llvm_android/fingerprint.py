@@ -0,0 +1,112 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Fingerprints of build inputs, to tell whether a build step is up to date."""
+
+import functools
+import hashlib
+import json
+import os
+from pathlib import Path
+import subprocess
+from typing import Any, Optional
+
+from llvm_android import toolchains
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=str)
+    return str(obj)
+
+
+def digest(obj: Any) -> str:
+    """Returns the sha256 of a JSON-serializable object (Paths and sets are allowed)."""
+    data = json.dumps(obj, sort_keys=True, default=_json_default)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    # size and mtime_ns are only part of the cache key.
+    del size, mtime_ns
+    sha = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        while chunk := infile.read(1 << 20):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_digest(path: Path) -> str:
+    """Returns the sha256 of a file's contents."""
+    stat = os.stat(path)
+    return _file_digest(os.fspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def _git(args, cwd: Path) -> bytes:
+    return subprocess.run(['git'] + args, cwd=cwd, check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL).stdout
+
+
+def _git_tree_digest(src_dir: Path) -> Optional[str]:
+    """Digest of the git checkout containing src_dir, including local changes."""
+    try:
+        top = Path(os.fsdecode(_git(['rev-parse', '--show-toplevel'], src_dir).strip()))
+        sha = hashlib.sha256(_git(['rev-parse', 'HEAD^{tree}'], top))
+        sha.update(_git(['diff', 'HEAD', '--binary'], top))
+        untracked = _git(['ls-files', '-z', '--others', '--exclude-standard'], top)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    for name in sorted(untracked.split(b'\0')):
+        if name and (top / os.fsdecode(name)).is_file():
+            sha.update(name)
+            sha.update(file_digest(top / os.fsdecode(name)).encode())
+    return sha.hexdigest()
+
+
+def dir_digest(src_dir: Path) -> str:
+    """Returns a digest of all names and file contents under src_dir."""
+    sha = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames.sort()
+        for name in sorted(filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]):
+            path = Path(dirpath) / name
+            sha.update(os.fsencode(path.relative_to(src_dir)))
+            if path.is_symlink():
+                sha.update(os.fsencode(os.readlink(path)))
+            else:
+                sha.update(file_digest(path).encode())
+    return sha.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def tree_digest(src_dir: Path) -> str:
+    """Returns a digest of the contents of a source tree.
+
+    For git checkouts, the whole checkout is covered (a CMake project in a
+    subdirectory can use sources elsewhere in the repository).  The result is
+    cached, sources are assumed not to change once a build has started.
+    """
+    if not src_dir.exists():
+        return 'missing'
+    return _git_tree_digest(src_dir) or dir_digest(src_dir)
+
+
+def toolchain_digest(toolchain: toolchains.Toolchain) -> str:
+    """Identifies a toolchain by the contents of its compiler binary."""
+    clang = toolchain.cc.resolve()
+    if not clang.is_file():
+        return str(toolchain.path)
+    return file_digest(clang)
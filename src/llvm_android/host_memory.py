@@ -0,0 +1,121 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Sizes parallel compile and link jobs by the memory of the build host.
+
+The peak memory of the largest process (in practice the biggest link) of each
+LLVM build is recorded in a profile under paths.CACHE_DIR, so later builds
+know how much memory a link job needs.  Without a profile, conservative
+estimates are used.
+"""
+
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Optional
+
+from llvm_android import paths
+
+GiB = 1 << 30
+
+# Estimated peak memory of one job, used when no profile was recorded.
+DEFAULT_COMPILE_JOB_MEMORY = 1 * GiB
+DEFAULT_LINK_JOB_MEMORY = 2 * GiB
+DEFAULT_LTO_LINK_JOB_MEMORY = 8 * GiB
+
+# Leave some memory for the page cache and everything else on the host.
+USABLE_FRACTION = 0.85
+
+# A recorded peak that a later build doesn't reach shrinks by this factor per
+# build, so one unusually large run doesn't limit job counts forever.
+PEAK_DECAY = 0.9
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+def total_memory() -> Optional[int]:
+    """Returns the physical memory of the host in bytes, None if unknown.
+
+    MemTotal is used rather than MemAvailable: the job counts end up in CMake
+    defines, and should not change from one build to the next.
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        return None
+
+
+class MemoryProfiles:
+    """Peak memory of earlier builds, by builder name and config."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def _load(self) -> Dict[str, int]:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[int]:
+        """Returns the recorded peak memory in bytes for key."""
+        return self._load().get(key)
+
+    def record(self, key: str, peak_bytes: int) -> None:
+        """Records the peak memory of the latest build for key.
+
+        The recorded value is the larger of peak_bytes and the decayed earlier
+        peak, so a build that did less work doesn't lower it at once.
+        """
+        with self._lock:
+            profiles = self._load()
+            if key in profiles:
+                peak_bytes = max(peak_bytes, int(profiles[key] * PEAK_DECAY))
+            # Round up to a GiB, so small variations don't change the job counts.
+            peak_bytes = math.ceil(peak_bytes / GiB) * GiB
+            if profiles.get(key) == peak_bytes:
+                return
+            profiles[key] = peak_bytes
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.parent / (self.path.name + '.tmp')
+            tmp_path.write_text(json.dumps(profiles, indent=2, sort_keys=True))
+            os.replace(tmp_path, self.path)
+        logger().info('Peak memory of %s: %d GiB', key, peak_bytes // GiB)
+
+
+PROFILES = MemoryProfiles(paths.MEMORY_PROFILES)
+
+
+def parallel_jobs(job_memory: int, max_jobs: int) -> int:
+    """Returns how many jobs of job_memory bytes fit in memory, at most max_jobs."""
+    memory = total_memory()
+    if not memory:
+        return max_jobs
+    return max(1, min(max_jobs, int(memory * USABLE_FRACTION) // job_memory))
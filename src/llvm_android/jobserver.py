@@ -0,0 +1,150 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A process-wide job slot pool shared by all child builds.
+
+The pool is a GNU make jobserver using the named pipe protocol
+(--jobserver-auth=fifo:PATH), which is understood by make 4.4+ and ninja 1.13+.
+Every build tool invocation first takes one slot from the pool for itself (the
+"implicit" slot of a jobserver client) and the tool takes further slots for its
+parallel jobs.  Concurrently running builders therefore never run more than
+`slots` jobs in total.
+
+How many slots are in use, including those make and ninja take from the fifo,
+is sampled once a second and summarized in build_times.txt.
+"""
+
+import atexit
+import contextlib
+import fcntl
+import logging
+import os
+from pathlib import Path
+import shutil
+import struct
+import tempfile
+import termios
+import threading
+from typing import Dict, Iterator, Optional
+
+from llvm_android import timer
+
+SAMPLE_INTERVAL = 1.0
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+class JobServer:
+    """A GNU make compatible jobserver with a fixed number of slots."""
+
+    def __init__(self, slots: int) -> None:
+        self.slots = slots
+        self._tmp_dir = Path(tempfile.mkdtemp(prefix='llvm-jobserver-'))
+        self.fifo = self._tmp_dir / 'fifo'
+        os.mkfifo(self.fifo, 0o600)
+        # Keep a read-write handle open, so that clients never see EOF and
+        # writes never fail because there's no reader.
+        self._fd = os.open(self.fifo, os.O_RDWR)
+        os.write(self._fd, b'+' * slots)
+        self._samples = 0
+        self._total_in_use = 0
+        self._peak_in_use = 0
+        self._saturated = 0
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='jobserver-sampler',
+                                         daemon=True)
+        self._sampler.start()
+
+    @property
+    def makeflags(self) -> str:
+        """MAKEFLAGS for jobserver clients."""
+        return f'-j{self.slots} --jobserver-auth=fifo:{self.fifo}'
+
+    @contextlib.contextmanager
+    def slot(self, holder: str) -> Iterator[None]:
+        """Holds one slot on behalf of `holder` while the context is active."""
+        # The fifo's tokens are anonymous, holder only documents the caller.
+        del holder
+        token = os.read(self._fd, 1)
+        try:
+            yield
+        finally:
+            os.write(self._fd, token)
+
+    def in_use(self) -> int:
+        """Returns how many slots are taken from the fifo, by us or by clients."""
+        available, = struct.unpack('i', fcntl.ioctl(self._fd, termios.FIONREAD, b'\0' * 4))
+        return self.slots - available
+
+    def _sample(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            in_use = self.in_use()
+            self._samples += 1
+            self._total_in_use += in_use
+            self._peak_in_use = max(self._peak_in_use, in_use)
+            self._saturated += in_use >= self.slots
+            timer.Timer.jobserver_usage = {
+                'slots': self.slots,
+                'peak in use': self._peak_in_use,
+                'average in use': round(self._total_in_use / self._samples, 1),
+                '% of time all in use': round(100 * self._saturated / self._samples),
+            }
+
+    def close(self) -> None:
+        """Stops sampling and removes the fifo."""
+        self._stop.set()
+        self._sampler.join()
+        os.close(self._fd)
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+_JOBSERVER: Optional[JobServer] = None
+
+
+def start(slots: Optional[int] = None) -> JobServer:
+    """Creates the process-wide jobserver.  Defaults to one slot per core."""
+    global _JOBSERVER  # pylint: disable=global-statement
+    if _JOBSERVER is not None:
+        raise RuntimeError('jobserver is already started')
+    _JOBSERVER = JobServer(slots or os.cpu_count())
+    atexit.register(_JOBSERVER.close)
+    logger().info('Started jobserver with %d slots at %s', _JOBSERVER.slots, _JOBSERVER.fifo)
+    return _JOBSERVER
+
+
+def get() -> Optional[JobServer]:
+    """Returns the process-wide jobserver, or None if it isn't started."""
+    return _JOBSERVER
+
+
+@contextlib.contextmanager
+def job_slot(holder: str) -> Iterator[None]:
+    """Holds a slot from the process-wide jobserver, if there is one."""
+    if _JOBSERVER is None:
+        yield
+    else:
+        with _JOBSERVER.slot(holder):
+            yield
+
+
+def client_env(env: Dict[str, str]) -> Dict[str, str]:
+    """Returns a copy of env that makes make and ninja use the jobserver."""
+    env = dict(env)
+    if _JOBSERVER is not None:
+        env['MAKEFLAGS'] = _JOBSERVER.makeflags
+    return env
@@ -0,0 +1,127 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A persistent journal of completed build steps, used to resume a failed build.
+
+Each completed step is recorded with the fingerprint of its inputs, and
+optionally its result.  When resuming, a step is skipped if it completed before
+with the same fingerprint, and its recorded result is returned instead.  Once a
+step has to run, all later steps run as well, since they may consume its new
+outputs.  That only gives the same skips from one build to the next if steps
+run in a fixed order, so builds that resume run them one at a time.
+
+Journaling is opt-in: without a journal, steps don't compute fingerprints.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from llvm_android import fingerprint
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+class Journal:
+    """Completed steps, their input fingerprints and results, stored in a JSON file."""
+
+    def __init__(self, path: Path, resume: bool) -> None:
+        self.path = path
+        self._resuming = resume
+        self._lock = threading.Lock()
+        # step -> {input fingerprint: recorded result}
+        self._steps: Dict[str, Dict[str, Any]] = {}
+        if resume and path.exists():
+            steps = json.loads(path.read_text())
+            if all(isinstance(records, dict) for records in steps.values()):
+                self._steps = steps
+        self._write()
+
+    def _write(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.parent / (self.path.name + '.tmp')
+        tmp_path.write_text(json.dumps(self._steps, indent=2, sort_keys=True))
+        os.replace(tmp_path, self.path)
+
+    def should_skip(self, step: str, input_fingerprint: str) -> Tuple[bool, Any]:
+        """Tests whether step completed earlier with the same inputs.
+
+        Returns whether to skip the step and its recorded result.  If it is
+        not skipped, the step is marked incomplete and resuming stops."""
+        with self._lock:
+            records = self._steps.get(step, {})
+            if self._resuming and input_fingerprint in records:
+                logger().info('Resume: skipping %s, completed in an earlier build', step)
+                return True, records[input_fingerprint]
+            if self._resuming:
+                logger().info('Resume: continuing from %s', step)
+                self._resuming = False
+            if input_fingerprint in records:
+                del records[input_fingerprint]
+                self._write()
+            return False, None
+
+    def complete(self, step: str, input_fingerprint: str, result: Any = None) -> None:
+        """Records that step completed, with a JSON-serializable result."""
+        with self._lock:
+            self._steps.setdefault(step, {})[input_fingerprint] = result
+            self._write()
+
+
+_JOURNAL: Optional[Journal] = None
+
+
+def open_journal(path: Path, resume: bool) -> Journal:
+    """Opens the journal for this build.  Without resume, prior records are dropped.
+
+    Until this is called, steps are not journaled."""
+    global _JOURNAL  # pylint: disable=global-statement
+    _JOURNAL = Journal(path, resume)
+    return _JOURNAL
+
+
+def get() -> Optional[Journal]:
+    """Returns the journal, or None if there is none."""
+    return _JOURNAL
+
+
+# Converts a step's result to JSON-serializable data and back.
+ResultCodec = Tuple[Callable[[Any], Any], Callable[[Any], Any]]
+
+
+def run_step(step: str, inputs: Callable[[], Any], func: Callable, *args,
+             result_codec: Optional[ResultCodec] = None, **kwargs) -> Any:
+    """Runs func(*args, **kwargs) as a journaled step.
+
+    inputs() returns what the step depends on.  It is only called if there is
+    a journal, since fingerprinting it can be expensive.  If the step is
+    skipped, func isn't called, and the result recorded through result_codec
+    is returned (None without a codec).
+    """
+    if _JOURNAL is None:
+        return func(*args, **kwargs)
+    input_fingerprint = fingerprint.digest(inputs())
+    skip, recorded = _JOURNAL.should_skip(step, input_fingerprint)
+    if skip:
+        return result_codec[1](recorded) if result_codec else None
+    result = func(*args, **kwargs)
+    _JOURNAL.complete(step, input_fingerprint, result_codec[0](result) if result_codec else None)
+    return result
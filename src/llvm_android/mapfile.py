@@ -18,12 +18,25 @@
 
 from pathlib import Path
 import sys
-import subprocess
+from typing import List
+
+from llvm_android import objfile
+
+
+def exported_symbols(lib_file: Path) -> List[objfile.Symbol]:
+    """Returns the symbols `nm -g --defined-only` lists, sorted by name.
+
+    The static symbol table is used, like nm does.  If lib_file is stripped,
+    the dynamic symbol table is used instead.
+    """
+    info = objfile.read(lib_file)
+    symbols = info.symbols or info.dynamic_symbols
+    return sorted((s for s in symbols if s.external and s.defined),
+                  key=lambda s: s.name.encode())
+
 
 def create_map_file(lib_file: Path, map_file: Path, section_name: str) -> None:
     """Creates a map_file for lib_file."""
-    symbols = subprocess.check_output(['nm', '-g', '--defined-only', str(lib_file)],
-                                      text=True)
     use_apex = 'libclang_rt.hwasan-aarch64-android.map.txt' == map_file.name
     # Number of symbols with map annotations
     num_symbols_annotated = 0
@@ -31,9 +44,9 @@ def create_map_file(lib_file: Path, map_file: Path, section_name: str) -> None:
         output.write('# AUTO-GENERATED by mapfile.py. DO NOT EDIT.\n')
         output.write(f'{{\n')
         output.write('  global:\n')
-        for line in symbols.splitlines():
-            _, symbol_type, symbol_name = line.split(' ', 2)
-            if symbol_type in ['T', 'W', 'B', 'i']:
+        for symbol in exported_symbols(lib_file):
+            symbol_name = symbol.name
+            if symbol.nm_type in ['T', 'W', 'B', 'i']:
                 # Add the API surface annotations to libclang_rt.* symbols.
                 # These annotations will be used to generate libclang_rt.* stubs.
                 # system and llndk indicate that these symbols are available to
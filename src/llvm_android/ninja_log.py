@@ -0,0 +1,219 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Summarizes where time went in the ninja builds of CMake builders.
+
+ninja appends one line per output to <build dir>/.ninja_log: start and end
+time in milliseconds since the start of that ninja run, the output's mtime,
+its path and a hash of the command.  Outputs of one edge (command) share the
+start time, end time and hash.
+"""
+
+import atexit
+import bisect
+import dataclasses
+from datetime import timedelta
+import logging
+from pathlib import Path
+import threading
+from typing import Dict, List, Tuple
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+LINK_SUFFIXES = ('.so', '.a', '.dylib', '.dll', '.exe', '.lib')
+
+
+@dataclasses.dataclass
+class Edge:
+    """A command run by ninja."""
+    start: int
+    end: int
+    outputs: List[str]
+
+    @property
+    def duration(self) -> int:
+        return self.end - self.start
+
+    @property
+    def kind(self) -> str:
+        """'compile', 'link' or 'other', guessed from the output names."""
+        output = self.outputs[0]
+        if output.endswith(('.o', '.obj')):
+            return 'compile'
+        if output.endswith(LINK_SUFFIXES) or '/bin/' in output or output.startswith('bin/'):
+            return 'link'
+        return 'other'
+
+
+def _read_entries(log_file: Path, offset: int) -> List[Tuple[int, int, str, str]]:
+    """Reads (start, end, output, hash) entries of the ninja run that began at offset."""
+    with log_file.open('rb') as infile:
+        data = infile.read()
+    if offset > len(data) or (offset and data[offset - 1:offset] != b'\n'):
+        # ninja recompacted the log.  Fall back to the last run in it.
+        offset = 0
+    entries = []
+    for line in data[offset:].decode(errors='replace').splitlines():
+        if line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        if len(fields) != 5:
+            continue
+        entries.append((int(fields[0]), int(fields[1]), fields[3], fields[4]))
+    # Times restart at 0 for every ninja run, so a run starts where the end
+    # time goes back.  Only keep the last one.
+    last_run = 0
+    for i in range(1, len(entries)):
+        if entries[i][1] < entries[i - 1][1] and entries[i][0] < entries[i - 1][0]:
+            last_run = i
+    return entries[last_run:]
+
+
+def read_edges(log_file: Path, offset: int = 0) -> List[Edge]:
+    """Returns the edges of the ninja run that began at offset in log_file."""
+    edges: Dict[Tuple[int, int, str], Edge] = {}
+    for start, end, output, cmd_hash in _read_entries(log_file, offset):
+        key = (start, end, cmd_hash)
+        if key in edges:
+            edges[key].outputs.append(output)
+        else:
+            edges[key] = Edge(start, end, [output])
+    return sorted(edges.values(), key=lambda edge: (edge.start, edge.end))
+
+
+def critical_path(edges: List[Edge]) -> List[Edge]:
+    """Estimates the chain of edges that determined when the build finished.
+
+    .ninja_log doesn't record dependencies.  Starting from the edge that finished
+    last, this repeatedly picks the edge that finished last before the current
+    one started, which is the edge ninja was most likely waiting for.
+    """
+    if not edges:
+        return []
+    by_end = sorted(edges, key=lambda edge: edge.end)
+    ends = [edge.end for edge in by_end]
+    path = [by_end[-1]]
+    while True:
+        index = bisect.bisect_right(ends, path[-1].start)
+        if index == 0:
+            break
+        path.append(by_end[index - 1])
+    path.reverse()
+    return path
+
+
+def parallelism(edges: List[Edge], buckets: int = 10) -> Tuple[float, List[float]]:
+    """Returns the average number of running edges, overall and per time bucket."""
+    if not edges:
+        return 0.0, []
+    begin = min(edge.start for edge in edges)
+    finish = max(edge.end for edge in edges)
+    wall = max(finish - begin, 1)
+    busy = [0.0] * buckets
+    width = wall / buckets
+    for edge in edges:
+        for i in range(buckets):
+            lo = begin + i * width
+            hi = lo + width
+            overlap = min(edge.end, hi) - max(edge.start, lo)
+            if overlap > 0:
+                busy[i] += overlap
+    total = sum(edge.duration for edge in edges)
+    return total / wall, [b / width for b in busy]
+
+
+def summarize(name: str, edges: List[Edge], top: int = 10) -> str:
+    """Returns a text summary of one ninja run."""
+    pretty_print = lambda ms: str(timedelta(seconds=int(ms / 1000)))
+    if not edges:
+        return f'{name}: nothing was built\n'
+    wall = max(edge.end for edge in edges) - min(edge.start for edge in edges)
+    average, buckets = parallelism(edges)
+    lines = [f'{name}: {len(edges)} edges, {pretty_print(wall)} wall, '
+             f'average parallelism {average:.1f}']
+
+    for kind in ('compile', 'link', 'other'):
+        kind_edges = [edge for edge in edges if edge.kind == kind]
+        if kind_edges:
+            lines.append(f'  {kind}: {len(kind_edges)} edges, '
+                         f'{pretty_print(sum(edge.duration for edge in kind_edges))} total')
+    lines.append('  parallelism per tenth of the build: ' +
+                 ' '.join(f'{b:.1f}' for b in buckets))
+
+    path = critical_path(edges)
+    lines.append(f'  critical path (estimated): {len(path)} edges, '
+                 f'{pretty_print(sum(edge.duration for edge in path))} busy')
+    for edge in sorted(path, key=lambda edge: edge.duration, reverse=True)[:top]:
+        lines.append(f'    {pretty_print(edge.duration)} {edge.outputs[0]}')
+
+    for kind in ('compile', 'link'):
+        slowest = sorted((edge for edge in edges if edge.kind == kind),
+                         key=lambda edge: edge.duration, reverse=True)[:top]
+        if slowest:
+            lines.append(f'  slowest {kind} edges:')
+            lines.extend(f'    {pretty_print(edge.duration)} {edge.outputs[0]}'
+                         for edge in slowest)
+    return '\n'.join(lines) + '\n'
+
+
+class NinjaLogs:
+    """The ninja runs of this build, to be summarized at exit."""
+    # (name, build dir, offset of the run in .ninja_log)
+    runs: List[Tuple[str, Path, int]] = []
+    lock = threading.Lock()
+
+    @staticmethod
+    def log_offset(build_dir: Path) -> int:
+        """Returns where the next ninja run in build_dir will start logging."""
+        log_file = build_dir / '.ninja_log'
+        return log_file.stat().st_size if log_file.exists() else 0
+
+    @classmethod
+    def add_run(cls, name: str, build_dir: Path, offset: int) -> None:
+        """Records that a ninja run for name logged to build_dir from offset."""
+        with cls.lock:
+            cls.runs.append((name, build_dir, offset))
+
+    @classmethod
+    def report(cls) -> str:
+        """Returns summaries of all recorded ninja runs."""
+        summaries = []
+        for name, build_dir, offset in cls.runs:
+            log_file = build_dir / '.ninja_log'
+            if not log_file.exists():
+                continue
+            summaries.append(summarize(name, read_edges(log_file, offset)))
+        return '\n'.join(summaries)
+
+    @classmethod
+    def report_to_file(cls, outfile: Path) -> None:
+        if not cls.runs:
+            return
+        try:
+            report = cls.report()
+        except (OSError, ValueError) as e:
+            logger().warning('Failed to summarize ninja logs: %s', e)
+            return
+        with open(outfile, 'w') as out:
+            out.write(report)
+
+    @classmethod
+    def register_atexit(cls, outfile: Path) -> None:
+        """Register report_to_file(outfile) to run at exit."""
+        atexit.register(cls.report_to_file, outfile)
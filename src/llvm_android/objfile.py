@@ -0,0 +1,317 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Reads the dynamic linking information of ELF and Mach-O files in process.
+
+read() maps a file and returns its SONAME (or Mach-O install name), needed
+libraries, build ID and, for ELF, its symbols, with the type letter nm would
+print for each.  Results are cached by path, size and mtime, so reading the
+same library again is free until it is rebuilt.
+
+Only what the build needs is supported: Mach-O files give no symbols, and the
+first architecture of a universal binary is read.
+"""
+
+import dataclasses
+import functools
+import mmap
+import os
+from pathlib import Path
+import struct
+from typing import List, Optional, Tuple
+
+_ELF_MAGIC = b'\x7fELF'
+
+# Section types.
+_SHT_SYMTAB = 2
+_SHT_DYNAMIC = 6
+_SHT_NOTE = 7
+_SHT_NOBITS = 8
+_SHT_DYNSYM = 11
+
+# Section flags.
+_SHF_WRITE = 0x1
+_SHF_ALLOC = 0x2
+_SHF_EXECINSTR = 0x4
+
+# Special section indices.
+_SHN_UNDEF = 0
+_SHN_LORESERVE = 0xff00
+_SHN_ABS = 0xfff1
+_SHN_COMMON = 0xfff2
+
+# Dynamic tags.
+_DT_NULL = 0
+_DT_NEEDED = 1
+_DT_SONAME = 14
+
+# Symbol bindings and types.
+_STB_LOCAL = 0
+_STB_WEAK = 2
+_STB_GNU_UNIQUE = 10
+_STT_OBJECT = 1
+_STT_SECTION = 3
+_STT_FILE = 4
+_STT_GNU_IFUNC = 10
+
+_NT_GNU_BUILD_ID = 3
+
+# Mach-O magics, as read little-endian, and load commands.
+_MH_MAGIC = 0xfeedface
+_MH_MAGIC_64 = 0xfeedfacf
+_FAT_MAGIC = 0xcafebabe
+_FAT_MAGIC_64 = 0xcafebabf
+_LC_LOAD_DYLIB = 0xc
+_LC_ID_DYLIB = 0xd
+_LC_UUID = 0x1b
+_LC_LOAD_WEAK_DYLIB = 0x80000018
+_LC_REEXPORT_DYLIB = 0x8000001f
+
+
+@dataclasses.dataclass(frozen=True)
+class Symbol:
+    """A symbol and its type letter in nm output ('T', 'W', 'U', ...)."""
+    name: str
+    nm_type: str
+    # Global, weak or unique, i.e. listed by `nm -g`.
+    external: bool
+
+    @property
+    def defined(self) -> bool:
+        return self.nm_type not in ('U', 'w', 'v')
+
+
+@dataclasses.dataclass(frozen=True)
+class ObjectInfo:
+    """Dynamic linking information of an ELF or Mach-O file."""
+    # 'elf' or 'macho'.
+    format: str
+    # DT_SONAME, or the LC_ID_DYLIB install name.
+    soname: Optional[str]
+    # DT_NEEDED entries, or the install names of LC_LOAD_DYLIB and friends.
+    needed: Tuple[str, ...]
+    # Hex of the GNU build ID note, or of LC_UUID.
+    build_id: Optional[str]
+    # .dynsym and .symtab, without the null symbol, in file order.
+    dynamic_symbols: Tuple[Symbol, ...] = ()
+    symbols: Tuple[Symbol, ...] = ()
+
+
+def _cstr(data, offset: int) -> str:
+    end = data.find(b'\0', offset)
+    return data[offset:end].decode('utf-8', errors='replace')
+
+
+@dataclasses.dataclass
+class _Section:
+    name: int
+    type: int
+    flags: int
+    offset: int
+    size: int
+    link: int
+    addralign: int
+    entsize: int
+
+
+class _ElfReader:
+    """Parses the section headers of an ELF file."""
+
+    def __init__(self, data) -> None:
+        self.data = data
+        ei_class, ei_data = data[4], data[5]
+        if ei_class not in (1, 2) or ei_data not in (1, 2):
+            raise ValueError('Bad ELF identification')
+        self.is_64 = ei_class == 2
+        self.endian = '<' if ei_data == 1 else '>'
+        if self.is_64:
+            shoff, = self._unpack('Q', 0x28)
+            shentsize, shnum = self._unpack('HH', 0x3a)
+        else:
+            shoff, = self._unpack('I', 0x20)
+            shentsize, shnum = self._unpack('HH', 0x2e)
+        self.sections: List[_Section] = []
+        if not shoff:
+            return
+        # Large counts are stored in the first section header.
+        shnum = shnum or self._section(shoff).size
+        self.sections = [self._section(shoff + i * shentsize) for i in range(shnum)]
+
+    def _unpack(self, fmt: str, offset: int) -> tuple:
+        return struct.unpack_from(self.endian + fmt, self.data, offset)
+
+    def _section(self, offset: int) -> _Section:
+        if self.is_64:
+            name, type_, flags, _, off, size, link, _, align, entsize = self._unpack(
+                'IIQQQQIIQQ', offset)
+        else:
+            name, type_, flags, _, off, size, link, _, align, entsize = self._unpack(
+                'IIIIIIIIII', offset)
+        return _Section(name, type_, flags, off, size, link, align, entsize)
+
+    def _string(self, strtab: _Section, offset: int) -> str:
+        return _cstr(self.data, strtab.offset + offset)
+
+    def dynamic(self) -> Tuple[Optional[str], Tuple[str, ...]]:
+        """Returns DT_SONAME and the DT_NEEDED entries."""
+        soname = None
+        needed = []
+        fmt, size = ('qQ', 16) if self.is_64 else ('iI', 8)
+        for section in self.sections:
+            if section.type != _SHT_DYNAMIC:
+                continue
+            strtab = self.sections[section.link]
+            for offset in range(section.offset, section.offset + section.size, size):
+                tag, value = self._unpack(fmt, offset)
+                if tag == _DT_NULL:
+                    break
+                if tag == _DT_NEEDED:
+                    needed.append(self._string(strtab, value))
+                elif tag == _DT_SONAME:
+                    soname = self._string(strtab, value)
+        return soname, tuple(needed)
+
+    def build_id(self) -> Optional[str]:
+        for section in self.sections:
+            if section.type != _SHT_NOTE or section.flags & _SHF_ALLOC == 0:
+                continue
+            align = 8 if section.addralign == 8 else 4
+            offset, end = section.offset, section.offset + section.size
+            while offset + 12 <= end:
+                namesz, descsz, note_type = self._unpack('III', offset)
+                name_offset = offset + 12
+                desc_offset = name_offset + (namesz + align - 1) // align * align
+                if note_type == _NT_GNU_BUILD_ID and \
+                        self.data[name_offset:name_offset + namesz] == b'GNU\0':
+                    return self.data[desc_offset:desc_offset + descsz].hex()
+                offset = desc_offset + (descsz + align - 1) // align * align
+        return None
+
+    def _nm_type(self, bind: int, sym_type: int, shndx: int) -> str:
+        """Returns the letter GNU nm prints for a symbol."""
+        if shndx == _SHN_UNDEF:
+            if bind == _STB_WEAK:
+                return 'v' if sym_type == _STT_OBJECT else 'w'
+            return 'U'
+        if sym_type == _STT_GNU_IFUNC:
+            return 'i'
+        if bind == _STB_WEAK:
+            return 'V' if sym_type == _STT_OBJECT else 'W'
+        if bind == _STB_GNU_UNIQUE:
+            return 'u'
+        if shndx == _SHN_ABS:
+            letter = 'A'
+        elif shndx == _SHN_COMMON:
+            letter = 'C'
+        elif shndx >= _SHN_LORESERVE:
+            letter = '?'
+        else:
+            section = self.sections[shndx]
+            if section.flags & _SHF_EXECINSTR:
+                letter = 'T'
+            elif section.type == _SHT_NOBITS and section.flags & _SHF_ALLOC:
+                letter = 'B'
+            elif section.flags & _SHF_ALLOC:
+                letter = 'D' if section.flags & _SHF_WRITE else 'R'
+            else:
+                letter = 'N'
+        return letter.lower() if bind == _STB_LOCAL else letter
+
+    def symbols(self, section_type: int) -> Tuple[Symbol, ...]:
+        fmt, size = ('IBBHQQ', 24) if self.is_64 else ('IIIBBH', 16)
+        result = []
+        for section in self.sections:
+            if section.type != section_type:
+                continue
+            strtab = self.sections[section.link]
+            # Skip the null symbol.
+            for offset in range(section.offset + size, section.offset + section.size, size):
+                if self.is_64:
+                    name, info, _, shndx, _, _ = self._unpack(fmt, offset)
+                else:
+                    name, _, _, info, _, shndx = self._unpack(fmt, offset)
+                bind, sym_type = info >> 4, info & 0xf
+                if sym_type in (_STT_SECTION, _STT_FILE):
+                    continue
+                result.append(Symbol(self._string(strtab, name),
+                                     self._nm_type(bind, sym_type, shndx),
+                                     bind != _STB_LOCAL))
+        return tuple(result)
+
+
+def _read_elf(data) -> ObjectInfo:
+    reader = _ElfReader(data)
+    soname, needed = reader.dynamic()
+    return ObjectInfo('elf', soname, needed, reader.build_id(),
+                      reader.symbols(_SHT_DYNSYM), reader.symbols(_SHT_SYMTAB))
+
+
+def _read_macho(data, offset: int) -> ObjectInfo:
+    magic, = struct.unpack_from('<I', data, offset)
+    if magic not in (_MH_MAGIC, _MH_MAGIC_64):
+        raise ValueError('Unsupported Mach-O file')
+    ncmds, = struct.unpack_from('<I', data, offset + 16)
+    cmd_offset = offset + (32 if magic == _MH_MAGIC_64 else 28)
+    soname = None
+    needed = []
+    build_id = None
+    for _ in range(ncmds):
+        cmd, cmdsize = struct.unpack_from('<II', data, cmd_offset)
+        if cmd in (_LC_ID_DYLIB, _LC_LOAD_DYLIB, _LC_LOAD_WEAK_DYLIB, _LC_REEXPORT_DYLIB):
+            name_offset, = struct.unpack_from('<I', data, cmd_offset + 8)
+            name = _cstr(data, cmd_offset + name_offset)
+            if cmd == _LC_ID_DYLIB:
+                soname = name
+            else:
+                needed.append(name)
+        elif cmd == _LC_UUID:
+            build_id = data[cmd_offset + 8:cmd_offset + 24].hex()
+        cmd_offset += cmdsize
+    return ObjectInfo('macho', soname, tuple(needed), build_id)
+
+
+def _read_fat(data) -> ObjectInfo:
+    magic, nfat_arch = struct.unpack_from('>II', data, 0)
+    if not nfat_arch:
+        raise ValueError('Empty universal binary')
+    # All architectures have the same install name and dependencies.
+    if magic == _FAT_MAGIC_64:
+        offset, = struct.unpack_from('>Q', data, 8 + 8)
+    else:
+        offset, = struct.unpack_from('>I', data, 8 + 8)
+    return _read_macho(data, offset)
+
+
+@functools.lru_cache(maxsize=None)
+def _read(path: str, size: int, mtime_ns: int) -> ObjectInfo:
+    # size and mtime_ns are only part of the cache key.
+    del size, mtime_ns
+    with open(path, 'rb') as infile, \
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:4] == _ELF_MAGIC:
+            return _read_elf(data)
+        magic, = struct.unpack_from('<I', data, 0)
+        if magic in (_MH_MAGIC, _MH_MAGIC_64):
+            return _read_macho(data, 0)
+        magic, = struct.unpack_from('>I', data, 0)
+        if magic in (_FAT_MAGIC, _FAT_MAGIC_64):
+            return _read_fat(data)
+    raise ValueError(f'{path} is not an ELF or Mach-O file')
+
+
+def read(path: Path) -> ObjectInfo:
+    """Returns the dynamic linking information of an ELF or Mach-O file."""
+    stat = os.stat(path)
+    return _read(os.fspath(path), stat.st_size, stat.st_mtime_ns)
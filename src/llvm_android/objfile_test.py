@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint: disable=invalid-name
+import os
+import sys
+import re
+from pathlib import Path
+import subprocess
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../.."))
+
+import context
+from llvm_android import (mapfile, objfile)
+
+# Defines a symbol of each kind nm tells apart.
+TEST_LIB_SOURCE = '''
+extern int dep_value(void);
+
+int global_data = 1;
+const int global_rodata = 2;
+int global_bss;
+__thread int global_tls;
+static int local_data = 3;
+
+int global_func(void) { return dep_value() + local_data; }
+__attribute__((weak)) int weak_func(void) { return 4; }
+__attribute__((weak)) int weak_data = 5;
+__attribute__((weak)) extern int undefined_weak(void);
+static int local_func(void) { return undefined_weak ? undefined_weak() : 6; }
+int call_local(void) { return local_func(); }
+
+static int impl(void) { return 7; }
+static int (*resolve_ifunc(void))(void) { return impl; }
+int ifunc_func(void) __attribute__((ifunc("resolve_ifunc")));
+'''
+
+DEP_LIB_SOURCE = 'int dep_value(void) { return 0; }\n'
+
+
+def build_libs(tmp_dir: Path) -> tuple[Path, Path]:
+    dep_lib = tmp_dir / 'libdep.so'
+    (tmp_dir / 'dep.c').write_text(DEP_LIB_SOURCE)
+    subprocess.check_call(['gcc', '-shared', '-fPIC', '-Wl,-soname,libdep.so',
+                           '-o', str(dep_lib), str(tmp_dir / 'dep.c')])
+
+    lib = tmp_dir / 'libtest.so'
+    (tmp_dir / 'test.c').write_text(TEST_LIB_SOURCE)
+    subprocess.check_call(['gcc', '-shared', '-fPIC', '-Wl,-soname,libtest.so.1',
+                           '-Wl,--build-id', '-o', str(lib), str(tmp_dir / 'test.c'),
+                           '-L', str(tmp_dir), '-ldep'])
+    return (lib, dep_lib)
+
+
+def run_tool(cmd: list) -> str:
+    return subprocess.check_output(cmd, env={**os.environ, 'LC_ALL': 'C'}, text=True)
+
+
+def nm_exported_symbols(lib: Path, *args: str) -> list:
+    symbols = []
+    for line in run_tool(['nm', '-g', '--defined-only', *args, str(lib)]).splitlines():
+        _, nm_type, name = line.split()
+        symbols.append((name, nm_type))
+    return symbols
+
+
+def readelf_dynamic(lib: Path) -> tuple:
+    soname = None
+    needed = []
+    for line in run_tool(['readelf', '-d', str(lib)]).splitlines():
+        found = re.search(r'\((SONAME|NEEDED)\).*\[(.*)\]$', line)
+        if not found:
+            continue
+        if found.group(1) == 'SONAME':
+            soname = found.group(2)
+        else:
+            needed.append(found.group(2))
+    return (soname, tuple(needed))
+
+
+def readelf_build_id(lib: Path) -> str:
+    found = re.search(r'Build ID: ([0-9a-f]+)', run_tool(['readelf', '-n', str(lib)]))
+    return found.group(1)
+
+
+def exported_symbols_test(lib: Path, tmp_dir: Path):
+    symbols = [(s.name, s.nm_type) for s in mapfile.exported_symbols(lib)]
+    assert(symbols == nm_exported_symbols(lib))
+    names = {name for name, _ in symbols}
+    for name in ['global_data', 'global_rodata', 'global_bss', 'global_tls', 'global_func',
+                 'weak_func', 'weak_data', 'ifunc_func']:
+        assert(name in names)
+    assert('local_data' not in names and 'undefined_weak' not in names)
+
+    # A stripped library only has the dynamic symbol table, which nm reads with -D.
+    stripped = tmp_dir / 'libtest.stripped.so'
+    subprocess.check_call(['strip', '-o', str(stripped), str(lib)])
+    symbols = [(s.name, s.nm_type) for s in mapfile.exported_symbols(stripped)]
+    assert(symbols == nm_exported_symbols(stripped, '-D'))
+
+
+def dynamic_test(lib: Path, dep_lib: Path):
+    info = objfile.read(lib)
+    assert(info.format == 'elf')
+    assert((info.soname, info.needed) == readelf_dynamic(lib))
+    assert(info.soname == 'libtest.so.1' and 'libdep.so' in info.needed)
+    assert(info.build_id == readelf_build_id(lib))
+
+    info = objfile.read(dep_lib)
+    assert((info.soname, info.needed) == readelf_dynamic(dep_lib))
+
+
+def objfile_test(tmp_dir):
+    tmp_dir_Path = Path(tmp_dir)
+    (lib, dep_lib) = build_libs(tmp_dir_Path)
+    exported_symbols_test(lib, tmp_dir_Path)
+    dynamic_test(lib, dep_lib)
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        objfile_test(tmp_dir)
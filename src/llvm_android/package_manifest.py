@@ -0,0 +1,273 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Which files of an LLVM install go into a toolchain package.
+
+A package contains the whole install, except for the binaries in bin/ and the
+static libraries directly in lib/ that aren't listed in its manifest.  Only
+the files in the manifest are materialized in the package directory, as
+reflinks or hardlinks of the install where the filesystem allows it.
+
+Hardlinked files are shared with the install, so files of a package must be
+replaced (unlinked and written anew), not modified in place.  llvm-strip
+replaces its output.
+"""
+
+import dataclasses
+import errno
+import logging
+import os
+from pathlib import Path
+import shutil
+import sys
+from typing import Optional, Set
+
+from llvm_android import hosts
+
+# Binaries of every package, without the executable extension.
+_BIN_FILES = (
+    'clang',
+    'clang++',
+    'clang-check',
+    'clang-cl',
+    'clang-format',
+    'clang-scan-deps',
+    'clang-tidy',
+    'clangd',
+    'dsymutil',
+    'ld.lld',
+    'ld64.lld',
+    'lld',
+    'lld-link',
+    'llvm-addr2line',
+    'llvm-ar',
+    'llvm-as',
+    'llvm-bolt',
+    'llvm-cfi-verify',
+    'llvm-config',
+    'llvm-cov',
+    'llvm-cxxfilt',
+    'llvm-dis',
+    'llvm-dlltool',
+    'llvm-dwarfdump',
+    'llvm-dwp',
+    'llvm-ifs',
+    'llvm-lib',
+    'llvm-link',
+    'llvm-lipo',
+    'llvm-modextract',
+    'llvm-ml',
+    'llvm-nm',
+    'llvm-objcopy',
+    'llvm-objdump',
+    'llvm-profdata',
+    'llvm-ranlib',
+    'llvm-rc',
+    'llvm-readelf',
+    'llvm-readobj',
+    'llvm-size',
+    'llvm-strings',
+    'llvm-strip',
+    'llvm-symbolizer',
+    'llvm-windres',
+    'merge-fdata',
+    'perf2bolt',
+    'sancov',
+    'sanstats',
+    'scan-build',
+    'scan-view',
+    'wasm-ld',
+)
+
+_WINDOWS_EXCLUDED_BIN_FILES = (
+    'clangd',
+    'llvm-bolt',
+    'merge-fdata',
+    'perf2bolt',
+    'scan-build',
+    'scan-view',
+)
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+def executable_ext(host: hosts.Host) -> str:
+    return '.exe' if host.is_windows else ''
+
+
+def script_ext(host: hosts.Host) -> str:
+    return '.cmd' if host.is_windows else '.sh'
+
+
+def bin_files(host: hosts.Host, major_version: str, build_lldb: bool,
+              extra: Optional[Set[str]] = None) -> Set[str]:
+    """Returns the names of the binaries in bin/ of a release package."""
+    ext = executable_ext(host)
+    result = set(extra or ())
+    result |= {name + ext for name in _BIN_FILES}
+    result.add('clang-' + major_version + ext)
+    result.add('git-clang-format')  # No extension here
+    if build_lldb:
+        result |= {'lldb-argdumper' + ext, 'lldb' + ext, 'lldb' + script_ext(host)}
+    if host.is_windows:
+        result -= {name + ext for name in _WINDOWS_EXCLUDED_BIN_FILES}
+        result.discard('clang-' + major_version + ext)
+        result.add('libclang.dll')
+    return result
+
+
+def script_bins(host: hosts.Host) -> Set[str]:
+    """Returns the names of the files in bin/ that should not be stripped."""
+    return {
+        'git-clang-format',
+        'lldb' + script_ext(host),
+        # merge-fdata is built with relocation, strip -S would fail. Treat it as
+        # a script and do not strip as a workaround.
+        'merge-fdata' + executable_ext(host),
+        'scan-build',
+        'scan-view',
+    }
+
+
+def lib_files(host: hosts.Host, with_runtimes: bool, win_sdk_enabled: bool) -> Set[str]:
+    """Returns the names of the runtime libraries a package must contain."""
+    result: Set[str] = set()
+    if not with_runtimes:
+        return result
+    if not (host.is_windows and win_sdk_enabled):
+        result |= {
+            'libc++.a',
+            'libc++abi.a',
+        }
+    if host.is_linux:
+        result |= {
+            'libbolt_rt_instr.a',
+            'libc++.so',
+            'libc++.so.1',
+            'libc++abi.so',
+            'libc++abi.so.1',
+            'libsimpleperf_readelf.a',
+        }
+    if host.is_darwin:
+        result |= {
+            'libc++.dylib',
+            'libc++abi.dylib',
+            'libsimpleperf_readelf.a',
+        }
+    if host.is_windows and not win_sdk_enabled:
+        result.add('libwinpthread-1.dll')
+    return result
+
+
+@dataclasses.dataclass
+class PackageManifest:
+    """The files of an install that go into a package.
+
+    None means that all files of that kind are included.
+    """
+    # Names of the files in bin/.
+    bin_files: Optional[Set[str]]
+    # Names of the static libraries directly in lib/.
+    static_libs: Optional[Set[str]]
+
+    def includes(self, install_dir: Path, rel_path: Path) -> bool:
+        """Tests whether install_dir/rel_path goes into the package."""
+        parts = rel_path.parts
+        if len(parts) != 2:
+            return True
+        directory, name = parts
+        if directory == 'bin' and self.bin_files is not None:
+            # Directories and broken links in bin/ were always kept.
+            return name in self.bin_files or not (install_dir / rel_path).is_file()
+        if directory == 'lib' and self.static_libs is not None and name.endswith('.a'):
+            return name in self.static_libs
+        return True
+
+    def materialize(self, install_dir: Path, package_dir: Path) -> None:
+        """Creates package_dir with the files of install_dir in the manifest."""
+        linker = _FileLinker()
+        for root, dirs, files in os.walk(install_dir):
+            root_path = Path(root)
+            rel_root = root_path.relative_to(install_dir)
+            dst_root = package_dir / rel_root
+            dst_root.mkdir(parents=True, exist_ok=True)
+            shutil.copystat(root_path, dst_root)
+            for name in list(dirs):
+                src = root_path / name
+                if src.is_symlink():
+                    # os.walk doesn't follow links to directories, copy them as links.
+                    dirs.remove(name)
+                    files.append(name)
+            for name in files:
+                src = root_path / name
+                if not self.includes(install_dir, rel_root / name):
+                    continue
+                dst = dst_root / name
+                if src.is_symlink():
+                    dst.symlink_to(os.readlink(src))
+                else:
+                    linker.link(src, dst)
+        logger().info('Packaged %s: %d files reflinked, %d hardlinked, %d copied',
+                      package_dir, linker.reflinked, linker.hardlinked, linker.copied)
+
+
+class _FileLinker:
+    """Shares a file's data with a new path in the cheapest way that works."""
+
+    # From linux/fs.h.
+    _FICLONE = 0x40049409
+
+    def __init__(self) -> None:
+        self.can_reflink = sys.platform.startswith('linux')
+        self.can_hardlink = True
+        self.reflinked = 0
+        self.hardlinked = 0
+        self.copied = 0
+
+    def _reflink(self, src: Path, dst: Path) -> bool:
+        import fcntl  # pylint: disable=import-outside-toplevel
+        with src.open('rb') as src_file, dst.open('wb') as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), self._FICLONE, src_file.fileno())
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY):
+                    raise
+                return False
+        shutil.copystat(src, dst)
+        return True
+
+    def link(self, src: Path, dst: Path) -> None:
+        if self.can_reflink:
+            if self._reflink(src, dst):
+                self.reflinked += 1
+                return
+            # Not supported by this filesystem, don't try again.
+            self.can_reflink = False
+            dst.unlink()
+        if self.can_hardlink:
+            try:
+                os.link(src, dst)
+                self.hardlinked += 1
+                return
+            except OSError as e:
+                if e.errno in (errno.EXDEV, errno.EPERM):
+                    self.can_hardlink = False
+                elif e.errno != errno.EMLINK:
+                    raise
+        shutil.copy2(src, dst)
+        self.copied += 1
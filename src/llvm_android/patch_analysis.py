@@ -0,0 +1,144 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Checks which entries of PATCHES.json apply to an llvm-project checkout.
+
+Every patch is checked on its own with `git apply --check` dry runs, which only
+read the checkout, so they run concurrently.  Patches that touch the same files
+are then checked in pairs, to find patches that conflict with each other or
+only apply on top of another patch.
+"""
+
+import concurrent.futures
+import dataclasses
+import enum
+import itertools
+import logging
+import os
+from pathlib import Path
+import subprocess
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from llvm_android import source_manager
+from llvm_android.patch_index import PatchIndex
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+class Status(enum.Enum):
+    """Result of checking a patch against the base tree."""
+    APPLIES = 'applies'
+    APPLIES_3WAY = 'applies with a 3-way merge'
+    ALREADY_APPLIED = 'already applied'
+    FAILS = 'fails'
+
+
+@dataclasses.dataclass
+class PatchResult:
+    """Analysis result of one PATCHES.json entry."""
+    rel_patch_path: str
+    title: str
+    status: Status
+    files: Set[str]
+
+
+@dataclasses.dataclass
+class Analysis:
+    """Results of all applicable patches, in PATCHES.json order."""
+    results: List[PatchResult]
+    # (earlier, later) patches that apply alone but not together.
+    conflicts: List[Tuple[str, str]]
+    # (dependency, patch): patch fails alone but applies on top of dependency.
+    dependencies: List[Tuple[str, str]]
+
+    def report(self) -> str:
+        lines = []
+        for status in Status:
+            results = [r for r in self.results if r.status == status]
+            if results:
+                lines.append(f'{len(results)} patches {status.value}:')
+                lines.extend(f'  {r.rel_patch_path}: {r.title}' for r in results)
+        if self.conflicts:
+            lines.append(f'{len(self.conflicts)} conflicting pairs:')
+            lines.extend(f'  {a} <-> {b}' for a, b in self.conflicts)
+        if self.dependencies:
+            lines.append(f'{len(self.dependencies)} patches only apply on top of another:')
+            lines.extend(f'  {b} needs {a}' for a, b in self.dependencies)
+        return '\n'.join(lines)
+
+
+def is_android_patch(entry: Dict[str, Any]) -> bool:
+    """Tests whether a PATCHES.json entry is for Android, like patch_manager.py."""
+    return not entry.get('platforms') or 'android' in entry['platforms']
+
+
+def _git_apply_check(source_dir: Path, patch_files: List[Path], *args: str) -> bool:
+    """Tests whether patch_files apply in sequence, without modifying source_dir."""
+    # `git apply --check` checks separate patch files against the original
+    # tree.  Patches concatenated into one input are checked in sequence.
+    patches = b'\n'.join(patch_file.read_bytes() for patch_file in patch_files)
+    cmd = ['git', 'apply', '--check', *args, '-']
+    return subprocess.run(cmd, cwd=source_dir, input=patches, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL).returncode == 0
+
+
+def check_patch(source_dir: Path, patch_file: Path) -> Status:
+    """Checks one patch against source_dir without modifying it."""
+    if _git_apply_check(source_dir, [patch_file]):
+        return Status.APPLIES
+    if _git_apply_check(source_dir, [patch_file], '--reverse'):
+        return Status.ALREADY_APPLIED
+    if _git_apply_check(source_dir, [patch_file], '--3way'):
+        return Status.APPLIES_3WAY
+    return Status.FAILS
+
+
+def analyze(source_dir: Path, patch_json: Path, svn_version: int,
+            jobs: Optional[int] = None) -> Analysis:
+    """Checks the entries of patch_json that apply to svn_version against source_dir."""
+    patch_dir = patch_json.parent
+    entries = [e for e in PatchIndex.from_json(patch_json).applicable(svn_version)
+               if is_android_patch(e)]
+    logger().info('Checking %d patches applicable to r%d', len(entries), svn_version)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        statuses = list(executor.map(
+            lambda e: check_patch(source_dir, patch_dir / e['rel_patch_path']), entries))
+        results = [
+            PatchResult(e['rel_patch_path'],
+                        e.get('metadata', {}).get('title', e['rel_patch_path']), status,
+                        source_manager.paths_in_patch(patch_dir / e['rel_patch_path']))
+            for e, status in zip(entries, statuses)]
+
+        # Only patches touching the same files can interact.
+        pairs = [(a, b) for a, b in itertools.combinations(results, 2)
+                 if a.files & b.files and a.status == Status.APPLIES and
+                 b.status in (Status.APPLIES, Status.FAILS)]
+        together = list(executor.map(
+            lambda pair: _git_apply_check(source_dir, [patch_dir / pair[0].rel_patch_path,
+                                                       patch_dir / pair[1].rel_patch_path]),
+            pairs))
+
+    conflicts = []
+    dependencies = []
+    for (a, b), ok in zip(pairs, together):
+        if b.status == Status.APPLIES and not ok:
+            conflicts.append((a.rel_patch_path, b.rel_patch_path))
+        elif b.status == Status.FAILS and ok:
+            dependencies.append((a.rel_patch_path, b.rel_patch_path))
+    return Analysis(results, conflicts, dependencies)
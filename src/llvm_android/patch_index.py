@@ -0,0 +1,160 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""An index over PATCHES.json entries, by version range and by cherry-picked SHA.
+
+Entries can be PATCHES.json dicts or objects with `rel_patch_path` and
+`version_range` attributes (cherrypick_cl.PatchItem).  The index keeps
+references to the entries, so updating an entry's version range through
+set_end_version() updates the entry itself.
+"""
+
+import json
+import math
+from pathlib import Path
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# A half-open interval [start, end) of svn revisions and the entry's index.
+_Interval = Tuple[float, float, int]
+
+_CHERRY_PICK = re.compile(r'cherry/([0-9a-f]+?)(?:[-_]v(\d+))?\.patch$')
+
+
+def _rel_patch_path(entry: Any) -> str:
+    return entry['rel_patch_path'] if isinstance(entry, dict) else entry.rel_patch_path
+
+
+def _version_range(entry: Any) -> Dict[str, Optional[int]]:
+    return entry['version_range'] if isinstance(entry, dict) else entry.version_range
+
+
+def parse_cherry_pick(rel_patch_path: str) -> Optional[Tuple[str, int]]:
+    """Returns the SHA and version of a cherry/<sha>[-vN].patch path."""
+    match = _CHERRY_PICK.match(rel_patch_path)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2) or 1)
+
+
+class _IntervalTree:
+    """A centered interval tree for stabbing queries."""
+
+    def __init__(self, intervals: List[_Interval]) -> None:
+        self.left: Optional[_IntervalTree] = None
+        self.right: Optional[_IntervalTree] = None
+        finite = sorted(x for start, end, _ in intervals for x in (start, end) if math.isfinite(x))
+        self.center = finite[(len(finite) - 1) // 2] if finite else 0
+        overlapping = [i for i in intervals if i[0] <= self.center < i[1]]
+        left = [i for i in intervals if i[1] <= self.center]
+        right = [i for i in intervals if i[0] > self.center]
+        if len(left) == len(intervals) or len(right) == len(intervals):
+            # Can't split further (only unbounded intervals), scan them all.
+            self.center = None
+            self.by_start = intervals
+            return
+        self.by_start = sorted(overlapping, key=lambda i: i[0])
+        self.by_end = sorted(overlapping, key=lambda i: i[1], reverse=True)
+        if left:
+            self.left = _IntervalTree(left)
+        if right:
+            self.right = _IntervalTree(right)
+
+    def stab(self, point: int) -> Iterable[int]:
+        """Yields the indices of intervals containing point."""
+        node: Optional[_IntervalTree] = self
+        while node:
+            if node.center is None:
+                yield from (idx for start, end, idx in node.by_start if start <= point < end)
+                return
+            if point < node.center:
+                for start, _, idx in node.by_start:
+                    if start > point:
+                        break
+                    yield idx
+                node = node.left
+            else:
+                for _, end, idx in node.by_end:
+                    if end <= point:
+                        break
+                    yield idx
+                node = node.right if point > node.center else None
+
+
+class PatchIndex:
+    """Answers which patches apply at a revision and which versions of a SHA exist."""
+
+    def __init__(self, entries: Sequence[Any]) -> None:
+        self.entries: List[Any] = []
+        # SHA -> (latest version, index of its entry)
+        self._latest: Dict[str, Tuple[int, int]] = {}
+        self._tree: Optional[_IntervalTree] = None
+        for entry in entries:
+            self.add(entry)
+
+    @classmethod
+    def from_json(cls, patch_json: Path) -> 'PatchIndex':
+        """Builds an index of the dict entries of a PATCHES.json file."""
+        return cls(json.loads(patch_json.read_text()))
+
+    def add(self, entry: Any) -> None:
+        """Adds an entry, e.g. a new cherry-pick."""
+        idx = len(self.entries)
+        self.entries.append(entry)
+        self._tree = None
+        cherry_pick = parse_cherry_pick(_rel_patch_path(entry))
+        if cherry_pick:
+            sha, version = cherry_pick
+            if sha not in self._latest or version > self._latest[sha][0]:
+                self._latest[sha] = (version, idx)
+
+    def _interval_tree(self) -> _IntervalTree:
+        if self._tree is None:
+            intervals = []
+            for idx, entry in enumerate(self.entries):
+                version_range = _version_range(entry)
+                start = version_range.get('from')
+                end = version_range.get('until')
+                start = -math.inf if start is None else start
+                end = math.inf if end is None else end
+                if start < end:
+                    intervals.append((start, end, idx))
+            self._tree = _IntervalTree(intervals)
+        return self._tree
+
+    def applicable(self, svn_version: int) -> List[Any]:
+        """Returns the entries whose version range covers svn_version, in file order."""
+        return [self.entries[idx] for idx in sorted(self._interval_tree().stab(svn_version))]
+
+    def ended_by(self, svn_version: int) -> List[Any]:
+        """Returns the entries that don't apply to svn_version or later revisions."""
+        return [entry for entry in self.entries
+                if _version_range(entry).get('until') is not None and
+                _version_range(entry)['until'] <= svn_version]
+
+    def latest(self, sha: str) -> Optional[Any]:
+        """Returns the entry with the highest version of a cherry-picked SHA."""
+        latest = self._latest.get(sha)
+        return self.entries[latest[1]] if latest else None
+
+    def next_version(self, sha: str) -> int:
+        """Returns the version number for a new cherry-pick of sha."""
+        latest = self._latest.get(sha)
+        return latest[0] + 1 if latest else 1
+
+    def set_end_version(self, entry: Any, svn_version: int) -> None:
+        """Sets the end of an entry's version range."""
+        _version_range(entry)['until'] = svn_version
+        self._tree = None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint: disable=invalid-name
+import json
+import os
+import random
+import sys
+from pathlib import Path
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../.."))
+
+import context
+from llvm_android.patch_index import PatchIndex
+
+
+def entry(rel_patch_path: str, start, end) -> dict:
+    return {'rel_patch_path': rel_patch_path, 'version_range': {'from': start, 'until': end}}
+
+
+def names(entries: list) -> list:
+    return [e['rel_patch_path'] for e in entries]
+
+
+def applicable_test():
+    index = PatchIndex([
+        entry('open_start.patch', None, 100),
+        entry('open_end.patch', 200, None),
+        entry('open.patch', None, None),
+        entry('bounded.patch', 100, 200),
+        entry('empty.patch', 150, 150),
+        entry('reversed.patch', 180, 120),
+    ])
+    assert(names(index.applicable(99)) == ['open_start.patch', 'open.patch'])
+    # 'until' is exclusive and 'from' inclusive.
+    assert(names(index.applicable(100)) == ['open.patch', 'bounded.patch'])
+    assert(names(index.applicable(150)) == ['open.patch', 'bounded.patch'])
+    assert(names(index.applicable(199)) == ['open.patch', 'bounded.patch'])
+    assert(names(index.applicable(200)) == ['open_end.patch', 'open.patch'])
+    assert(names(index.applicable(10**9)) == ['open_end.patch', 'open.patch'])
+
+
+def applicable_random_test():
+    rng = random.Random(0)
+    entries = []
+    for i in range(300):
+        start = rng.choice([None, rng.randrange(1000)])
+        end = rng.choice([None, rng.randrange(1000)])
+        entries.append(entry(f'{i}.patch', start, end))
+    index = PatchIndex(entries)
+    for svn_version in range(-1, 1001):
+        expected = [e for e in entries
+                    if (e['version_range']['from'] is None or
+                        e['version_range']['from'] <= svn_version) and
+                    (e['version_range']['until'] is None or
+                     svn_version < e['version_range']['until'])]
+        assert(index.applicable(svn_version) == expected)
+
+
+def ended_by_test():
+    index = PatchIndex([
+        entry('open_end.patch', 100, None),
+        entry('ends_at_200.patch', 100, 200),
+        entry('ends_at_201.patch', 100, 201),
+        entry('empty.patch', 150, 150),
+        entry('reversed.patch', 300, 120),
+    ])
+    assert(names(index.ended_by(149)) == ['reversed.patch'])
+    assert(names(index.ended_by(199)) == ['empty.patch', 'reversed.patch'])
+    # A patch until 200 doesn't apply at 200.
+    assert(names(index.ended_by(200)) == ['ends_at_200.patch', 'empty.patch', 'reversed.patch'])
+    assert(names(index.ended_by(201)) ==
+           ['ends_at_200.patch', 'ends_at_201.patch', 'empty.patch', 'reversed.patch'])
+    for svn_version in [149, 199, 200, 201]:
+        ended = index.ended_by(svn_version)
+        assert(not [e for e in ended if e in index.applicable(svn_version)])
+
+
+def cherry_pick_test():
+    sha = '0123456789abcdef0123456789abcdef01234567'
+    index = PatchIndex([entry('Other.patch', None, None)])
+    assert(index.latest(sha) is None)
+    assert(index.next_version(sha) == 1)
+
+    first = entry(f'cherry/{sha}.patch', 100, 200)
+    index.add(first)
+    assert(index.latest(sha) is first)
+    assert(index.next_version(sha) == 2)
+
+    # Repeated cherry-picks, in either naming, added out of order.
+    third = entry(f'cherry/{sha}-v3.patch', 300, None)
+    second = entry(f'cherry/{sha}_v2.patch', 200, 300)
+    index.add(third)
+    index.add(second)
+    assert(index.latest(sha) is third)
+    assert(index.next_version(sha) == 4)
+    assert(index.next_version('fedcba9876543210fedcba9876543210fedcba98') == 1)
+
+    # Ending a range through the index updates the entry and later queries.
+    assert(third in index.applicable(400))
+    index.set_end_version(third, 400)
+    assert(third['version_range']['until'] == 400)
+    assert(third not in index.applicable(400))
+    assert(third in index.ended_by(400))
+
+
+def from_json_test(tmp_dir: Path):
+    patch_json = tmp_dir / 'PATCHES.json'
+    patch_json.write_text(json.dumps([entry('a.patch', 100, 200), entry('b.patch', None, 150)]))
+    index = PatchIndex.from_json(patch_json)
+    assert(names(index.applicable(149)) == ['a.patch', 'b.patch'])
+    assert(names(index.ended_by(150)) == ['b.patch'])
+
+
+def patch_index_test(tmp_dir):
+    applicable_test()
+    applicable_random_test()
+    ended_by_test()
+    cherry_pick_test()
+    from_json_test(Path(tmp_dir))
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        patch_index_test(tmp_dir)
@@ -27,8 +27,17 @@ SCRIPTS_DIR: Path = Path(__file__).resolve().parents[2]
 ANDROID_DIR: Path = SCRIPTS_DIR.parents[1]
 OUT_DIR: Path = Path(os.environ.get('OUT_DIR', ANDROID_DIR / 'out')).resolve()
 DIST_DIR = Path(os.environ.get('DIST_DIR', OUT_DIR)).resolve()
+# Caches that outlive OUT_DIR, which is removed by non-incremental builds.
+CACHE_DIR: Path = Path(os.environ.get('LLVM_ANDROID_CACHE_DIR',
+                                      Path.home() / '.cache' / 'llvm_android')).resolve()
+BUILD_CACHE_DIR: Path = CACHE_DIR / 'builds'
+BUILD_HISTORY_DB: Path = CACHE_DIR / 'build_history.sqlite'
+MEMORY_PROFILES: Path = CACHE_DIR / 'memory_profiles.json'
+PATCHED_SOURCES_CACHE_DIR: Path = CACHE_DIR / 'patched_sources'
+PROFILES_CACHE_DIR: Path = CACHE_DIR / 'profiles'
 SYSROOTS: Path = OUT_DIR / 'sysroots'
 LLVM_PATH: Path = OUT_DIR / 'llvm-project'
+UPSTREAM_REVISIONS: Path = OUT_DIR / 'upstream-main.revisions'
 PREBUILTS_DIR: Path = ANDROID_DIR / 'prebuilts'
 EXTERNAL_DIR: Path = ANDROID_DIR / 'external'
 TOOLCHAIN_DIR: Path = ANDROID_DIR / 'toolchain'
@@ -0,0 +1,111 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A cache of extracted PGO and BOLT profile tarballs, outside OUT_DIR.
+
+Each tarball is extracted once into <cache>/<sha256 of the tarball>/, and
+its files are hardlinked into OUT_DIR by later builds.  The cached files are
+made read-only, since they are shared.  The least recently used entries are
+removed when the cache grows beyond max_bytes.
+"""
+
+import logging
+import os
+from pathlib import Path
+import shutil
+import stat
+import tempfile
+
+from llvm_android import fingerprint, paths, utils
+
+DEFAULT_MAX_BYTES = 4 << 30
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+class ProfileCache:
+    """Extracted profile tarballs, keyed by tarball digest."""
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _entry(self, tarball: Path) -> Path:
+        """Returns the cache entry of tarball, extracting it if necessary."""
+        entry = self.root / fingerprint.file_digest(tarball)
+        if entry.is_dir():
+            logger().info('Using cached profiles of %s', tarball)
+        else:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp_dir = Path(tempfile.mkdtemp(dir=self.root, prefix='.tmp-'))
+            try:
+                utils.extract_tarball(tmp_dir, tarball)
+                for path in tmp_dir.rglob('*'):
+                    if path.is_file() and not path.is_symlink():
+                        path.chmod(path.stat().st_mode & ~(stat.S_IWUSR | stat.S_IWGRP |
+                                                           stat.S_IWOTH))
+                tmp_dir.rename(entry)
+            except OSError:
+                # Another build may have added the same entry meanwhile.
+                if not entry.is_dir():
+                    raise
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        # The entry's mtime records when it was last used.
+        os.utime(entry)
+        return entry
+
+    def _evict(self, keep: Path) -> None:
+        entries = sorted((e for e in self.root.iterdir()
+                          if e.is_dir() and not e.name.startswith('.')),
+                         key=lambda e: e.stat().st_mtime, reverse=True)
+        total = 0
+        for entry in entries:
+            total += _dir_size(entry)
+            if total > self.max_bytes and entry != keep:
+                logger().info('Removing %s from the profile cache', entry.name)
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def extract(self, tarball: Path, output_dir: Path) -> None:
+        """Places the files of tarball in output_dir, like extracting it there."""
+        entry = self._entry(tarball)
+        for src in sorted(entry.rglob('*')):
+            dst = output_dir / src.relative_to(entry)
+            if src.is_dir() and not src.is_symlink():
+                dst.mkdir(parents=True, exist_ok=True)
+                continue
+            if dst.is_symlink() or dst.exists():
+                dst.unlink()
+            if src.is_symlink():
+                dst.symlink_to(os.readlink(src))
+                continue
+            try:
+                os.link(src, dst)
+            except OSError:
+                # e.g. the cache is on another filesystem.
+                shutil.copy2(src, dst)
+        self._evict(keep=entry)
+
+
+def extract_profile(tarball: Path, output_dir: Path) -> None:
+    """Extracts a profile tarball into output_dir through the profile cache."""
+    ProfileCache(paths.PROFILES_CACHE_DIR).extract(tarball, output_dir)
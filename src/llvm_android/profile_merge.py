@@ -0,0 +1,216 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Merges many profile files with a pool of merge tool invocations.
+
+tree_reduce() merges files in groups of at most `fan_in`, concurrently, then
+merges the results the same way until one file is left.  Each merge only
+holds one group in memory, so the number of concurrent merges bounds the
+memory used.
+
+IncrementalMerger does the first level of that while profiles are still being
+written: it watches a directory, and once enough files have not been written
+to for a while, merges them into an intermediate profile and deletes them.
+"""
+
+import concurrent.futures
+import fcntl
+import itertools
+import logging
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import Callable, List, Optional
+
+# Merges input files into an output file, e.g. with `llvm-profdata merge`.
+MergeFn = Callable[[List[Path], Path], None]
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+def tree_reduce(inputs: List[Path], output: Path, merge: MergeFn, work_dir: Path,
+                fan_in: int = 16, jobs: Optional[int] = None) -> Path:
+    """Merges inputs into output, fan_in files at a time, in parallel.
+
+    Intermediate files are written to work_dir and deleted once merged.
+    """
+    if not inputs:
+        raise ValueError('No profiles to merge')
+    work_dir.mkdir(parents=True, exist_ok=True)
+    names = itertools.count()
+    level = list(inputs)
+    intermediate = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count(),
+                                               thread_name_prefix='merge') as executor:
+        while len(level) > fan_in:
+            groups = [level[i:i + fan_in] for i in range(0, len(level), fan_in)]
+            outputs = [work_dir / f'reduce-{next(names)}{output.suffix}' for _ in groups]
+            list(executor.map(merge, groups, outputs))
+            if intermediate:
+                for path in level:
+                    path.unlink()
+            level = outputs
+            intermediate = True
+    merge(level, output)
+    if intermediate:
+        for path in level:
+            path.unlink()
+    return output
+
+
+# Lines at the start of a BOLT .fdata file that describe the whole profile.
+_FDATA_HEADERS = ('boltedcollection', 'no_lbr')
+
+
+def sort_fdata(path: Path) -> None:
+    """Sorts the entries of a BOLT .fdata file, keeping its header lines first.
+
+    merge-fdata writes entries in hash table order, which depends on how the
+    profiles were grouped.  Sorting makes a merge's output independent of that.
+    """
+    lines = path.read_text().splitlines(keepends=True)
+    headers = [line for line in lines if line.startswith(_FDATA_HEADERS)]
+    entries = sorted(line for line in lines if not line.startswith(_FDATA_HEADERS))
+    path.write_text(''.join(headers + entries))
+
+
+def _wait_for_writer(path: Path) -> None:
+    """Waits until no process holds a lock on path.
+
+    The profile runtime locks a file in merge mode (%m) while it writes.  A
+    process that opened the file before it was renamed finishes writing
+    before the file is merged.
+    """
+    with path.open('rb') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class IncrementalMerger:
+    """Merges profiles in profiles_dir into intermediate files while they are written.
+
+    A profile is taken once it hasn't been modified for quiet_seconds.  It is
+    first renamed into work_dir, so a later writer of the same file name
+    starts a new file.  If a merge fails, its inputs are left for finish().
+    """
+
+    def __init__(self, profiles_dir: Path, suffix: str, merge: MergeFn, work_dir: Path,
+                 shard_size: int = 256, quiet_seconds: float = 30,
+                 poll_seconds: float = 10, jobs: int = 4) -> None:
+        self.profiles_dir = profiles_dir
+        self.suffix = suffix
+        self.merge = merge
+        self.work_dir = work_dir
+        self.shard_size = shard_size
+        self.quiet_seconds = quiet_seconds
+        self.poll_seconds = poll_seconds
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs,
+                                                              thread_name_prefix='merge')
+        self.futures: List[concurrent.futures.Future] = []
+        self.intermediates: List[Path] = []
+        self.failed: List[Path] = []
+        self.lock = threading.Lock()
+        self.names = itertools.count()
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Starts watching profiles_dir."""
+        self.profiles_dir.mkdir(parents=True, exist_ok=True)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.thread = threading.Thread(target=self._watch, name='profile-watcher', daemon=True)
+        self.thread.start()
+
+    def _settled_profiles(self, quiet_seconds: float) -> List[Path]:
+        now = time.time()
+        result = []
+        for entry in os.scandir(self.profiles_dir):
+            if not entry.name.endswith(self.suffix):
+                continue
+            try:
+                if now - entry.stat().st_mtime >= quiet_seconds:
+                    result.append(Path(entry.path))
+            except FileNotFoundError:
+                pass
+        return sorted(result)
+
+    def _take(self, profiles: List[Path]) -> List[Path]:
+        """Moves profiles out of profiles_dir."""
+        taken = []
+        for profile in profiles:
+            dst = self.work_dir / f'shard-{next(self.names)}{self.suffix}'
+            try:
+                os.rename(profile, dst)
+            except FileNotFoundError:
+                continue
+            _wait_for_writer(dst)
+            taken.append(dst)
+        return taken
+
+    def _merge_shard(self, shard: List[Path]) -> None:
+        output = self.work_dir / f'partial-{next(self.names)}.merged'
+        try:
+            self.merge(shard, output)
+        except Exception as e:  # pylint: disable=broad-except
+            logger().warning('Failed to merge %d profiles, retrying at the end: %s',
+                             len(shard), e)
+            output.unlink(missing_ok=True)
+            with self.lock:
+                self.failed.extend(shard)
+            return
+        for profile in shard:
+            profile.unlink()
+        with self.lock:
+            self.intermediates.append(output)
+
+    def _submit(self, profiles: List[Path]) -> None:
+        taken = self._take(profiles)
+        for i in range(0, len(taken), self.shard_size):
+            self.futures.append(self.executor.submit(self._merge_shard,
+                                                     taken[i:i + self.shard_size]))
+
+    def _watch(self) -> None:
+        while not self.stopping.wait(self.poll_seconds):
+            profiles = self._settled_profiles(self.quiet_seconds)
+            # Wait for a full shard, so intermediates don't end up tiny.
+            full = len(profiles) - len(profiles) % self.shard_size
+            if full:
+                self._submit(profiles[:full])
+
+    def finish(self, output: Path, fan_in: int = 16) -> Path:
+        """Stops watching and merges everything into output.
+
+        Call this once nothing writes profiles anymore.
+        """
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+        for future in self.futures:
+            future.result()
+        self.executor.shutdown()
+        self.profiles_dir.mkdir(parents=True, exist_ok=True)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        remaining = self._take(self._settled_profiles(quiet_seconds=0))
+        logger().info('Merging %d intermediate and %d remaining profiles',
+                      len(self.intermediates), len(remaining) + len(self.failed))
+        tree_reduce(self.intermediates + self.failed + remaining, output, self.merge,
+                    self.work_dir, fan_in)
+        shutil.rmtree(self.work_dir)
+        return output
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint: disable=invalid-name
+import collections
+import fcntl
+import os
+import random
+import sys
+from pathlib import Path
+import subprocess
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../.."))
+
+import context
+from llvm_android import (paths, profile_merge)
+
+MERGE_FDATA = paths.CLANG_PREBUILT_DIR / 'bin' / 'merge-fdata'
+
+FUNCTIONS = ['main', '_ZN4llvm3foo3barEv', '_ZN4llvm3bazEi', 'memcpy', 'qsort']
+
+
+def merge_fdata(inputs: list, output: Path) -> None:
+    subprocess.check_call([str(MERGE_FDATA), '-o', str(output), *map(str, inputs)])
+
+
+def write_fdata_files(fdata_dir: Path, header: str, count: int) -> list:
+    """Writes count .fdata files of random entries, in the format header selects."""
+    rng = random.Random(header)
+    files = []
+    for i in range(count):
+        lines = [header + '\n']
+        for _ in range(rng.randint(5, 40)):
+            src = f'1 {rng.choice(FUNCTIONS)} {rng.randrange(64):x}'
+            if header == 'no_lbr':
+                lines.append(f'{src} {rng.randint(1, 1000)}\n')
+            else:
+                dst = f'1 {rng.choice(FUNCTIONS)} {rng.randrange(64):x}'
+                lines.append(f'{src} {dst} {rng.randint(0, 3)} {rng.randint(1, 1000)}\n')
+        path = fdata_dir / f'{header}-{i}.fdata'
+        path.write_text(''.join(lines))
+        files.append(path)
+    return files
+
+
+def fdata_counts(path: Path) -> dict:
+    """Returns the summed counts of each branch (or sample) in an .fdata file."""
+    counts = collections.Counter()
+    for line in path.read_text().splitlines():
+        if line.startswith(profile_merge._FDATA_HEADERS):
+            continue
+        fields = line.split()
+        counts[' '.join(fields[:-1])] += int(fields[-1])
+    return counts
+
+
+def fdata_tree_reduce_test(tmp_dir: Path):
+    for header in ['boltedcollection', 'no_lbr']:
+        inputs = write_fdata_files(tmp_dir, header, 11)
+
+        single_shot = tmp_dir / f'{header}-single.fdata'
+        merge_fdata(inputs, single_shot)
+        profile_merge.sort_fdata(single_shot)
+
+        reduced = tmp_dir / f'{header}-reduced.fdata'
+        profile_merge.tree_reduce(inputs, reduced, merge_fdata, tmp_dir / f'{header}-work',
+                                  fan_in=3, jobs=2)
+        profile_merge.sort_fdata(reduced)
+
+        assert(reduced.read_bytes() == single_shot.read_bytes())
+        assert(reduced.read_text().startswith(header))
+        expected = collections.Counter()
+        for path in inputs:
+            expected.update(fdata_counts(path))
+        assert(fdata_counts(reduced) == expected)
+
+
+class FakeMerge:
+    """Concatenates profiles, and fails once for inputs containing 'fail'."""
+
+    def __init__(self) -> None:
+        self.calls = []
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def __call__(self, inputs: list, output: Path) -> None:
+        contents = [path.read_text() for path in inputs]
+        with self.lock:
+            self.calls.append(contents)
+            if not self.failed and any('fail' in text for text in contents):
+                self.failed = True
+                raise RuntimeError('merge failed')
+        output.write_text(''.join(contents))
+
+
+def write_profiles(profiles_dir: Path, names: list, settled: bool) -> None:
+    profiles_dir.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        path = profiles_dir / f'{name}.profraw'
+        path.write_text(f'{name}\n')
+        if settled:
+            os.utime(path, (time.time() - 60, time.time() - 60))
+
+
+def wait_for(condition) -> None:
+    deadline = time.time() + 10
+    while not condition():
+        assert(time.time() < deadline)
+        time.sleep(0.01)
+
+
+def incremental_merge_test(tmp_dir: Path):
+    profiles_dir = tmp_dir / 'profiles'
+    merge = FakeMerge()
+    merger = profile_merge.IncrementalMerger(profiles_dir, '.profraw', merge, tmp_dir / 'work',
+                                             shard_size=2, quiet_seconds=30, poll_seconds=0.01)
+    write_profiles(profiles_dir, ['p0', 'p1-fail', 'p2', 'p3'], settled=True)
+    write_profiles(profiles_dir, ['p4'], settled=False)
+    merger.start()
+    wait_for(lambda: len(merge.calls) == 2)
+    time.sleep(0.1)
+
+    # Settled profiles are merged once, in full shards, and the recent one is left.
+    assert(len(merge.calls) == 2)
+    assert(sorted(text for call in merge.calls for text in call) ==
+           ['p0\n', 'p1-fail\n', 'p2\n', 'p3\n'])
+    assert(sorted(os.listdir(profiles_dir)) == ['p4.profraw'])
+    assert(len(merger.intermediates) == 1 and len(merger.failed) == 2)
+
+    # The failed shard is merged again by the final reduction.
+    output = tmp_dir / 'merged.profdata'
+    merger.finish(output, fan_in=2)
+    assert(sorted(output.read_text().splitlines()) == ['p0', 'p1-fail', 'p2', 'p3', 'p4'])
+    assert(not (tmp_dir / 'work').exists())
+    assert(not os.listdir(profiles_dir))
+
+
+def incremental_merge_lock_test(tmp_dir: Path):
+    profiles_dir = tmp_dir / 'profiles'
+    merge = FakeMerge()
+    merger = profile_merge.IncrementalMerger(profiles_dir, '.profraw', merge, tmp_dir / 'work',
+                                             shard_size=2, quiet_seconds=30, poll_seconds=0.01)
+    write_profiles(profiles_dir, ['l0', 'l1'], settled=True)
+    # A writer that opened l0 and holds its lock, like the profile runtime in
+    # merge mode, but hasn't written to it for longer than quiet_seconds.
+    with (profiles_dir / 'l0.profraw').open('a') as writer:
+        fcntl.flock(writer, fcntl.LOCK_EX)
+        merger.start()
+        wait_for(lambda: not (profiles_dir / 'l0.profraw').exists())
+        time.sleep(0.2)
+        assert(not merge.calls)
+        writer.write('l0 done\n')
+        writer.flush()
+        fcntl.flock(writer, fcntl.LOCK_UN)
+    wait_for(lambda: merge.calls)
+    assert(sorted(merge.calls[0]) == ['l0\nl0 done\n', 'l1\n'])
+
+    output = tmp_dir / 'merged.profdata'
+    merger.finish(output)
+    assert(sorted(output.read_text().splitlines()) == ['l0', 'l0 done', 'l1'])
+
+
+def profile_merge_test(tmp_dir):
+    tmp_dir_Path = Path(tmp_dir)
+    for test in [fdata_tree_reduce_test, incremental_merge_test, incremental_merge_lock_test]:
+        test_dir = tmp_dir_Path / test.__name__
+        test_dir.mkdir()
+        test(test_dir)
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        profile_merge_test(tmp_dir)
@@ -17,9 +17,13 @@
 Package to manage LLVM sources when building a toolchain.
 """
 
+import concurrent.futures
+import contextlib
+import filecmp
+import json
 import logging
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 import os
 import re
 import shutil
@@ -27,8 +31,9 @@ import string
 import subprocess
 import sys
 
+from llvm_android.patch_index import PatchIndex
 from llvm_android.toolchain_errors import ToolchainErrorCode, ToolchainError
-from llvm_android import android_version, hosts, paths, utils
+from llvm_android import android_version, build_cache, fingerprint, hosts, paths, utils
 
 
 def logger():
@@ -154,6 +159,219 @@ def get_source_info(source_dir: str, patch_output: str) -> PatchInfo:
 
     return pi
 
+# Bump when the format of the source index changes.
+SOURCE_INDEX_VERSION = 2
+
+
+def _scan_tree(root: Path) -> Dict[str, list]:
+    """Returns [size, mtime_ns] (or ['link', target]) of every file under root.
+
+    Only stats files, so this is much cheaper than reading the tree.
+    """
+    result: Dict[str, list] = {}
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(root / rel_dir) as entries:
+            for entry in entries:
+                rel = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                if entry.is_symlink():
+                    result[rel] = ['link', os.readlink(entry.path)]
+                elif entry.is_dir():
+                    stack.append(rel)
+                else:
+                    stat = entry.stat()
+                    result[rel] = [stat.st_size, stat.st_mtime_ns]
+    return result
+
+
+_PATCH_HEADER = re.compile(r'^(?:diff --git a/(\S+) b/(\S+)|--- (?:a/(\S+)|/dev/null)|'
+                           r'\+\+\+ (?:b/(\S+)|/dev/null)|(?:rename|copy) (?:from|to) (\S+))$')
+# Other lines that start a file header, whether or not _PATCH_HEADER parses them.
+_HEADER_START = re.compile(r'^(?:diff |(?:rename|copy) (?:from|to) |GIT binary patch$)')
+
+
+def _parse_patch(patch_file: Path) -> Tuple[Set[str], bool]:
+    """Returns the paths patch_file touches, and whether all its file headers were parsed."""
+    result: Set[str] = set()
+    parsed = True
+    lines = patch_file.read_text(errors='replace').splitlines()
+    for i, line in enumerate(lines):
+        # A removed line starting with '-- ' looks like a '--- ' header, but
+        # isn't followed by '+++ '.
+        if line.startswith('--- '):
+            is_header = i + 1 < len(lines) and lines[i + 1].startswith('+++ ')
+        elif line.startswith('+++ '):
+            is_header = i > 0 and lines[i - 1].startswith('--- ')
+        else:
+            is_header = bool(_HEADER_START.match(line))
+        if not is_header:
+            continue
+        match = _PATCH_HEADER.match(line)
+        if match:
+            result.update(path for path in match.groups() if path)
+        else:
+            parsed = False
+    return result, parsed
+
+
+def paths_in_patch(patch_file: Path) -> Set[str]:
+    """Returns the paths (relative to llvm-project) that patch_file touches."""
+    return _parse_patch(patch_file)[0]
+
+
+def patched_paths(patch_dir: Path) -> Optional[Set[str]]:
+    """Returns the paths (relative to llvm-project) touched by any patch in patch_dir.
+
+    Returns None if a patch has a file header that can't be parsed, e.g. with
+    quoted paths or a binary patch, as the paths it touches are then unknown.
+    """
+    result: Set[str] = set()
+    for patch_file in patch_dir.rglob('*.patch'):
+        paths, parsed = _parse_patch(patch_file)
+        if not parsed:
+            logger().info(f'Can\'t tell which files {patch_file} touches')
+            return None
+        result.update(paths)
+    return result
+
+
+def _patch_snapshot_key(base_dir: Path, patch_json: Path, patch_dir: Path, svn_version: int,
+                        failure_mode: str) -> str:
+    """Identifies the result of applying the patches in patch_json to base_dir."""
+    patch_files = {}
+    for patch in PatchIndex.from_json(patch_json).applicable(svn_version):
+        patch_file = patch_dir / patch['rel_patch_path']
+        if patch_file.is_file():
+            patch_files[patch['rel_patch_path']] = fingerprint.file_digest(patch_file)
+    return 'patched-sources-' + fingerprint.digest({
+        'base': fingerprint.tree_digest(base_dir),
+        'patch_json': fingerprint.file_digest(patch_json),
+        'patch_files': patch_files,
+        'svn_version': svn_version,
+        'failure_mode': failure_mode,
+    })
+
+
+def _restore_patch_snapshot(key: str, patched_dir: Path) -> Optional[PatchInfo]:
+    """Restores the patched files for key into patched_dir and returns their PatchInfo."""
+    cache = build_cache.BuildCache(paths.PATCHED_SOURCES_CACHE_DIR)
+    metadata = cache.load_metadata(key)
+    if metadata is None or not cache.restore(key, [patched_dir]):
+        return None
+    pi = PatchInfo()
+    pi.applied_patches = metadata['applied_patches']
+    pi.failed_patches = metadata['failed_patches']
+    pi.inapplicable_patches = metadata['inapplicable_patches']
+    logger().info(f'Restored patched sources from {paths.PATCHED_SOURCES_CACHE_DIR}')
+    return pi
+
+
+def _store_patch_snapshot(key: str, patched_dir: Path, pi: PatchInfo) -> None:
+    cache = build_cache.BuildCache(paths.PATCHED_SOURCES_CACHE_DIR)
+    cache.store(key, [patched_dir], metadata={
+        'applied_patches': pi.applied_patches,
+        'failed_patches': pi.failed_patches,
+        'inapplicable_patches': pi.inapplicable_patches,
+    })
+
+
+def _load_source_index(index_path: Path) -> Optional[Dict]:
+    try:
+        index = json.loads(index_path.read_text())
+    except (OSError, ValueError):
+        return None
+    return index if index.get('version') == SOURCE_INDEX_VERSION else None
+
+
+def _write_source_index(index_path: Path, base_files: Dict[str, list], touched: Set[str],
+                        source_files: Dict[str, list]) -> None:
+    index = {
+        'version': SOURCE_INDEX_VERSION,
+        'base': base_files,
+        'patched': sorted(touched),
+        'source': source_files,
+    }
+    tmp_path = index_path.parent / (index_path.name + '.tmp')
+    tmp_path.write_text(json.dumps(index))
+    os.replace(tmp_path, index_path)
+
+
+def _remove_path(path: Path) -> None:
+    if path.is_symlink() or path.is_file():
+        path.unlink()
+    elif path.is_dir():
+        shutil.rmtree(path)
+
+
+def _update_file(src: Path, dst: Path) -> bool:
+    """Copies src to dst unless dst has the same contents.  Returns whether dst changed."""
+    if src.is_symlink():
+        target = os.readlink(src)
+        if dst.is_symlink() and os.readlink(dst) == target:
+            return False
+        _remove_path(dst)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.symlink_to(target)
+        return True
+    if dst.is_file() and not dst.is_symlink() and filecmp.cmp(src, dst, shallow=False):
+        return False
+    _remove_path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    # Copy without timestamps, so that changed files are newer than build outputs.
+    shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+    return True
+
+
+def _sync_incremental(base_dir: Path, patched_dir: Path, source_dir: Path, index: Dict,
+                      base_files: Dict[str, list], touched: Set[str]) -> None:
+    """Updates source_dir to base_dir with the patched files in patched_dir.
+
+    patched_dir only contains the files in touched, which are compared by
+    content.  Other files are only compared if their size or mtime changed
+    since the index was written, in base_dir or in source_dir.  Files in
+    source_dir that are in neither tree are removed, like `rsync --delete`
+    does.
+    """
+    old_base: Dict[str, list] = index['base']
+    old_patched = set(index['patched'])
+    old_source: Dict[str, list] = index['source']
+    source_files = _scan_tree(source_dir)
+    updated = 0
+    removed = 0
+    for rel, stat in base_files.items():
+        if rel in touched:
+            continue
+        # Files edited in source_dir since the last setup are restored.
+        if (old_base.get(rel) == stat and rel not in old_patched and
+                rel in source_files and source_files[rel] == old_source.get(rel)):
+            continue
+        updated += _update_file(base_dir / rel, source_dir / rel)
+
+    for rel in touched:
+        src = patched_dir / rel
+        dst = source_dir / rel
+        if src.exists() or src.is_symlink():
+            updated += _update_file(src, dst)
+        elif dst.exists() or dst.is_symlink():
+            _remove_path(dst)
+            removed += 1
+
+    for rel in source_files.keys() - base_files.keys() - touched:
+        _remove_path(source_dir / rel)
+        removed += 1
+    logger().info(f'Incremental source setup: updated {updated} and removed {removed} files')
+
+
+def _log_patch_analysis(source_dir: Path, patch_json: Path, svn_version: int) -> None:
+    """Logs which patches fail against source_dir, alone or together with another."""
+    # pylint: disable=import-outside-toplevel
+    from llvm_android import patch_analysis  # patch_analysis imports this module.
+    analysis = patch_analysis.analyze(source_dir, patch_json, svn_version)
+    logger().warning('Patch analysis against %s:\n%s', source_dir, analysis.report())
+
+
 def setup_sources(git_am=False, llvm_rev=None, skip_apply_patches=False, continue_on_patch_errors=False) -> Optional[ToolchainError]:
     """Setup toolchain sources into paths.LLVM_PATH.
 
@@ -161,6 +379,12 @@ def setup_sources(git_am=False, llvm_rev=None, skip_apply_patches=False, continu
     Apply patches per the specification in
     toolchain/llvm_android/patches/PATCHES.json.  The function overwrites
     paths.LLVM_PATH only if necessary to avoid recompiles during incremental builds.
+
+    When copying from toolchain/llvm-project, an index of the base tree and
+    the patched files is kept next to paths.LLVM_PATH.  With an index from an
+    earlier setup, only the patched files and files changed in the base tree
+    or in paths.LLVM_PATH are copied and compared.  The full tree is copied
+    if a patch has a file header that can't be parsed.
     """
     # Return the error messages upon failure.
     ret: Optional[ToolchainError] = []
@@ -174,7 +398,43 @@ def setup_sources(git_am=False, llvm_rev=None, skip_apply_patches=False, continu
     if not os.path.exists(tmp_source_parent):
         os.makedirs(tmp_source_parent)
 
-    if not llvm_rev:
+    patch_dir = paths.SCRIPTS_DIR / 'patches'
+    index_path = source_dir.parent / (source_dir.name + '.index.json')
+    use_index = not llvm_rev and not git_am
+    index = _load_source_index(index_path) if use_index and source_dir.exists() else None
+    # source_dir doesn't match the index while it is being updated.
+    index_path.unlink(missing_ok=True)
+    if use_index:
+        copy_from = paths.TOOLCHAIN_LLVM_PATH
+        base_files = _scan_tree(copy_from)
+        touched = patched_paths(patch_dir)
+        # Patches are applied to a tree of only the files they touch, so
+        # these must all be known.
+        if touched is None:
+            use_index = False
+            index = None
+
+    patch_json = patch_dir / 'PATCHES.json'
+    svn_version = android_version.get_svn_revision_number()
+    failure_mode = 'continue' if continue_on_patch_errors else 'fail'
+
+    # With an index, only the patched files are needed, and the result of
+    # patching them may be cached from an earlier setup.
+    snapshot_key = None
+    pi: Optional[PatchInfo] = None
+    if index and not skip_apply_patches:
+        snapshot_key = _patch_snapshot_key(copy_from, patch_json, patch_dir, svn_version,
+                                           failure_mode)
+        pi = _restore_patch_snapshot(snapshot_key, tmp_source_dir)
+
+    if index:
+        if not pi:
+            logger().info(f'Copying patched files from {copy_from}')
+            tmp_source_dir.mkdir()
+            for rel in touched:
+                if rel in base_files:
+                    _update_file(copy_from / rel, tmp_source_dir / rel)
+    elif not llvm_rev:
         # Copy llvm source tree to a temporary directory.
         copy_from = paths.TOOLCHAIN_LLVM_PATH
         logger().info(f'No llvm revision provided, copying from {copy_from}')
@@ -218,22 +478,25 @@ def setup_sources(git_am=False, llvm_rev=None, skip_apply_patches=False, continu
             subprocess.check_call(cmd)
 
     # patch source tree
-    patch_dir = paths.SCRIPTS_DIR / 'patches'
-    patch_json = os.path.join(patch_dir, 'PATCHES.json')
-    svn_version = android_version.get_svn_revision_number()
-
     if not skip_apply_patches:
-      failure_mode = 'continue' if continue_on_patch_errors else 'fail'
-      patch_output = apply_patches(tmp_source_dir, svn_version, patch_json,
-                                   patch_dir, git_am, failure_mode)
-      logger().info(patch_output)
-      pi = get_source_info(tmp_source_dir, patch_output)
+      if not pi:
+        patch_output = apply_patches(tmp_source_dir, svn_version, patch_json,
+                                     patch_dir, git_am, failure_mode)
+        logger().info(patch_output)
+        pi = get_source_info(tmp_source_dir, patch_output)
+        if snapshot_key:
+          _store_patch_snapshot(snapshot_key, tmp_source_dir, pi)
       write_source_info(tmp_source_dir, pi)
       ret = ToolchainError(ToolchainErrorCode.PATCH_ERROR, str(pi.failed_patches))
+      if pi.failed_patches and continue_on_patch_errors and not llvm_rev:
+        _log_patch_analysis(paths.TOOLCHAIN_LLVM_PATH, patch_json, int(svn_version))
 
     # Copy tmp_source_dir to source_dir if they are different.  This avoids
     # invalidating prior build outputs.
-    if not os.path.exists(source_dir):
+    if index:
+        _sync_incremental(copy_from, tmp_source_dir, source_dir, index, base_files, touched)
+        shutil.rmtree(tmp_source_dir, ignore_errors=True)
+    elif not os.path.exists(source_dir):
         os.rename(tmp_source_dir, source_dir)
     else:
         # Without a trailing '/' in $SRC, rsync copies $SRC to
@@ -248,11 +511,53 @@ def setup_sources(git_am=False, llvm_rev=None, skip_apply_patches=False, continu
                                tmp_source_dir_str, source_dir])
 
         shutil.rmtree(tmp_source_dir)
+    if use_index:
+        _write_source_index(index_path, base_files, touched, _scan_tree(source_dir))
     remote, url = try_set_git_remote(source_dir)
     logger().info(f'git remote url: remote: {remote} url: {url}')
     return ret
 
 
+@contextlib.contextmanager
+def git_worktree(repo: Path, path: Path) -> Iterator[Path]:
+    """Checks out HEAD of repo into a detached worktree at path.
+
+    A worktree shares the object store of repo, so it is much cheaper than
+    copying the tree and its .git directory.
+    """
+    if path.exists():
+        utils.check_call(['git', 'worktree', 'remove', '--force', path], cwd=repo)
+    utils.check_call(['git', 'worktree', 'add', '--detach', path, 'HEAD'], cwd=repo)
+    try:
+        yield path
+    finally:
+        utils.check_call(['git', 'worktree', 'remove', '--force', path], cwd=repo)
+
+
+def verify_patches() -> None:
+    """Checks that PATCHES.json applies with both `git am` and `patch`.
+
+    Unlike two calls to setup_sources(), this leaves paths.LLVM_PATH alone and
+    applies the patches to two worktrees of toolchain/llvm-project at once.
+    Raises subprocess.CalledProcessError if patches fail to apply.
+    """
+    patch_dir = paths.SCRIPTS_DIR / 'patches'
+    patch_json = patch_dir / 'PATCHES.json'
+    svn_version = android_version.get_svn_revision_number()
+
+    def verify(git_am: bool) -> None:
+        name = 'git-am' if git_am else 'patch'
+        worktree_dir = paths.OUT_DIR / f'verify-patches-{name}'
+        with git_worktree(paths.TOOLCHAIN_LLVM_PATH, worktree_dir):
+            logger().info('Verifying patches with %s', name)
+            apply_patches(worktree_dir, svn_version, patch_json, patch_dir, git_am, 'fail')
+
+    paths.OUT_DIR.mkdir(parents=True, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        for future in [executor.submit(verify, git_am) for git_am in (True, False)]:
+            future.result()
+
+
 def try_set_git_remote(source_dir):
     AOSP_URL = 'https://android.googlesource.com/toolchain/llvm-project'
 
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint: disable=invalid-name
+import filecmp
+import os
+import sys
+from pathlib import Path
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../.."))
+
+import context
+from llvm_android import (android_version, paths, source_manager, utils)
+
+PATCH = '''From 0000000000000000000000000000000000000000 Mon Sep 17 00:00:00 2001
+Subject: [PATCH] Test patch
+
+---
+diff --git a/llvm/lib/A.cpp b/llvm/lib/A.cpp
+index 1111111..2222222 100644
+--- a/llvm/lib/A.cpp
++++ b/llvm/lib/A.cpp
+@@ -1,3 +1,2 @@
+ int a;
+--- removed line that looks like a header
+ int b;
+diff --git a/llvm/lib/New.cpp b/llvm/lib/New.cpp
+new file mode 100644
+--- /dev/null
++++ b/llvm/lib/New.cpp
+@@ -0,0 +1 @@
++int c;
+diff --git a/llvm/lib/Old.h b/llvm/lib/Renamed.h
+similarity index 100%
+rename from llvm/lib/Old.h
+rename to llvm/lib/Renamed.h
+'''
+
+QUOTED_PATCH = '''diff --git "a/llvm/docs/With Space.md" "b/llvm/docs/With Space.md"
+--- "a/llvm/docs/With Space.md"
++++ "b/llvm/docs/With Space.md"
+@@ -1 +1 @@
+-a
++b
+'''
+
+BINARY_PATCH = '''diff --git a/llvm/test/Inputs/a.bc b/llvm/test/Inputs/a.bc
+new file mode 100644
+index 0000000000000000000000000000000000000000..1111111111111111111111111111111111111111
+GIT binary patch
+literal 4
+LcmZ?wbnpiN00jU9
+
+literal 0
+HcmV?d00001
+
+'''
+
+
+def paths_in_patch_test(tmp_dir: Path):
+    patch_dir = tmp_dir / 'patches'
+    patch_dir.mkdir()
+    (patch_dir / 'test.patch').write_text(PATCH)
+    expected = {'llvm/lib/A.cpp', 'llvm/lib/New.cpp', 'llvm/lib/Old.h', 'llvm/lib/Renamed.h'}
+    assert(source_manager.paths_in_patch(patch_dir / 'test.patch') == expected)
+    assert(source_manager.patched_paths(patch_dir) == expected)
+
+    # The files these touch can't be told, so the full tree is needed.
+    for name, contents in [('quoted.patch', QUOTED_PATCH), ('binary.patch', BINARY_PATCH)]:
+        (patch_dir / name).write_text(contents)
+        assert(source_manager.patched_paths(patch_dir) is None)
+        (patch_dir / name).unlink()
+
+
+def sync_incremental_test(tmp_dir: Path):
+    base_dir = tmp_dir / 'base'
+    patched_dir = tmp_dir / 'patched'
+    source_dir = tmp_dir / 'source'
+    for rel, contents in [('a.txt', 'a'), ('b.txt', 'b'), ('dir/c.txt', 'c')]:
+        (base_dir / rel).parent.mkdir(parents=True, exist_ok=True)
+        (base_dir / rel).write_text(contents)
+    (patched_dir / 'dir').mkdir(parents=True)
+    (patched_dir / 'dir' / 'c.txt').write_text('patched c')
+    touched = {'dir/c.txt'}
+
+    def sync(index):
+        base_files = source_manager._scan_tree(base_dir)
+        source_manager._sync_incremental(base_dir, patched_dir, source_dir, index, base_files,
+                                         touched)
+        return {'version': source_manager.SOURCE_INDEX_VERSION, 'base': base_files,
+                'patched': sorted(touched), 'source': source_manager._scan_tree(source_dir)}
+
+    source_dir.mkdir()
+    index = sync({'base': {}, 'patched': [], 'source': {}})
+    assert((source_dir / 'dir' / 'c.txt').read_text() == 'patched c')
+    unchanged_stat = (source_dir / 'a.txt').stat().st_mtime_ns
+
+    # Edited, half-written and added files in source_dir are all undone.
+    (source_dir / 'b.txt').write_text('edited')
+    (source_dir / 'dir' / 'c.txt').write_text('')
+    (source_dir / 'added.txt').write_text('added')
+    sync(index)
+    assert((source_dir / 'a.txt').stat().st_mtime_ns == unchanged_stat)
+    assert((source_dir / 'b.txt').read_text() == 'b')
+    assert((source_dir / 'dir' / 'c.txt').read_text() == 'patched c')
+    assert(not (source_dir / 'added.txt').exists())
+
+
+def partial_tree_test(tmp_dir: Path):
+    """Checks that patching only the files in patched_paths() is like patching the full tree."""
+    patch_dir = paths.SCRIPTS_DIR / 'patches'
+    patch_json = patch_dir / 'PATCHES.json'
+    svn_version = android_version.get_svn_revision_number()
+    base_dir = paths.TOOLCHAIN_LLVM_PATH
+    touched = source_manager.patched_paths(patch_dir)
+    assert(touched is not None)
+
+    partial_dir = tmp_dir / 'partial'
+    partial_dir.mkdir()
+    for rel in touched:
+        if (base_dir / rel).exists():
+            source_manager._update_file(base_dir / rel, partial_dir / rel)
+    partial_output = source_manager.apply_patches(partial_dir, svn_version, patch_json,
+                                                  patch_dir, False, 'continue')
+    partial_pi = source_manager.get_source_info(partial_dir, partial_output)
+
+    with source_manager.git_worktree(base_dir, tmp_dir / 'full') as full_dir:
+        full_output = source_manager.apply_patches(full_dir, svn_version, patch_json,
+                                                   patch_dir, False, 'continue')
+        full_pi = source_manager.get_source_info(full_dir, full_output)
+        assert(partial_pi.applied_patches == full_pi.applied_patches)
+        assert(partial_pi.failed_patches == full_pi.failed_patches)
+        assert(partial_pi.inapplicable_patches == full_pi.inapplicable_patches)
+
+        # Patches change nothing outside of touched.
+        status = utils.check_output(['git', 'status', '--porcelain', '--untracked-files=all',
+                                     '--no-renames'], cwd=full_dir)
+        changed = {line[3:] for line in status.splitlines()}
+        assert(changed <= touched)
+        for rel in touched:
+            full_file = full_dir / rel
+            partial_file = partial_dir / rel
+            assert(full_file.exists() == partial_file.exists())
+            if full_file.is_file():
+                assert(filecmp.cmp(full_file, partial_file, shallow=False))
+
+
+def source_manager_test(tmp_dir):
+    tmp_dir_Path = Path(tmp_dir)
+    for test in [paths_in_patch_test, sync_incremental_test, partial_tree_test]:
+        test_dir = tmp_dir_Path / test.__name__
+        test_dir.mkdir()
+        test(test_dir)
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_manager_test(tmp_dir)
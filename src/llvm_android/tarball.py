@@ -0,0 +1,359 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Streams tarballs through parallel compressors, hashing them on the way.
+
+The tar stream is written once, in process, and fed to one compressor per
+output (.tar.xz or .tar.zst).  The compressed data is hashed while it is
+written, so no output is read back.  Entries are sorted and their owners are
+cleared, and by default their mtimes are fixed, so the same inputs give the
+same tarball.
+
+A .tar.xz is written as a sequence of independent xz streams, one per
+XZ_BLOCK_SIZE bytes of tar data, compressed in parallel.  xz and tar read it
+like any other .tar.xz.  Next to it, <name>.index.json records where each
+stream and each member is, so a few members can be extracted by decompressing
+only the streams that hold them.
+
+Extraction likewise hashes the tarball while feeding it to tar.
+"""
+
+import bisect
+import collections
+import concurrent.futures
+import fnmatch
+import hashlib
+import io
+import json
+import logging
+import lzma
+import os
+from pathlib import Path
+import subprocess
+import tarfile
+import threading
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+# 1980-01-01, a common fixed timestamp of reproducible builds.
+DETERMINISTIC_MTIME = 315532800
+
+_CHUNK_SIZE = 1 << 20
+
+# The block size of multi-threaded `xz -6`.
+XZ_BLOCK_SIZE = 24 << 20
+# Each xz compressor takes about 100MB of memory.
+_MAX_XZ_THREADS = 32
+
+_XZ_MAGIC = b'\xfd7zXZ\x00'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+class _HashingWriter:
+    """Writes to a file and hashes what was written."""
+
+    def __init__(self, output: Path) -> None:
+        self.output = output
+        self.file: BinaryIO = output.open('wb')
+        self.sha = hashlib.sha256()
+
+    def write(self, data: bytes) -> None:
+        self.sha.update(data)
+        self.file.write(data)
+
+    def close(self) -> str:
+        self.file.close()
+        return self.sha.hexdigest()
+
+
+class _ProcessCompressor:
+    """Compresses with an external tool, e.g. `zstd -T0`."""
+
+    def __init__(self, cmd: List[str], output: Path) -> None:
+        self.writer = _HashingWriter(output)
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._drain, name=f'{cmd[0]}-{output.name}')
+        self.thread.start()
+
+    def _drain(self) -> None:
+        try:
+            while True:
+                data = self.proc.stdout.read(_CHUNK_SIZE)
+                if not data:
+                    break
+                self.writer.write(data)
+        except BaseException as e:  # pylint: disable=broad-except
+            self.error = e
+
+    def write(self, data: bytes) -> None:
+        self.proc.stdin.write(data)
+
+    def close(self) -> str:
+        self.proc.stdin.close()
+        self.thread.join()
+        returncode = self.proc.wait()
+        digest = self.writer.close()
+        if self.error:
+            raise self.error
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.proc.args)
+        return digest
+
+
+class _XzCompressor:
+    """Compresses XZ_BLOCK_SIZE chunks into independent xz streams in parallel."""
+
+    def __init__(self, output: Path) -> None:
+        self.writer = _HashingWriter(output)
+        self.max_workers = min(os.cpu_count(), _MAX_XZ_THREADS)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix='xz')
+        self.pending: collections.deque = collections.deque()
+        self.buffer = bytearray()
+        self.uncompressed_offset = 0
+        self.compressed_offset = 0
+        # (uncompressed offset, compressed offset, compressed size) of each stream.
+        self.streams: List[Tuple[int, int, int]] = []
+
+    def _submit(self) -> None:
+        chunk = bytes(self.buffer[:XZ_BLOCK_SIZE])
+        del self.buffer[:XZ_BLOCK_SIZE]
+        # lzma releases the GIL while compressing.
+        self.pending.append((len(chunk), self.executor.submit(lzma.compress, chunk)))
+
+    def _write_next(self) -> None:
+        size, future = self.pending.popleft()
+        data = future.result()
+        self.streams.append((self.uncompressed_offset, self.compressed_offset, len(data)))
+        self.uncompressed_offset += size
+        self.compressed_offset += len(data)
+        self.writer.write(data)
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+        while len(self.buffer) >= XZ_BLOCK_SIZE:
+            self._submit()
+            # Bound the memory held by compressed chunks waiting to be written.
+            while len(self.pending) > 2 * self.max_workers:
+                self._write_next()
+
+    def close(self) -> str:
+        try:
+            if self.buffer:
+                self._submit()
+            while self.pending:
+                self._write_next()
+        finally:
+            self.executor.shutdown()
+        return self.writer.close()
+
+
+def _compressor(output: Path):
+    name = output.name
+    if name.endswith('.tar.zst'):
+        return _ProcessCompressor(['zstd', '-T0', '-19', '-q', '-c'], output)
+    if name.endswith('.tar.xz'):
+        return _XzCompressor(output)
+    raise ValueError(f'Unsupported tarball type: {output}')
+
+
+class _Tee:
+    """A write-only file object that writes to all compressors."""
+
+    def __init__(self, compressors) -> None:
+        self.compressors = compressors
+
+    def write(self, data: bytes) -> int:
+        for compressor in self.compressors:
+            compressor.write(data)
+        return len(data)
+
+
+def _add_tree(tar: tarfile.TarFile, source_dir: Path, rel_path: str,
+              mtime: Optional[int], members: Dict[str, list]) -> None:
+    """Adds source_dir/rel_path and, for directories, its contents in sorted order.
+
+    Records [start, end, hardlink target] of each member's tar data in members.
+    """
+    path = source_dir / rel_path
+    info = tar.gettarinfo(str(path), arcname=rel_path)
+    info.uid = info.gid = 0
+    info.uname = info.gname = ''
+    if mtime is not None:
+        info.mtime = mtime
+    start = tar.offset
+    if info.isreg():
+        with path.open('rb') as infile:
+            tar.addfile(info, infile)
+    else:
+        tar.addfile(info)
+    members[info.name] = [start, tar.offset, info.linkname if info.islnk() else None]
+    if info.isdir():
+        for name in sorted(os.listdir(path)):
+            _add_tree(tar, source_dir, f'{rel_path}/{name}', mtime, members)
+
+
+def index_path(tarball: Path) -> Path:
+    """Returns the path of the member index of tarball."""
+    return tarball.parent / (tarball.name + '.index.json')
+
+
+def _write_index(output: Path, streams: List[Tuple[int, int, int]],
+                 members: Dict[str, list]) -> None:
+    index = {
+        'size': output.stat().st_size,
+        'streams': streams,
+        'members': members,
+    }
+    index_path(output).write_text(json.dumps(index, sort_keys=True))
+
+
+def create(source_dir: Path, inputs: Sequence[Union[str, Path]], outputs: Sequence[Path],
+           mtime: Optional[int] = DETERMINISTIC_MTIME) -> List[str]:
+    """Creates tarballs of inputs (relative to source_dir) at each of outputs.
+
+    The compression of each output follows its suffix.  With mtime=None, the
+    entries keep their modification times.  Returns the sha256 of each output.
+    """
+    compressors = []
+    members: Dict[str, list] = {}
+    try:
+        for output in outputs:
+            compressors.append(_compressor(Path(output)))
+        with tarfile.open(fileobj=_Tee(compressors), mode='w|',
+                          format=tarfile.GNU_FORMAT) as tar:
+            for rel_path in inputs:
+                _add_tree(tar, Path(source_dir), os.fspath(rel_path), mtime, members)
+    finally:
+        digests = [compressor.close() for compressor in compressors]
+    for output, compressor, digest in zip(outputs, compressors, digests):
+        if isinstance(compressor, _XzCompressor):
+            _write_index(Path(output), compressor.streams, members)
+        logger().info('%s  %s', digest, output)
+    return digests
+
+
+def _load_index(tarball: Path) -> Optional[Dict]:
+    try:
+        index = json.loads(index_path(tarball).read_text())
+    except (OSError, ValueError):
+        return None
+    if index.get('size') != tarball.stat().st_size:
+        logger().warning('Ignoring stale index of %s', tarball)
+        return None
+    return index
+
+
+def _extract_indexed(output_dir: Path, tarball: Path, index: Dict,
+                     patterns: Sequence[str]) -> List[str]:
+    """Extracts the members matching patterns by decompressing only their streams."""
+    members = index['members']
+    selected = {name for name in members if any(fnmatch.fnmatchcase(name, p) for p in patterns)}
+    # Hardlinks need their targets.
+    selected |= {members[name][2] for name in selected if members[name][2]}
+    streams = index['streams']
+    stream_starts = [stream[0] for stream in streams]
+
+    extraction_args = {}
+    if hasattr(tarfile, 'fully_trusted_filter'):
+        extraction_args['filter'] = 'fully_trusted'
+
+    decompressed: Dict[int, bytes] = {}
+    with open(tarball, 'rb') as infile:
+        def read_stream(i: int) -> bytes:
+            if i not in decompressed:
+                _, offset, size = streams[i]
+                infile.seek(offset)
+                decompressed.clear()
+                decompressed[i] = lzma.decompress(infile.read(size))
+            return decompressed[i]
+
+        # In archive order, so that hardlink targets are extracted first.
+        for name in sorted(selected, key=lambda name: members[name][0]):
+            start, end, _ = members[name]
+            first = bisect.bisect_right(stream_starts, start) - 1
+            data = bytearray()
+            for i in range(first, len(streams)):
+                if streams[i][0] >= end:
+                    break
+                data += read_stream(i)
+            data = data[start - streams[first][0]:end - streams[first][0]]
+            with tarfile.open(fileobj=io.BytesIO(bytes(data) + bytes(2 * tarfile.BLOCKSIZE)),
+                              mode='r:') as tar:
+                tar.extractall(output_dir, **extraction_args)
+    return sorted(selected)
+
+
+def extract(output_dir: Path, tarball: Path, args: Sequence[str] = (),
+            patterns: Optional[Sequence[str]] = None) -> Optional[str]:
+    """Extracts tarball into output_dir with tar.  Returns the tarball's sha256.
+
+    With patterns, only the members matching one of them (like tar
+    --wildcards) are extracted.  If tarball has an index and no extra tar
+    args are given, they are extracted without reading the rest of it, and
+    None is returned, since the tarball isn't read in full to hash it.
+    """
+    if patterns:
+        # The index is read in process, and tar options don't apply to it.
+        index = None if args else _load_index(tarball)
+        if index:
+            extracted = _extract_indexed(output_dir, tarball, index, patterns)
+            logger().info('Extracted %d members of %s', len(extracted), tarball)
+            return None
+        args = [*args, '--wildcards', *patterns]
+    sha = hashlib.sha256()
+    env = dict(os.environ)
+    with open(tarball, 'rb') as infile:
+        data = infile.read(_CHUNK_SIZE)
+        if data.startswith(_XZ_MAGIC):
+            env['XZ_OPT'] = '-T0'
+            compression = ['-J']
+        elif data.startswith(_ZSTD_MAGIC):
+            compression = ['--zstd']
+        else:
+            # tar can't detect the compression of a pipe, but it can for a file.
+            infile.close()
+            subprocess.check_call(['tar', '-xC', str(output_dir), '-f', str(tarball), *args],
+                                  env=env)
+            return _file_sha256(tarball)
+        cmd = ['tar', '-xC', str(output_dir), *compression, '-f', '-', *args]
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE, env=env) as proc:
+            try:
+                while data:
+                    sha.update(data)
+                    proc.stdin.write(data)
+                    data = infile.read(_CHUNK_SIZE)
+            finally:
+                proc.stdin.close()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+    digest = sha.hexdigest()
+    logger().info('%s  %s', digest, tarball)
+    return digest
+
+
+def _file_sha256(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for data in iter(lambda: infile.read(_CHUNK_SIZE), b''):
+            sha.update(data)
+    digest = sha.hexdigest()
+    logger().info('%s  %s', digest, path)
+    return digest
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint: disable=invalid-name
+import filecmp
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+import subprocess
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../.."))
+
+import context
+from llvm_android import tarball
+
+# Longer than the 100 bytes of a ustar name field.
+LONG_NAME = 'a_directory_with_a_long_name/' * 4 + 'and_a_file_with_a_long_name_too.txt'
+
+
+def make_tree(source_dir: Path) -> None:
+    root = source_dir / 'toolchain'
+    (root / 'bin').mkdir(parents=True)
+    (root / 'lib').mkdir()
+    (root / 'empty').mkdir()
+    (root / 'bin' / 'clang-19').write_bytes(os.urandom(64 << 10))
+    (root / 'bin' / 'clang-19').chmod(0o755)
+    # clang++ and clang-19 are hardlinks, clang a symlink.
+    os.link(root / 'bin' / 'clang-19', root / 'bin' / 'clang++')
+    (root / 'bin' / 'clang').symlink_to('clang-19')
+    (root / 'lib' / 'libc++.so').write_text('INPUT(-lc++_shared)\n')
+    long_file = root / LONG_NAME
+    long_file.parent.mkdir(parents=True)
+    long_file.write_text('long\n')
+    # A symlink with a long target needs a GNU long link entry.
+    (root / 'lib' / 'long_link').symlink_to('../' + LONG_NAME)
+
+
+def tree_entries(root: Path) -> list:
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            entries.append(os.path.relpath(os.path.join(dirpath, name), root.parent))
+    return sorted(entries)
+
+
+def compare_trees(expected: Path, actual: Path) -> None:
+    assert(tree_entries(expected) == tree_entries(actual))
+    for entry in tree_entries(expected):
+        expected_path = expected.parent / entry
+        actual_path = actual.parent / entry
+        if expected_path.is_symlink():
+            assert(os.readlink(expected_path) == os.readlink(actual_path))
+        elif expected_path.is_file():
+            assert(filecmp.cmp(expected_path, actual_path, shallow=False))
+            assert(expected_path.stat().st_mode == actual_path.stat().st_mode)
+            assert(actual_path.stat().st_mtime == tarball.DETERMINISTIC_MTIME)
+    assert(os.path.samefile(actual / 'bin' / 'clang-19', actual / 'bin' / 'clang++'))
+
+
+def file_sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def round_trip_test(tmp_dir: Path):
+    tmp_dir.mkdir()
+    source_dir = tmp_dir / 'src'
+    make_tree(source_dir)
+    outputs = [tmp_dir / 'toolchain.tar.xz', tmp_dir / 'toolchain.tar.zst']
+    digests = tarball.create(source_dir, ['toolchain'], outputs)
+    assert(digests == [file_sha256(output) for output in outputs])
+
+    # The same inputs give the same tarballs.
+    again = [tmp_dir / 'again.tar.xz', tmp_dir / 'again.tar.zst']
+    assert(tarball.create(source_dir, ['toolchain'], again) == digests)
+
+    expected = sorted(['toolchain'] + tree_entries(source_dir / 'toolchain'))
+    for output, digest in zip(outputs, digests):
+        listing = subprocess.check_output(['tar', '-tf', str(output)], text=True)
+        assert(sorted(line.rstrip('/') for line in listing.splitlines()) == expected)
+
+        output_dir = tmp_dir / (output.name + '.out')
+        output_dir.mkdir()
+        assert(tarball.extract(output_dir, output) == digest)
+        compare_trees(source_dir / 'toolchain', output_dir / 'toolchain')
+
+
+def indexed_extract_test(tmp_dir: Path):
+    tmp_dir.mkdir()
+    source_dir = tmp_dir / 'src'
+    make_tree(source_dir)
+    output = tmp_dir / 'indexed.tar.xz'
+    # Split clang-19 and its neighbours over several xz streams.
+    block_size = tarball.XZ_BLOCK_SIZE
+    tarball.XZ_BLOCK_SIZE = 16 << 10
+    try:
+        digest = tarball.create(source_dir, ['toolchain'], [output])[0]
+    finally:
+        tarball.XZ_BLOCK_SIZE = block_size
+    index = json.loads(tarball.index_path(output).read_text())
+    assert(len(index['streams']) > 4)
+
+    # clang++ sorts first, so clang-19 is archived as a hardlink to it, and
+    # clang++ comes with it.
+    patterns = ['toolchain/bin/clang-19', 'toolchain/lib/*', '*/and_a_file_*']
+    indexed_dir = tmp_dir / 'indexed'
+    indexed_dir.mkdir()
+    assert(tarball.extract(indexed_dir, output, patterns=patterns) is None)
+    tar_dir = tmp_dir / 'tar'
+    tar_dir.mkdir()
+    subprocess.check_call(['tar', '-xJf', str(output), '-C', str(tar_dir), '--wildcards',
+                           *patterns, 'toolchain/bin/clang++'])
+    assert(tree_entries(indexed_dir / 'toolchain') == tree_entries(tar_dir / 'toolchain'))
+    assert(filecmp.cmp(indexed_dir / 'toolchain/bin/clang++',
+                       source_dir / 'toolchain/bin/clang++', shallow=False))
+    assert(os.path.samefile(indexed_dir / 'toolchain/bin/clang-19',
+                            indexed_dir / 'toolchain/bin/clang++'))
+    assert((indexed_dir / 'toolchain' / LONG_NAME).read_text() == 'long\n')
+
+    # Extra tar args make extraction go through tar.
+    args_dir = tmp_dir / 'args'
+    args_dir.mkdir()
+    assert(tarball.extract(args_dir, output, ['--strip-components=1'],
+                           patterns=['toolchain/lib/*']) == digest)
+    assert((args_dir / 'lib' / 'libc++.so').exists())
+
+
+def tarball_test(tmp_dir):
+    round_trip_test(Path(tmp_dir) / 'round_trip')
+    indexed_extract_test(Path(tmp_dir) / 'indexed_extract')
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tarball_test(tmp_dir)
@@ -17,22 +17,102 @@ from time import time
 from datetime import timedelta
 
 import atexit
+import contextlib
+import contextvars
+import itertools
+import json
 import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional
 from llvm_android.build_info import ToolchainBuild
 
+
+class Span:
+    """A traced interval of the build, nested in the span active when it started."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str, category: str, args: Optional[Dict[str, Any]] = None) -> None:
+        self.id = next(self._ids)
+        self.name = name
+        self.category = category
+        self.args = dict(args or {})
+        self.parent = _CURRENT_SPAN.get()
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.start = time()
+        self.end: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time()) - self.start
+
+    def trace_event(self, origin: float) -> Dict[str, Any]:
+        """Returns a Chrome trace 'complete' event for this span."""
+        args = dict(self.args, span_id=self.id)
+        if self.parent:
+            args['parent_id'] = self.parent.id
+        return {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': int((self.start - origin) * 1e6),
+            'dur': int(self.duration * 1e6),
+            'pid': self.pid,
+            'tid': self.tid,
+            'args': args,
+        }
+
+
+# The innermost active span.  Thread pools that run build steps copy the
+# submitting context, so spans in worker threads keep their parent.
+_CURRENT_SPAN: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    'current_span', default=None)
+
+
+@contextlib.contextmanager
+def trace(name: str, category: str = 'step', **args) -> Iterator[Span]:
+    """Records a span for the duration of the context."""
+    span = Span(name, category, args)
+    token = _CURRENT_SPAN.set(span)
+    try:
+        yield span
+    finally:
+        span.end = time()
+        _CURRENT_SPAN.reset(token)
+        with Timer.lock:
+            Timer.spans.append(span)
+
+
 class Timer:
     times = {}
+    # Jobserver slot usage, sampled by jobserver.JobServer.
+    jobserver_usage: Dict[str, float] = {}
+    # Finished spans, in the order they ended.
+    spans: List[Span] = []
+    lock = threading.Lock()
     def __init__(self, descr):
         self.descr = descr
 
     def __enter__(self):
-        self.start = time()
+        self._trace = trace(self.descr)
+        self.span = self._trace.__enter__()
 
     def __exit__(self, t, value, traceback):
-        end = time()
-        build_time = end - self.start
-        type(self).times[self.descr] = build_time
-        ToolchainBuild.BuildTime.append({"step": self.descr, "time": round(build_time, 2)})
+        self._trace.__exit__(t, value, traceback)
+        build_time = self.span.duration
+        with type(self).lock:
+            type(self).times[self.descr] = build_time
+            ToolchainBuild.BuildTime.append({"step": self.descr, "time": round(build_time, 2),
+                                             "parent": self._parent_step()})
+
+    def _parent_step(self) -> Optional[str]:
+        """The enclosing step, so that consumers don't count nested steps twice."""
+        parent = self.span.parent
+        while parent and parent.category != 'step':
+            parent = parent.parent
+        return parent.name if parent else None
 
     @classmethod
     def report(cls):
@@ -44,6 +124,10 @@ class Timer:
         result = sorted(cls.times.items(), key=lambda item: item[1], reverse=True)
         report = report + '\n'.join(f'{pretty_print(t)} {d}' for d, t in result)
 
+        if cls.jobserver_usage:
+            report += '\n\nJobserver:\n'
+            report += '\n'.join(f'{n} {d}' for d, n in cls.jobserver_usage.items())
+
         return report
 
     @classmethod
@@ -55,3 +139,30 @@ class Timer:
     def register_atexit(cls, outfile):
         """Register report_to_file(outfile) to run at exit."""
         atexit.register(cls.report_to_file, outfile)
+
+    @classmethod
+    def trace_events(cls) -> Dict[str, Any]:
+        """Returns all spans in the Chrome trace event format (Perfetto can load it too)."""
+        with cls.lock:
+            spans = list(cls.spans)
+        if not spans:
+            return {'traceEvents': [], 'displayTimeUnit': 'ms'}
+        origin = min(span.start for span in spans)
+        events = []
+        threads = {(span.pid, span.tid): span.thread_name for span in spans}
+        for (pid, tid), name in sorted(threads.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': name}})
+        events.extend(span.trace_event(origin)
+                      for span in sorted(spans, key=lambda span: (span.start, span.id)))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    @classmethod
+    def trace_to_file(cls, outfile):
+        with open(outfile, 'w') as out:
+            json.dump(cls.trace_events(), out)
+
+    @classmethod
+    def register_trace_atexit(cls, outfile):
+        """Register trace_to_file(outfile) to run at exit."""
+        atexit.register(cls.trace_to_file, outfile)
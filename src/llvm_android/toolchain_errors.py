@@ -16,7 +16,7 @@
 """Report toolchain build errors"""
 
 from enum import Enum, auto
-from typing import List
+from typing import Any, Dict, List, Optional
 
 class ToolchainErrorCode(Enum):
     UNKNOWN_ERROR = auto()
@@ -37,5 +37,14 @@ class ToolchainError:
     def __repr__(self):
         return repr(self.code.name + ':' + self.msg)
 
+def error_to_json(err: Optional[ToolchainError]) -> Optional[Dict[str, str]]:
+    return {'code': err.code.name, 'msg': err.msg} if err else None
+
+def error_from_json(data: Optional[Dict[str, Any]]) -> Optional[ToolchainError]:
+    return ToolchainError(ToolchainErrorCode[data['code']], data['msg']) if data else None
+
+# journal.run_step result_codec for steps that return an Optional[ToolchainError].
+ERROR_CODEC = (error_to_json, error_from_json)
+
 def combine_toolchain_errors(errs: List[ToolchainError]) -> str:
     return ',\n'.join(map(str, errs))
@@ -0,0 +1,100 @@
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A persistent mapping between upstream-main SHAs and LLVM revision numbers.
+
+Since the git migration, the revision of an upstream-main commit is the
+revision of the migration base plus the number of first-parent commits from
+the base to that commit (see git_llvm_rev.py).  The index file lists the
+first-parent SHAs from the base on, one per line, so line N holds the SHA of
+revision base + N.  New upstream commits are appended to it.
+"""
+
+import logging
+from pathlib import Path
+import subprocess
+from typing import Dict, List, Optional
+
+
+def logger():
+    """Returns the module level logger."""
+    return logging.getLogger(__name__)
+
+
+class RevisionIndex:
+    """SHA <-> revision lookups for the first-parent history of a branch."""
+
+    def __init__(self, path: Path, repo: Path, base_sha: str, base_revision: int) -> None:
+        self.path = path
+        self.repo = repo
+        self.base_sha = base_sha
+        self.base_revision = base_revision
+        self._shas: List[str] = []
+        self._revisions: Dict[str, int] = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            lines = self.path.read_text().split()
+        except OSError:
+            lines = []
+        if not lines or lines[0] != self.base_sha:
+            lines = [self.base_sha]
+        self._load_shas(lines)
+
+    def _load_shas(self, shas: List[str]) -> None:
+        self._shas = shas
+        self._revisions = {sha: self.base_revision + i for i, sha in enumerate(shas)}
+
+    def update(self, ref: str) -> None:
+        """Indexes the first-parent commits of ref that aren't indexed yet."""
+        tip = self._shas[-1]
+        rewrite = not self.path.exists()
+        if subprocess.run(['git', 'merge-base', '--is-ancestor', tip, ref],
+                          cwd=self.repo, check=False).returncode != 0:
+            # The indexed history was rewritten.  Start over from the base.
+            logger().warning('%s is not an ancestor of %s, rebuilding %s', tip, ref, self.path)
+            self._load_shas([self.base_sha])
+            tip = self.base_sha
+            rewrite = True
+        new_shas = subprocess.check_output(
+            ['git', 'rev-list', '--reverse', '--first-parent', f'{tip}..{ref}'],
+            cwd=self.repo, text=True).split()
+        for sha in new_shas:
+            self._revisions[sha] = self.base_revision + len(self._shas)
+            self._shas.append(sha)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if rewrite:
+            self.path.write_text(''.join(sha + '\n' for sha in self._shas))
+        elif new_shas:
+            with self.path.open('a') as outfile:
+                outfile.write(''.join(sha + '\n' for sha in new_shas))
+        if new_shas:
+            logger().info('Indexed upstream revisions up to r%d', self.tip_revision)
+
+    @property
+    def tip_revision(self) -> int:
+        return self.base_revision + len(self._shas) - 1
+
+    def revision(self, sha: str) -> Optional[int]:
+        """Returns the revision of sha, None if it isn't indexed."""
+        return self._revisions.get(sha)
+
+    def sha(self, revision: int) -> Optional[str]:
+        """Returns the SHA of revision, None if it isn't indexed."""
+        if self.base_revision <= revision <= self.tip_revision:
+            return self._shas[revision - self.base_revision]
+        return None
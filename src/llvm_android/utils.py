@@ -26,7 +26,7 @@ import subprocess
 import sys
 from typing import Dict, List
 
-from llvm_android import constants, paths
+from llvm_android import constants, paths, tarball, timer
 
 ORIG_ENV = dict(os.environ)
 
@@ -35,6 +35,13 @@ def logger():
     return logging.getLogger(__name__)
 
 
+def _trace_subprocess(cmd, kwargs):
+    """Returns a trace span context for running cmd."""
+    cmdline = cmd if isinstance(cmd, str) else list2cmdline(cmd)
+    name = os.path.basename(cmd.split()[0] if isinstance(cmd, str) else str(cmd[0]))
+    return timer.trace(name, 'subprocess', cmd=cmdline, cwd=str(kwargs.get('cwd') or os.getcwd()))
+
+
 def subprocess_run(cmd, *args, **kwargs):
     """subprocess.run with logging."""
     logger().debug('subprocess.run:%s %s',
@@ -42,7 +49,38 @@ def subprocess_run(cmd, *args, **kwargs):
                   cmd if isinstance(cmd, str) else list2cmdline(cmd))
     if kwargs.pop('dry_run', None):
         return None
-    return subprocess.run(cmd, *args, **kwargs, text=True)
+    with _trace_subprocess(cmd, kwargs) as span:
+        try:
+            result = subprocess.run(cmd, *args, **kwargs, text=True)
+        except subprocess.CalledProcessError as e:
+            span.args['returncode'] = e.returncode
+            raise
+        span.args['returncode'] = result.returncode
+    return result
+
+
+def check_call_peak_rss(cmd, *args, **kwargs) -> int:
+    """subprocess.check_call with logging.
+
+    Returns the peak resident memory in bytes of the largest process that cmd
+    ran, including cmd itself.
+    """
+    logger().debug('subprocess.run:%s %s',
+                  datetime.datetime.now().strftime("%H:%M:%S"),
+                  cmd if isinstance(cmd, str) else list2cmdline(cmd))
+    with _trace_subprocess(cmd, kwargs) as span:
+        with subprocess.Popen(cmd, *args, **kwargs) as proc:
+            # Unlike Popen.wait, wait4 reports resource usage, which includes
+            # the waited-for descendants of the child.
+            _, status, rusage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        span.args['returncode'] = proc.returncode
+        # ru_maxrss is in KiB on Linux and in bytes on Darwin.
+        peak_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        span.args['peak_rss'] = peak_rss
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return peak_rss
 
 
 def unchecked_call(cmd, *args, **kwargs):
@@ -60,24 +98,27 @@ def check_output(cmd, *args, **kwargs):
     return subprocess_run(cmd, *args, **kwargs, check=True, stdout=subprocess.PIPE).stdout
 
 
-def create_tarball(source_dir, input, output):
-    xz_env = os.environ.copy()
-    xz_env["XZ_OPT"] = "-T0"
-    check_call([
-        'tar', '-cJC', str(source_dir),
-        '-f', str(output),
-        *map(str, input)
-    ], env=xz_env)
-    # print sha of tarball for debugging
-    check_call(['shasum', str(output)])
-
-
-def extract_tarball(output_dir, input, args=[]):
-    xz_env = os.environ.copy()
-    xz_env["XZ_OPT"] = "-T0"
-    # print sha of tarball for debugging
-    check_call(['shasum', str(input)])
-    check_call(['tar', '-xC', str(output_dir), '-f', str(input)] + args, env=xz_env)
+def create_tarball(source_dir, input, output, extra_outputs=(), deterministic=True):
+    """Creates a tarball of input (paths relative to source_dir) at output.
+
+    extra_outputs are written from the same tar stream, e.g. a .tar.zst next
+    to a .tar.xz.  Without deterministic, entries keep their mtimes.
+    Returns the sha256 of output.
+    """
+    outputs = [Path(output), *map(Path, extra_outputs)]
+    mtime = tarball.DETERMINISTIC_MTIME if deterministic else None
+    return tarball.create(Path(source_dir), input, outputs, mtime)[0]
+
+
+def extract_tarball(output_dir, input, args=[], patterns=None):
+    """Extracts a tarball into output_dir.
+
+    With patterns, only extracts the members matching one of them, like tar
+    --wildcards.  Tarballs with a member index are then read only where
+    those members are, unless args are given.  Returns the sha256 of input,
+    or None if it was read through its index.
+    """
+    return tarball.extract(Path(output_dir), Path(input), args, patterns)
 
 
 def is_available_mac_ver(ver: str) -> bool:
@@ -23,6 +23,7 @@ import sys
 
 import context
 from llvm_android import android_version, hosts, paths, utils, source_manager
+from llvm_android.patch_index import PatchIndex
 
 _LLVM_ANDROID_PATH = paths.SCRIPTS_DIR
 _PATCH_DIR = _LLVM_ANDROID_PATH / 'patches'
@@ -61,10 +62,14 @@ def get_removed_patches(output):
 
 def trim_patches_json():
     """Invoke patch_manager.py with failure_mode=remove_patches."""
+    if not PatchIndex.from_json(_PATCH_JSON).ended_by(int(_SVN_REVISION)):
+        # Nothing to remove, don't bother applying all patches.
+        return None
     source_dir = paths.TOOLCHAIN_LLVM_PATH
     output = source_manager.apply_patches(source_dir, _SVN_REVISION,
                                           _PATCH_JSON, _PATCH_DIR,
-                                          'remove_patches')
+                                          git_am=False,
+                                          failure_mode='remove_patches')
     return get_removed_patches(output)
 
 
@@ -103,11 +103,14 @@ class ArgParser(argparse.ArgumentParser):
             help='Extra hashtags (comma separated) during \'repo upload\'')
 
 
-def fetch_artifact(branch, target, build, pattern):
+def fetch_artifact(branch, target, build, pattern, required=True):
     fetch_artifact_path = '/google/data/ro/projects/android/fetch_artifact'
     cmd = [fetch_artifact_path, f'--branch={branch}',
            f'--target={target}', f'--bid={build}', pattern]
-    utils.check_call(cmd)
+    if required:
+        utils.check_call(cmd)
+    else:
+        utils.unchecked_call(cmd)
 
 
 def extract_clang_info(clang_dir):
@@ -232,8 +235,7 @@ def update_clang(host, build_number, use_current_branch, download_dir, bug,
         musl_package = f'{download_dir}/clang-{build_number}-linux_musl-x86.tar.xz'
         if os.path.exists(extract_subdir):
             shutil.rmtree(extract_subdir)
-        utils.extract_tarball(prebuilt_dir, musl_package, [
-            "--wildcards",
+        utils.extract_tarball(prebuilt_dir, musl_package, patterns=[
             "*/lib/libclang.so*",
             "*/lib/*/libc++.so*",
             "*/lib/libc_musl.so",
@@ -390,6 +392,12 @@ def main():
                 os.rename(f'{download_dir}/{build_info}', f'{download_dir}/{build_info}-{host}')
             for target in targets:
                 fetch_artifact(branch, target, args.build, clang_pattern)
+            if 'linux_musl' in targets:
+                # Only a few libraries are extracted from the musl package.
+                # Its member index lets them be extracted without
+                # decompressing the whole package.  Older builds don't have one.
+                fetch_artifact(branch, 'linux_musl', args.build, clang_pattern + '.index.json',
+                               required=False)
 
             if not args.skip_update_profiles and 'linux-x86' in hosts:
                 fetch_artifact(branch, 'linux', args.build, PGO_PROFILE_PATTERN)